@@ -31,62 +31,75 @@ mkdir -p $BUILDRST
 [[ -L $BUILDDIR/rst ]] || [[ -f $BUILDDIR/rst ]] || ln -sf ../rst $BUILDDIR/
 
 BUILDHTML=./_build/html/
+# Worker processes for the parallel stages (default: one per CPU)
+JOBS=${JOBS:-$( nproc )}
+
+# Incremental conversion: pages whose inputs are unchanged since the last
+# run are skipped.  Run with FORCE=--force to convert everything again.
+CACHE=$TMPDIR/convcache.json
+FORCE=${FORCE:-}
+
+# TRACE=<file> writes a JSON line per page and per stage of every step to
+# <file>, summarized at the end (see buildtrace.py).
+TRACE=${TRACE:-}
+TRACEOPT=${TRACE:+--trace $TRACE}
+[[ -z "$TRACE" ]] || cat /dev/null > $TRACE
+
 MANDIRS="ompi/mpi/man ompi/mpiext ompi/tools oshmem/shmem/man opal/tools/wrappers oshmem/tools/oshmem_info "
 
+# UPDATED_SINCE=<date> (or a revision range, e.g. v5.0.0..HEAD) converts
+# only the sources changed in git since then, and the pages including them
+# (see get_updated_man.py).
+ONLY=
+if [[ -n "$UPDATED_SINCE" ]] ; then
+    UPDATED=$TMPDIR/updated.txt
+    if [[ "$UPDATED_SINCE" == *..* ]] ; then
+        python3 $APPDIR/get_updated_man.py --output $UPDATED $UPDATED_SINCE || exit 1
+    else
+        python3 $APPDIR/get_updated_man.py --output $UPDATED --since $UPDATED_SINCE || exit 1
+    fi
+    ONLY="--only $UPDATED"
+fi
+
 TSTMAN_ORIG=$TMPDIR/tmpman_orig/
 TSTMAN_NEW=$TMPDIR/tmpman_new/
 TSTMAN_DIFF=$TMPDIR/tmpman_diff/
-TSTMAN_TEXT_DIFF=$TMPDIR/tmpman_text_diff/
 
 mkdir -p $BUILDMAN
 BUILDRST=$(cd $BUILDRST ; pwd -P )
-[[ -f $BUILDRST/conf.py ]] || cp $APPDIR/conf.py $BUILDRST/
+# conf.py is replaced when it differs, so a tree made by an earlier
+# version takes its man_pages from manpages.py too
+cmp -s $APPDIR/conf.py $BUILDRST/conf.py || cp $APPDIR/conf.py $BUILDRST/
 [[ -f $BUILDRST/index.rst ]] || cp $APPDIR/index.rst $BUILDRST/
+# conf.py takes man_pages from it
+cp $APPDIR/manpages.py $BUILDRST/
+
+# PIPELINE=1 runs the conversion stages below as one pipeline instead,
+# moving each page on as soon as it is converted and reporting per-stage
+# timings (see pipeline.py; STAGES=man2rst,fixup,... picks the stages).
+if [[ -n "$PIPELINE" ]] ; then
+    exec python3 $APPDIR/pipeline.py --jobs $JOBS --tmpdir $TMPDIR \
+        --builddir $BUILDDIR --rst $BUILDRST ${STAGES:+--stages $STAGES} \
+        $FORCE $ONLY $TRACEOPT $MANDIRS
+fi
 
 # For each man page, if the man page includes another,
-# convert nroff ".so" command to rst ".. include::"
+# convert nroff ".so" command to rst ".. include::",
+# else if it only uses the common man macros, convert it in python,
 # else use pandoc to convert the man page to rst.
 if [[ 1 -eq 1 ]] ; then
     echo "About to convert man to rst"
     SAVEME=$( pwd )
-    ERRORFILE=pandoc_man2rst.output
-    cat /dev/null > $ERRORFILE
-    for d in $MANDIRS ; do
-        for f in $( find $d -name \*.\*in ) ; do
-            f2=$( echo $f | sed -e "s/\.\([0-9]*\)in/.\1/" )
-            out=$TMPRST/${f2}.rst
-            # add labels for files that originally included this file
-            if [[ $( grep -w '^\.so' $f | wc -l ) -eq 1 ]] ; then
-                out=$BUILDRST/${f2}.rst
-                echo "converting $f to $out" >> $ERRORFILE
-                mkdir -p $( dirname $out )
-                fname=$( grep -w '^\.so' $f | awk '{printf"%s.rst",$2}' )
-                [[ -z "${fname}" ]] && echo "WARNING: ERROR: See $fname"
-                pname=$( basename $out | awk -F\. '{print $1}' )
-                pnamelower=$( echo $pname | tr 'A-Z' 'a-z')
-                delim=$( echo $pname | sed -e "s/[a-z,A-Z,0-9,_,\-]/=/g" )
-                echo ".. _${pnamelower}:" > $out
-                echo " " >> $out
-                echo $pname >> $out
-                echo $delim >> $out
-                echo "    .. include_body" >> $out
-                echo "" >> $out
-                echo ".. include:: ../${fname}" >> $out
-                echo "    :start-after: .. include_body" >> $out
-                echo "" >> $out
-            else
-                mkdir -p $( dirname $out )
-                echo "converting $f to $out" >> $ERRORFILE
-                cd $( dirname $f )
-                f2=$( basename $f)
-                pandoc -f man -t rst $f2 1> $out 2>> $ERRORFILE
-                cd $SAVEME
-            fi
-        done
-    done
+    # one JSON line per page, see pandoc_stage.py
+    ERRORFILE=pandoc_man2rst.json
+    PAIRS=$TMPDIR/man2rst.pairs
+    # Writes the .so stubs and the simple pages, lists the rest in $PAIRS
+    python3 $APPDIR/man2rst.py --rst $BUILDRST --tmprst $TMPRST \
+        --pairs $PAIRS --log man2rst.output --cache $CACHE $ONLY $TRACEOPT $MANDIRS
 
-    # Check for warning messages
-    echo "WARNING messages from $ERRORFILE:" $( grep WARNING $ERRORFILE | wc -l )
+    # Only run pandoc on pages that changed since the last run
+    python3 $APPDIR/pandoc_stage.py --from man --jobs $JOBS --log $ERRORFILE \
+        --cache $CACHE --stage man2rst $FORCE $TRACEOPT $PAIRS
 fi
 
 # For each man md page
@@ -94,40 +107,37 @@ fi
 if [[ 1 -eq 1 ]] ; then
     echo "About to convert md to rst"
     SAVEME=$( pwd )
-    ERRORFILE=pandoc_md2rst.output
-    cat /dev/null > $ERRORFILE
+    # one JSON line per page, see pandoc_stage.py
+    ERRORFILE=pandoc_md2rst.json
+    PAIRS=$TMPDIR/md2rst.pairs
+    cat /dev/null > $PAIRS
     for d in $MANDIRS ; do
         for f in $( find $d -name \*.md ) ; do
+            [[ -z "$ONLY" ]] || grep -qxF "$f" $UPDATED || continue
             f2=$( echo $f | sed -e "s/\.\([0-9]*\).md/.\1/" )
-            out=$MDTMPRST/${f2}.rst
-            mkdir -p $( dirname $out )
-            echo "converting $f to $out"
-            echo "converting $f to $out" >> $ERRORFILE
-            cd $( dirname $f )
-            f2=$( basename $f)
-            pandoc -f gfm -t rst $f2 1> $out 2>> $ERRORFILE
-            cd $SAVEME
+            echo "$f $MDTMPRST/${f2}.rst" >> $PAIRS
         done
     done
 
-    # Check for warning messages
-    echo "WARNING messages from $ERRORFILE:" $( grep WARNING $ERRORFILE | wc -l )
+    # Only run pandoc on pages that changed since the last run
+    python3 $APPDIR/pandoc_stage.py --from gfm --jobs $JOBS --log $ERRORFILE \
+        --cache $CACHE --stage md2rst $FORCE $TRACEOPT $PAIRS
 fi
 
 # fix up rst files
+# All pages are fixed by one fixup_rst.py process, driven by a manifest
 SAVEME=$( pwd )
 if [[ 1 -eq 1 ]] ; then
     echo "About to fix up rst"
     date
+    MANIFEST=$TMPDIR/fixup_rst.manifest
+    cat /dev/null > $MANIFEST
     for d in $MANDIRS ; do
         for f in $( cd $TMPRST/$d; find . -name \*.rst ) ; do
-            infile="$TMPRST/$d/$f"
-            out="$BUILDRST/$d/$f"
-            mkdir -p $( dirname $out )
-            echo "Fixing $infile as $out"
-            python3 $APPDIR/fixup_rst.py $infile $out
+            echo "$TMPRST/$d/$f $BUILDRST/$d/$f" >> $MANIFEST
         done
     done
+    python3 $APPDIR/fixup_rst.py --jobs $JOBS --cache $CACHE $FORCE $TRACEOPT --manifest $MANIFEST
     date
 fi
 
@@ -136,136 +146,101 @@ SAVEME=$( pwd )
 if [[ 1 -eq 1 ]] ; then
     echo "About to fix up rst generated from md files"
     date
+    MANIFEST=$TMPDIR/fix_md_rst.manifest
+    cat /dev/null > $MANIFEST
     for d in $MANDIRS ; do
         if [[ -d $MDTMPRST/$d ]]; then
             for f in $( cd $MDTMPRST/$d; find . -name \*.rst ) ; do
-                infile="$MDTMPRST/$d/$f"
-                out="$BUILDRST/$d/$f"
-                mkdir -p $( dirname $out )
-                echo "MD: Fixing $infile as $out"
-                python3 $APPDIR/fix_md_rst.py $infile $out
+                echo "$MDTMPRST/$d/$f $BUILDRST/$d/$f" >> $MANIFEST
             done
         fi
     done
+    python3 $APPDIR/fix_md_rst.py --jobs $JOBS --cache $CACHE $FORCE $TRACEOPT --manifest $MANIFEST
     date
 fi
 
 # ARGH. Tables are hard.
+# Only replaced when it changed, so sphinx does not read it again.
 if [[ 1 -eq 1 ]] ; then
-    cp $APPDIR/Open-MPI.5.rst $BUILDRST/ompi/mpi/man/man5/Open-MPI.5.rst
+    OPENMPI5=$BUILDRST/ompi/mpi/man/man5/Open-MPI.5.rst
+    if ! cmp -s $APPDIR/Open-MPI.5.rst $OPENMPI5 ; then
+        cp $APPDIR/Open-MPI.5.rst $OPENMPI5.tmp && mv $OPENMPI5.tmp $OPENMPI5
+        echo "Open-MPI.5.rst changed"
+    fi
+fi
+
+# quick check, without rendering: compare the sections, parameter names,
+# code blocks and see-also targets of each rst page with its nroff source
+if [[ 0 -eq 1 ]] ; then
+    python3 $APPDIR/fingerprint.py --jobs $JOBS --rst $BUILDRST \
+        --report $TMPDIR/fingerprint.json $TRACEOPT $MANDIRS
+fi
+
+# quick check, without sphinx: :ref: targets, duplicate labels, includes
+# (.so stubs) and toctree entries that do not resolve, and pages missing
+# from index.rst
+if [[ 0 -eq 1 ]] ; then
+    python3 $APPDIR/checkrefs.py --jobs $JOBS --report $TMPDIR/checkrefs.json $BUILDRST
 fi
 
-# use sphinx-build to create html files
+# use sphinx to create the html and man files, reading the rst tree once
+# for both (and only the pages that changed since the last build)
 if [[ 0 -eq 1 ]] ; then
-    echo "About to create html files"
+    echo "About to create html and man files"
     date
     SAVEME=$( pwd )
     cd $BUILDDIR
-    ERRORFILE=sphinx-build_rst2html.output
-    cat /dev/null > $ERRORFILE
-    sphinx-build -b html -c rst rst/ html/ >& $ERRORFILE
+    python3 $APPDIR/sphinx_build.py --builders html,man --jobs $JOBS \
+        --rst rst/ --doctrees doctrees/
     cd $SAVEME
     date
 fi
 
-
-# use sphinx-build to create man files
+# or: create the html and man files straight from the man sources, each
+# page converted in memory as sphinx reads it (see sphinx_man.py), without
+# the tmprst, tmpmdrst and rst trees
 if [[ 0 -eq 1 ]] ; then
-    echo "About to create man files"
+    echo "About to create html and man files from the man sources"
     date
-    ERRORFILE=sphinx-build_rst2man.output
+    SRCDIR=./mansrc/
+    python3 $APPDIR/sphinx_man.py --link $SRCDIR $MANDIRS
+    cp -p $APPDIR/conf.py $APPDIR/index.rst $APPDIR/manpages.py $SRCDIR
     SAVEME=$( pwd )
-    cd $BUILDDIR/
-    sphinx-build -vvv -b man -c rst  rst/ man/ >& $ERRORFILE
+    cd $BUILDDIR
+    python3 $APPDIR/sphinx_build.py --builders html,man --jobs $JOBS \
+        --rst ../mansrc/ --doctrees doctrees-mansrc/
     cd $SAVEME
-date
+    date
 fi
 
-# check the man pages by comparing against original man pages
-j=0
+# package the man pages for installing: manN directories, gzipped pages,
+# and the pages made from .so stubs as .so references to their page
+# (see manpackage.py)
 if [[ 0 -eq 1 ]] ; then
-    SAVEME=$( pwd -P )
-    mkdir -p $TSTMAN_NEW
-    TSTMAN_NEW=$( cd $TSTMAN_NEW; pwd -P )
-    echo "TSTMAN_NEW is $TSTMAN_NEW"
-    echo "TSTMAN_NEW is $TSTMAN_NEW"
-    cd $BUILDMAN
-    for i in $( /bin/ls ) ; do
-        if [[ ! -d $i ]] ; then
-            out=${TSTMAN_NEW}/${i}
-            ( man ./${i} >& $out ) &
-            j=$(( j + 1 ))
-            [[ $(( $j%5 )) -eq 0 ]] && wait
-        fi
-    done
-    echo "new man page output in $TSTMAN_NEW"
+    SAVEME=$( pwd )
+    cd $BUILDDIR
+    python3 $APPDIR/manpackage.py --jobs $JOBS --buildman man/ --rst rst/ \
+        --out man-install/
     cd $SAVEME
 fi
-wait
 
+# check the man pages by comparing against original man pages:
+# render the new pages and the original sources to text, through one pool
+# of man processes, skipping pages that did not change since the last run
 if [[ 0 -eq 1 ]] ; then
-    mkdir -p $TSTMAN_ORIG
-    TSTMAN_ORIG=$( cd $TSTMAN_ORIG; pwd -P )
-    SAVEME=$( pwd -P )
-    cd $MANHOME
-    i=0
-    for d in $MANDIRS ; do
-        for f in $( find $d -name \*.\*in -type f ) ; do
-            if [[ ! -d $TSTMAN_NEW/$i ]] ; then
-                sbname=$( basename $f | sed -e "s/in$//" )
-                out=$TSTMAN_ORIG/$sbname
-                (man ${f} >& $out) &
-                i=$(( i + 1 ))
-                [[ $(( $i%5 )) -eq 0 ]] && wait
-            fi
-        done
-    done
-    cd $SAVEME
-    echo "original man page output in $TSTMAN_ORIG"
+    python3 $APPDIR/render_man.py --jobs $JOBS $FORCE --buildman $BUILDMAN \
+        --manhome $MANHOME --new $TSTMAN_NEW --orig $TSTMAN_ORIG \
+        --cache $TMPDIR/rendercache.json $MANDIRS
 fi
-wait
 
+# compare the see-also sections of the new and original pages
 if [[ 0 -eq 1 ]] ; then
-    SAVEME=$( pwd -P )
-    TSTMAN_ORIG=$( cd $TSTMAN_ORIG; pwd -P )
-    TSTMAN_NEW=$( cd $TSTMAN_NEW; pwd -P )
-    outdir_orig="${TSTMAN_ORIG}.seealso"
-    mkdir -p $outdir_orig
-    outdir_new="${TSTMAN_NEW}.seealso"
-    mkdir -p $outdir_new
-    echo "Output dirs: $outdir_orig, $outdir_new"
-
-    j=0
-    for i in $( /bin/ls $TSTMAN_NEW ) ; do
-        if [[ ! -d $TSTMAN_NEW/$i ]] ; then
-            f1=${TSTMAN_NEW}/${i}
-            f1out=$outdir_new/$i
-            ( python3 $APPDIR/extract_seealso.py $f1 >& $f1out )&
-            
-            f2=${TSTMAN_ORIG}/${i}
-            f2out=$outdir_orig/$i
-            [[ -f $f2 ]] && (python3 $APPDIR/extract_seealso.py $f2 >& $f2out ) &
-
-        fi
-    done
-            
-    cd "$TSTMAN_NEW.seealso"
-    /bin/rm *.diff
-    for f in $( ls -l | grep -vw "0 May" | grep -vw total | awk '{print $NF}' ) ; do
-        orig="${TSTMAN_ORIG}.seealso"/$f
-        if [[ -f $orig ]] ; then
-           ( diff $f $orig >& "$f.diff" )&
-           j=$(( j + 1 ))
-        else
-           cp $f $f.diff
-        fi
-        [[ $(( $j%2 )) -eq 0 ]] && wait
-    done
+    python3 $APPDIR/extract_seealso.py --batch --report $TMPDIR/seealso.json \
+        $TSTMAN_NEW $TSTMAN_ORIG
 fi
-wait
 
 if [[ 0 -eq 1 ]] ; then
-    mkdir -p $TSTMAN_ORIG $TSTMAN_NEW $TSTMAN_DIFF $TSTMAN_TEXT_DIFF
+    mkdir -p $TSTMAN_ORIG $TSTMAN_NEW $TSTMAN_DIFF
     SAVEME=$( pwd -P )
     TSTMAN_ORIG=$( cd $TSTMAN_ORIG; pwd -P )
     TSTMAN_NEW=$( cd $TSTMAN_NEW; pwd -P )
@@ -291,29 +266,24 @@ fi
 wait
 
 
+# compare just the text of the new and original pages, worst pages first
 if [[ 0 -eq 1 ]] ; then
-    mkdir -p $TSTMAN_ORIG $TSTMAN_NEW $TSTMAN_DIFF $TSTMAN_TEXT_DIFF
-    SAVEME=$( pwd -P )
-    TSTMAN_ORIG=$( cd $TSTMAN_ORIG; pwd -P )
-    TSTMAN_NEW=$( cd $TSTMAN_NEW; pwd -P )
-    mkdir -p $TSTMAN_TEXT_DIFF
-    TSTMAN_TEXT_DIFF=$( cd $TSTMAN_TEXT_DIFF; pwd -P )
-    echo "TSTMAN_TEXT_DIFF is $TSTMAN_TEXT_DIFF"
-    j=0
-    for i in $( /bin/ls $TSTMAN_NEW ) ; do
-        if [[ ! -d $TSTMAN_NEW/$i ]] ; then
-            out=${TSTMAN_TEXT_DIFF}/$i
-            f1=${TSTMAN_NEW}/${i}
-            f2=${TSTMAN_ORIG}/${i}
-            if [[ -f $f1 ]] && [[ -f $f2 ]] ; then
-                ( ./checktext.sh $f1 $f2 >& $out ) &
-                j=$(( j + 1 ))
-                [[ $(( $j%5 )) -eq 0 ]] && wait
-            fi
-        fi
-    done
+    python3 $APPDIR/checktext.py --jobs $JOBS --report $TMPDIR/checktext.json \
+        $TSTMAN_NEW $TSTMAN_ORIG
+    echo "text comparison report in $TMPDIR/checktext.json"
+fi
+
+# slowest stages and pages, unresolved cross-references and warnings
+if [[ -n "$TRACE" ]] ; then
+    python3 $APPDIR/buildtrace.py $TRACE
+fi
+
+# WATCH=1 then keeps watching the man pages, converting each page again
+# as it is saved (see watch_man.py); stop it with ^C.
+if [[ -n "$WATCH" ]] ; then
+    exec python3 $APPDIR/watch_man.py --rst $BUILDRST --tmpdir $TMPDIR \
+        --cache $CACHE $MANDIRS
 fi
-wait
 
 # TO DO LIST:
 # Decide what the directory structure should be with docs and man
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+
+# Benchmark of the conversion stages on synthetic corpora of 1x, 10x and
+# 100x the size of the real tree.
+#
+# Corpus
+#  - For each scale, a tree of pages shaped like the Open MPI sources, as
+#    the stages see them: pandoc-style rst from man pages (tmprst), from md
+#    pages (tmpmdrst), ".so" stubs already in the rst tree (as man2rst.py
+#    writes them), and the rendered text of every page (as render_man.py
+#    writes it), plus the allrefs.txt naming every page.
+#  - Pages have a synopsis code block, PARAMETER sections, an example,
+#    and description and SEE ALSO text dense with MPI_* and shmem_* names,
+#    some of which are not labels.  --paragraphs sets the size of a page.
+#  - The real tree has one label per page, so 1x is the number of labels
+#    in allrefs.txt (--base changes it).  The corpus is the same for a
+#    given --seed.
+#
+# Stages timed, in order, each the best of --repeat runs
+#  fixup_rst       fixup_rst.py on the man pages (tmprst -> rst)
+#  fix_md_rst      fix_md_rst.py on the md pages (tmpmdrst -> rst)
+#  extract_seealso the see-also graph of the rendered pages, as --batch
+#  labels          the label index and allrefs list of the rst tree
+#                  (getcrossrefs.py, from scratch) and its xref.LabelIndex
+#  man_pages       conf.py's man_pages list of the rst tree (manpages.py,
+#                  without the manifest)
+#
+# Output
+#  - A table per scale, and with --report a JSON file: for each scale and
+#    stage the time, pages and bytes per second, and the time per page
+#    relative to the smallest scale (1.0 means the stage scales linearly).
+#  - With --baseline <json_file>, a stage whose pages per second fell by
+#    more than --tolerance from the baseline's, at the same scale, is
+#    reported and the exit status is 1.
+#
+# Usage
+#  bench_stages.py [--scales 1,10,100] [--base <pages>] [--paragraphs <n>]
+#                  [--repeat <n>] [--jobs <n>] [--seed <n>] [--workdir <dir>]
+#                  [--keep] [--report <json_file>] [--baseline <json_file>]
+#                  [--tolerance <fraction>]
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import extract_seealso
+import fix_md_rst
+import fixcommon
+import fixup_rst
+import getcrossrefs
+import man2rst
+import manpages
+import xref
+
+APPNAME=os.path.basename(__file__)
+
+FORMAT=1
+
+STAGES=["fixup_rst", "fix_md_rst", "extract_seealso", "labels", "man_pages"]
+
+MPIDIR="ompi/mpi/man/man3"
+SHMEMDIR="oshmem/shmem/man/man3"
+
+# Share of the pages that are md pages, ".so" stubs and shmem pages,
+# roughly as in the real tree
+MDSHARE=0.1
+STUBSHARE=0.25
+SHMEMSHARE=0.15
+
+WORDS = ["Send", "Recv", "Comm", "Type", "Win", "File", "Info", "Group",
+         "Request", "Status", "Op", "Errhandler", "Attr", "Topo", "Dist",
+         "Graph", "Cart", "Pack", "Unpack", "Reduce", "Scatter", "Gather",
+         "Bcast", "Alltoall", "Barrier", "Wait", "Test", "Probe", "Get", "Put"]
+# Names that appear in the text but are not pages
+CONSTANTS = ["MPI_COMM_WORLD", "MPI_INT", "MPI_SUCCESS", "MPI_ERR_ARG",
+             "MPI_Unknown_call", "shmem_not_a_page", "MPI_STATUS_IGNORE"]
+PARAMS = ["buf", "count", "datatype", "dest", "source", "tag", "comm",
+          "request", "status", "root", "op", "flag", "info", "win", "group"]
+SENTENCES = [
+    "The routine {0} completes before {1} returns, unlike {2}.",
+    "See *{0}*\\ (3) and **{1}** for the nonblocking forms.",
+    "Almost all MPI routines return an error value; see `{0}` and {1}.",
+    "It is erroneous to call {0} on {COMM} before {1} has completed.",
+    "The data are copied to a remote PE, see {2}(3) and {0}.",
+    "On return, {1} holds the count of elements received with {DATATYPE}.",
+]
+
+# Page names for a corpus of npages pages: (name, man dir, is md, stub target)
+def page_plan(npages, rng):
+    plan = list()
+    for i in range(npages):
+        word = WORDS[i % len(WORDS)]
+        if rng.random() < SHMEMSHARE:
+            plan.append([f"shmem_{word.lower()}_{i}", SHMEMDIR])
+        else:
+            plan.append([f"MPI_{word}_{i}", MPIDIR])
+    # stubs include an earlier page of the same directory that is not a stub
+    pages = list()
+    targets = {MPIDIR: [], SHMEMDIR: []}
+    for name, man_dir in plan:
+        if targets[man_dir] and rng.random() < STUBSHARE:
+            pages.append((name, man_dir, False, rng.choice(targets[man_dir])))
+        else:
+            pages.append((name, man_dir, rng.random() < MDSHARE, None))
+            targets[man_dir].append(name)
+    return pages
+
+def _sentences(names, rng, count):
+    text = list()
+    for _ in range(count):
+        picks = [rng.choice(names) for _ in range(3)]
+        text.append(rng.choice(SENTENCES).format(
+            *picks, COMM="MPI_COMM_WORLD", DATATYPE=rng.choice(CONSTANTS)))
+    return text
+
+# Text wrapped to at most width columns, as pandoc and man leave it
+def _wrap(words, width, indent=""):
+    lines = list()
+    line = indent
+    for word in words:
+        if len(line) + len(word) + 1 > width and line.strip():
+            lines.append(line)
+            line = indent
+        line = f"{line}{' ' if line.strip() else ''}{word}"
+    if line.strip():
+        lines.append(line)
+    return lines
+
+def _paragraphs(names, rng, paragraphs, indent=""):
+    lines = list()
+    for _ in range(paragraphs):
+        lines.extend(_wrap(" ".join(_sentences(names, rng, 4)).split(), 72, indent))
+        lines.append("")
+    return lines
+
+def _seealso(names, rng):
+    return [rng.choice(names) for _ in range(rng.randint(3, 8))] + [rng.choice(CONSTANTS)]
+
+# A page as pandoc writes it from a man page
+def man_rst(name, names, params, rng, paragraphs):
+    lines = ["NAME", "====", "", f"**{name}** - Performs {name.split('_')[1].lower()}.", "",
+             "SYNTAX", "======", "", "C Syntax", "--------", "", "::", "",
+             "   #include <mpi.h>",
+             f"   int {name}({', '.join(f'int {param}' for param in params)});", "",
+             "Fortran Syntax", "--------------", "", "::", "",
+             "   USE MPI", "   ! or the older form: INCLUDE 'mpif.h'",
+             f"   {name.upper()}({', '.join(param.upper() for param in params)}, IERROR)",
+             f"       INTEGER   {', '.join(param.upper() for param in params)}, IERROR", "",
+             "INPUT PARAMETERS", "================", ""]
+    for param in params:
+        lines.extend([param, f"   Value of {param} for {rng.choice(names)} (handle).", ""])
+    lines.extend(["OUTPUT PARAMETER", "================", "",
+                  "IERROR", "   Fortran only: Error status (integer).", "",
+                  "DESCRIPTION", "===========", ""])
+    lines.extend(_paragraphs(names, rng, paragraphs))
+    lines.extend(["- first bullet item", "  continues here", "",
+                  "Example", "-------", "", "In C:", "", "::", "",
+                  f"   {name}(buf, 1, MPI_INT, 0, 0, MPI_COMM_WORLD);", "",
+                  "ERRORS", "======", ""])
+    lines.extend(_paragraphs(names, rng, 1))
+    lines.extend(["SEE ALSO", "========", ""])
+    lines.extend(f"| {target}" for target in _seealso(names, rng))
+    return lines
+
+# A page as pandoc writes it from an md page
+def md_rst(name, names, params, rng, paragraphs):
+    lines = ["NAME", "====", "", f"{name} - Performs {name.split('_')[1].lower()}.", "",
+             "SYNTAX", "======", "", "C Syntax", "--------", "", ".. code:: c", "",
+             "   #include <mpi.h>", "",
+             f"   int {name}({', '.join(f'int {param}' for param in params)});", "",
+             "INPUT PARAMETERS", "================", ""]
+    lines.extend(f"-  ``{param}``: Value of {param} (handle)." for param in params)
+    lines.extend(["", "Description", "-----------", ""])
+    lines.extend(_paragraphs(names, rng, paragraphs))
+    lines.extend(["SEE ALSO", "========", ""])
+    lines.append(", ".join(f"`{target}`\\ (3)" for target in _seealso(names, rng)))
+    return lines
+
+# A page as man renders it
+def man_text(name, names, rng, paragraphs):
+    title = f"{name}(3)"
+    lines = [f"{title}{'Open MPI'.center(64 - 2 * len(title))}{title}", "",
+             "NAME", f"       {name} - Performs {name.split('_')[1].lower()}.", "",
+             "DESCRIPTION"]
+    lines.extend(_paragraphs(names, rng, paragraphs, "       "))
+    lines.append("SEE ALSO")
+    lines.extend(_wrap([f"{target}(3)," for target in _seealso(names, rng)], 72, "       "))
+    lines.extend(["", f"{'2021'.center(60)}{title}"])
+    return lines
+
+def _write(fname, lines):
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    with open(fname, 'w') as fp:
+        fp.writelines(f"{line}\n" for line in lines)
+
+# Write a corpus of npages pages below root.  Returns its description.
+def make_corpus(root, npages, paragraphs, seed):
+    rng = random.Random(seed)
+    pages = page_plan(npages, rng)
+    names = [name for name, _, _, _ in pages]
+    corpus = {"root": root, "pages": npages, "man": [], "md": [], "stubs": 0,
+              "text": os.path.join(root, "text"), "rst": os.path.join(root, "rst"),
+              "allrefs": os.path.join(root, "allrefs.txt")}
+    for name, man_dir, is_md, target in pages:
+        rst = os.path.join(corpus["rst"], man_dir, f"{name}.3.rst")
+        if target:
+            _write(rst, man2rst.stub_lines(rst, f".so man3/{target}.3"))
+            corpus["stubs"] += 1
+        else:
+            params = rng.sample(PARAMS, rng.randint(2, 6))
+            if is_md:
+                source = os.path.join(root, "tmpmdrst", man_dir, f"{name}.3.rst")
+                _write(source, md_rst(name, names, params, rng, paragraphs))
+                corpus["md"].append((source, rst))
+            else:
+                source = os.path.join(root, "tmprst", man_dir, f"{name}.3.rst")
+                _write(source, man_rst(name, names, params, rng, paragraphs))
+                corpus["man"].append((source, rst))
+        _write(os.path.join(corpus["text"], f"{name}.3"),
+               man_text(name, names, rng, paragraphs))
+    _write(corpus["allrefs"], sorted(name.lower() for name in names))
+    return corpus
+
+def _size(fnames):
+    return sum(os.path.getsize(fname) for fname in fnames)
+
+def _fixer(fixfunc, pairs, corpus, jobs):
+    allrefs = fixcommon.load_allrefs(corpus["allrefs"])
+    def run():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            failed, _, _ = fixcommon.run_batch(fixfunc, pairs, allrefs, jobs, verbose=False)
+        if failed:
+            raise RuntimeError(f"{len(failed)} pages failed, e.g. {failed[0]}")
+    # each run writes every page, as a first run does
+    def reset():
+        for _, out_fname in pairs:
+            if os.path.exists(out_fname):
+                os.remove(out_fname)
+    return run, reset, len(pairs), _size(fname for fname, _ in pairs)
+
+def _seealso_stage(corpus, jobs):
+    text = corpus["text"]
+    def run():
+        graph = extract_seealso.read_graph(text)
+        extract_seealso.diff_graphs(graph, graph)
+    fnames = [os.path.join(text, fname) for fname in os.listdir(text)]
+    return run, None, len(fnames), _size(fnames)
+
+def _labels_stage(corpus, jobs):
+    rst = corpus["rst"]
+    def run():
+        index, _ = getcrossrefs.build_index(rst, None, jobs)
+        xref.LabelIndex(getcrossrefs.allrefs_lines(index))
+    fnames = [os.path.join(rst, fname) for fname in getcrossrefs.find_rst_files(rst)]
+    return run, None, len(fnames), _size(fnames)
+
+def _man_pages_stage(corpus, jobs):
+    rst = corpus["rst"]
+    def run():
+        manpages.scan(rst)
+    return run, None, corpus["pages"], 0
+
+# (run, reset, pages, bytes) for one stage; made once the stages before it
+# have run, as the later stages read the rst tree the fixers write
+def make_stage(name, corpus, jobs):
+    if name == "fixup_rst":
+        return _fixer(fixup_rst.fixup_lines, corpus["man"], corpus, jobs)
+    if name == "fix_md_rst":
+        return _fixer(fix_md_rst.fixup_lines, corpus["md"], corpus, jobs)
+    if name == "extract_seealso":
+        return _seealso_stage(corpus, jobs)
+    if name == "labels":
+        return _labels_stage(corpus, jobs)
+    return _man_pages_stage(corpus, jobs)
+
+def time_stage(run, reset, repeat):
+    times = list()
+    for _ in range(repeat):
+        if reset:
+            reset()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times), sum(times) / len(times)
+
+def bench_scale(scale, npages, args):
+    root = os.path.join(args.workdir, f"x{scale}")
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    start = time.perf_counter()
+    corpus = make_corpus(root, npages, args.paragraphs, args.seed)
+    result = {"scale": scale, "pages": npages, "man": len(corpus["man"]),
+              "md": len(corpus["md"]), "stubs": corpus["stubs"],
+              "generate_s": round(time.perf_counter() - start, 4), "stages": {}}
+    for name in STAGES:
+        run, reset, pages, nbytes = make_stage(name, corpus, args.jobs)
+        best, mean = time_stage(run, reset, args.repeat)
+        result["stages"][name] = {
+            "seconds": round(best, 6), "mean_seconds": round(mean, 6),
+            "pages": pages, "bytes": nbytes,
+            "pages_per_s": round(pages / best, 1) if best else None,
+            "mb_per_s": round(nbytes / best / 1e6, 3) if best and nbytes else None,
+        }
+    if not args.keep:
+        shutil.rmtree(root)
+    return result
+
+# Time per page at each scale, relative to the smallest scale
+def add_scaling(results):
+    first = results[0]
+    for result in results:
+        for name, stage in result["stages"].items():
+            base = first["stages"][name]
+            if base["seconds"] and stage["pages"] and base["pages"]:
+                stage["per_page_vs_first"] = round(
+                    (stage["seconds"] / stage["pages"]) /
+                    (base["seconds"] / base["pages"]), 3)
+
+# Stages whose pages per second fell by more than tolerance
+def regressions(results, baseline, tolerance):
+    old = {(run["scale"], name): stage["pages_per_s"]
+           for run in baseline.get("runs", []) for name, stage in run["stages"].items()}
+    found = list()
+    for result in results:
+        for name, stage in result["stages"].items():
+            before = old.get((result["scale"], name))
+            if before and stage["pages_per_s"] and stage["pages_per_s"] < before * (1 - tolerance):
+                found.append({"scale": result["scale"], "stage": name,
+                              "pages_per_s": stage["pages_per_s"],
+                              "baseline_pages_per_s": before})
+    return found
+
+def print_result(result):
+    print(f"{result['scale']}x: {result['pages']} pages ({result['man']} man, "
+          f"{result['md']} md, {result['stubs']} stubs), "
+          f"generated in {result['generate_s']:.2f}s")
+    print(f"  {'stage':<16} {'best s':>9} {'mean s':>9} {'pages':>7} "
+          f"{'pages/s':>10} {'MB/s':>8} {'vs 1st':>7}")
+    for name, stage in result["stages"].items():
+        mbs = f"{stage['mb_per_s']:8.2f}" if stage["mb_per_s"] else f"{'-':>8}"
+        print(f"  {name:<16} {stage['seconds']:9.3f} {stage['mean_seconds']:9.3f} "
+              f"{stage['pages']:7d} {stage['pages_per_s'] or 0:10.1f} {mbs} "
+              f"{stage.get('per_page_vs_first', 1.0):7.2f}")
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('--scales', default="1,10,100")
+    parser.add_argument('--base', type=int, default=None,
+                        help="pages at 1x (default: labels in allrefs.txt)")
+    parser.add_argument('--paragraphs', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--jobs', type=int, default=fixcommon.default_jobs())
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--keep', action='store_true')
+    parser.add_argument('--report', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv[1:])
+
+    base = args.base or len(fixcommon.load_allrefs())
+    scales = [float(scale) if '.' in scale else int(scale)
+              for scale in args.scales.split(',')]
+    workdir = args.workdir
+    args.workdir = workdir or tempfile.mkdtemp(prefix="bench_stages.")
+
+    results = list()
+    try:
+        for scale in scales:
+            results.append(bench_scale(scale, max(1, int(base * scale)), args))
+    finally:
+        if not workdir and not args.keep:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+    add_scaling(results)
+    for result in results:
+        print_result(result)
+
+    report = {"format": FORMAT, "python": platform.python_version(),
+              "cpus": os.cpu_count(), "jobs": args.jobs, "repeat": args.repeat,
+              "paragraphs": args.paragraphs, "seed": args.seed, "base": base,
+              "runs": results}
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as fp:
+            report["regressions"] = regressions(results, json.load(fp), args.tolerance)
+        for entry in report["regressions"]:
+            print(f"REGRESSION: {entry['stage']} at {entry['scale']}x: "
+                  f"{entry['pages_per_s']} pages/s, was {entry['baseline_pages_per_s']}")
+            status = 1
+    if args.report:
+        with open(args.report, 'w') as fp:
+            json.dump(report, fp, indent=1)
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Micro-benchmark for the cross-reference resolver in xref.py.
+#
+# Times the per-line cost of turning MPI_* and shmem_* tokens into
+# :ref: links, the old way (a linear scan of the allrefs list and one
+# re.sub per token family) against the xref.py scanner (hashed label index,
+# one combined pass, memoized replacements).  Both must give the same text.
+#
+# Usage
+#  bench_xref.py [--allrefs <allrefs_file>] [--repeat <n>] [<rst_file> ...]
+#
+# Without rst files a fixed set of lines shaped like the man pages is used.
+
+import os
+import sys
+import timeit
+
+import fixcommon
+import fixup_rst
+import xref
+
+APPNAME=os.path.basename(__file__)
+
+SAMPLE_LINES = [
+    "MPI_Send performs a standard-mode, blocking send. See *MPI_Isend*(3)",
+    "and **MPI_Bsend** for more, also shmem_put and MPI_COMM_WORLD.",
+    "This routine will block until the message is sent to the destination.",
+    "For an in-depth explanation, see `MPI_Recv` and MPI_Wait.",
+    "The shmem_long_put routine copies data to a remote PE, see shmem_quiet(3).",
+    "Almost all MPI routines return an error value; C routines as the value",
+    "of the function and Fortran routines in the last argument.",
+    "| MPI_Comm_split MPI_Comm_create MPI_Intercomm_create MPI_Comm_free",
+    "",
+]
+
+def usage():
+    print(f"{APPNAME} [--allrefs <allrefs_file>] [--repeat <n>] [<rst_file> ...]\n")
+
+# The resolver as it was before xref.py.
+def old_sub(line, allrefs_list, mpi_pat, shmem_pat):
+    def cmdrepl(match):
+        match = match.group()
+        match = match.replace('(3)','')
+        match = match.replace('(2)','')
+        match = match.replace('(1)','')
+        match = match.replace('`','')
+        match = match.replace('*','')
+        if match.lower() in allrefs_list:
+            return (':ref:`' + match + '`')
+        else:
+            return (match)
+    line = mpi_pat.sub(cmdrepl, line)
+    return shmem_pat.sub(cmdrepl, line)
+
+def main(argv):
+    args = argv[1:]
+    allrefs_file = fixcommon.ALLREFSFILE
+    repeat = 20
+    while len(args) > 1 and args[0] in ('--allrefs', '--repeat'):
+        if args[0] == '--allrefs':
+            allrefs_file = args[1]
+        else:
+            repeat = int(args[1])
+        args = args[2:]
+    if args and args[0].startswith('-'):
+        usage()
+        return 1
+
+    lines = list()
+    for fname in args:
+        with open(fname) as fp:
+            lines.extend(line.rstrip() for line in fp)
+    if not lines:
+        lines = SAMPLE_LINES * 100
+
+    with open(allrefs_file) as fp:
+        allrefs_list = [line.rstrip('\n') for line in fp]
+    index = xref.LabelIndex(allrefs_list)
+    mpi_pat = fixup_rst.mpiref_pat
+    shmem_pat = fixup_rst.shmemref_pat
+    scanner = index.scanner(mpi_pat, shmem_pat)
+
+    for line in lines:
+        if old_sub(line, allrefs_list, mpi_pat, shmem_pat) != scanner.sub(line):
+            print(f"MISMATCH: {line}")
+            return 1
+
+    def before():
+        for line in lines:
+            old_sub(line, allrefs_list, mpi_pat, shmem_pat)
+    def after():
+        for line in lines:
+            scanner.sub(line)
+
+    before_t = min(timeit.repeat(before, number=1, repeat=repeat))
+    after_t = min(timeit.repeat(after, number=1, repeat=repeat))
+    nlines = len(lines)
+    print(f"labels:  {len(index)}")
+    print(f"lines:   {nlines}")
+    print(f"before:  {before_t * 1e6 / nlines:8.2f} us/line")
+    print(f"after:   {after_t * 1e6 / nlines:8.2f} us/line")
+    print(f"speedup: {before_t / after_t:8.2f}x")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
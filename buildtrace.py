@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# Structured trace of the conversion, fix-up and verification stages, and
+# a summary of it.
+#
+# Trace file
+#  - JSON lines, appended to by every tool given --trace <file> (man2rst.py,
+#    pandoc_stage.py, the fixers, fingerprint.py and pipeline.py), so one
+#    file can hold a whole README.sh run.  Only the process that started
+#    the workers writes; workers send their figures back with their results.
+#  - A "page" event per page and stage: stage, page, status ("ok",
+#    "failed", "skipped", "differs"), seconds, in_bytes and out_bytes, and
+#    whatever the stage knows: for the fixers, the lines scanned for
+#    cross-references and the tokens linked (resolved) and left as text
+#    (unresolved); the warnings the stage printed or pandoc wrote.
+#  - The fixers' regex substitutions are counted through resolved and
+#    unresolved only: the cross-reference substitutions (over the text,
+#    and over fix_md_rst.py's see-also lines) are the ones run over every
+#    line and whose count depends on the label list.  The others (heading
+#    underlines, indentation, the ';' of parameter lines) follow from the
+#    page's structure and are not counted.
+#  - A "stage" event when a stage ends, with its totals.
+#  - Warnings are still printed as before; the trace is a second channel,
+#    not a replacement.
+#
+# Summary
+#  - The stages by time spent on their pages, the slowest pages, the pages
+#    with the most unresolved cross-references and the most frequent
+#    warnings.  --json prints it as JSON instead.
+#
+# Usage
+#  buildtrace.py [--top <n>] [--stage <stage>] [--json] <trace_file>
+
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+
+APPNAME=os.path.basename(__file__)
+
+# Appends events to a trace file; with no file name, does nothing.
+class Trace:
+    def __init__(self, fname=None):
+        self.fp = open(fname, 'a', buffering=1) if fname else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, event):
+        if self.fp:
+            self.fp.write(json.dumps({"time": round(time.time(), 3), **event}) + "\n")
+
+    def page(self, stage, page, status="ok", **fields):
+        self.write({"event": "page", "stage": stage, "page": page,
+                    "status": status, **fields})
+
+    def stage(self, stage, **fields):
+        self.write({"event": "stage", "stage": stage, **fields})
+
+    def close(self):
+        if self.fp:
+            self.fp.close()
+            self.fp = None
+
+# Size of a file, None if there is none
+def file_size(fname):
+    try:
+        return os.path.getsize(fname)
+    except (OSError, TypeError):
+        return None
+
+# The WARNING lines of what a stage printed
+def warning_lines(text):
+    return [line.strip() for line in text.split('\n') if 'WARNING' in line]
+
+def read_events(fname):
+    events = list()
+    with open(fname) as fp:
+        for line in fp:
+            line = line.strip()
+            if line:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    print(f"{APPNAME}: skipping bad line in {fname}", file=sys.stderr)
+    return events
+
+def summarize(events, top=10):
+    pages = [event for event in events if event.get("event") == "page"]
+    stages = dict()
+    for event in pages:
+        stage = stages.setdefault(event["stage"], {
+            "stage": event["stage"], "pages": 0, "statuses": collections.Counter(),
+            "seconds": 0.0, "max_seconds": 0.0, "in_bytes": 0, "out_bytes": 0,
+            "resolved": 0, "unresolved": 0, "warnings": 0})
+        seconds = event.get("seconds") or 0.0
+        stage["pages"] += 1
+        stage["statuses"][event.get("status", "ok")] += 1
+        stage["seconds"] += seconds
+        stage["max_seconds"] = max(stage["max_seconds"], seconds)
+        for key in ("in_bytes", "out_bytes", "resolved", "unresolved"):
+            stage[key] += event.get(key) or 0
+        stage["warnings"] += len(event.get("warnings", ()))
+    for event in events:
+        if event.get("event") == "stage" and event["stage"] in stages:
+            stages[event["stage"]]["wall"] = event.get("wall")
+    for stage in stages.values():
+        stage["seconds"] = round(stage["seconds"], 3)
+        stage["mean_seconds"] = round(stage["seconds"] / stage["pages"], 4)
+        stage["statuses"] = dict(stage["statuses"])
+
+    timed = [event for event in pages if event.get("seconds")]
+    slowest = sorted(timed, key=lambda event: -event["seconds"])[:top]
+    unresolved = sorted((event for event in pages if event.get("unresolved")),
+                        key=lambda event: -event["unresolved"])[:top]
+    warnings = collections.Counter(warning for event in pages
+                                   for warning in event.get("warnings", ()))
+    brief = lambda event, key: {"stage": event["stage"], "page": event["page"],
+                                key: event[key]}
+    return {
+        "events": len(events),
+        "stages": sorted(stages.values(), key=lambda stage: -stage["seconds"]),
+        "slowest_pages": [brief(event, "seconds") for event in slowest],
+        "most_unresolved": [brief(event, "unresolved") for event in unresolved],
+        "warnings": [{"warning": text, "count": count}
+                     for text, count in warnings.most_common(top)],
+    }
+
+def print_summary(summary):
+    print(f"{'stage':16} {'pages':>6} {'not ok':>6} {'page s':>8} {'max s':>7} "
+          f"{'mean s':>7} {'wall s':>7} {'unres':>6} {'warn':>5}")
+    for stage in summary["stages"]:
+        failed = sum(count for status, count in stage["statuses"].items()
+                     if status not in ("ok", "skipped"))
+        wall = stage.get("wall")
+        wall = f"{wall:7.2f}" if wall is not None else f"{'-':>7}"
+        print(f"{stage['stage']:16} {stage['pages']:6} {failed:6} {stage['seconds']:8.2f} "
+              f"{stage['max_seconds']:7.3f} {stage['mean_seconds']:7.4f} {wall} "
+              f"{stage['unresolved']:6} {stage['warnings']:5}")
+    if summary["slowest_pages"]:
+        print("\nslowest pages:")
+        for event in summary["slowest_pages"]:
+            print(f"  {event['seconds']:8.3f}s  {event['stage']:16} {event['page']}")
+    if summary["most_unresolved"]:
+        print("\nmost unresolved cross-references:")
+        for event in summary["most_unresolved"]:
+            print(f"  {event['unresolved']:8}   {event['stage']:16} {event['page']}")
+    if summary["warnings"]:
+        print("\nmost frequent warnings:")
+        for entry in summary["warnings"]:
+            print(f"  {entry['count']:8}   {entry['warning']}")
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('trace_file')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--stage', action='append', default=[])
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv[1:])
+
+    events = read_events(args.trace_file)
+    if args.stage:
+        events = [event for event in events if event.get("stage") in args.stage]
+    summary = summarize(events, args.top)
+    if args.json:
+        json.dump(summary, sys.stdout, indent=1)
+        print()
+    else:
+        print_summary(summary)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
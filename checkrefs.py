@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+
+# This script checks the cross-references of the rst tree without running
+# sphinx, so a broken tree is found in seconds instead of from the log of
+# a full build.
+#
+# What is read, from every *.rst page of the tree, in one parallel pass
+#  - labels    ".. _label:" lines, as fixup_rst.py, fix_md_rst.py and the
+#              .so stubs write them (case-folded, as sphinx does)
+#  - refs      :ref:`target` and :ref:`text <target>` roles
+#  - includes  ".. include::" paths, relative to the page (or to the tree
+#              if they start with '/'), with their ":start-after:" text
+#  - toctrees  the entries of ".. toctree::" blocks; in a ":glob:" one,
+#              entries with *, ? or [...] are patterns over the page names,
+#              as sphinx reads them (* and ? within a directory, ** across)
+#
+# Problems reported
+#  - unresolved   a :ref: whose target no page defines
+#  - duplicate    a label defined more than once
+#  - include      an include whose file is missing, or does not hold the
+#                 ":start-after:" text (a .so stub whose page is missing
+#                 or lost its ".. include_body")
+#  - toctree      a toctree entry naming a page that does not exist, or a
+#                 glob pattern matching no page
+#  - orphan       a page in no toctree (index.rst's, in practice), unless
+#                 it is marked ":orphan:"
+#
+# Every problem is printed as "<page>:<line>: <kind>: <detail>", and with
+# --report written as JSON.  Exits with 1 if there is any problem, so it
+# can gate a commit; --ignore <kind>,... leaves kinds out.
+#
+# Usage
+#  checkrefs.py [--jobs <n>] [--report <json_file>] [--root-doc <name>]
+#               [--ignore <kind>,...] [<rst_dir>]
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import re
+import sys
+
+import fixcommon
+
+APPNAME=os.path.basename(__file__)
+
+KINDS=["unresolved", "duplicate", "include", "toctree", "orphan"]
+
+# Labels sphinx defines itself
+STD_LABELS={"genindex", "modindex", "search"}
+
+# Directories sphinx does not read (see conf.py's exclude_patterns)
+SKIPDIRS={"_build", "venv", "__pycache__"}
+
+# PATTERNS
+label_pat = re.compile(r"^\.\. _([^:`]+):\s*$")
+ref_pat = re.compile(r":ref:`([^`]+)`")
+ref_target_pat = re.compile(r"<([^<>]+)>\s*$")
+include_pat = re.compile(r"^\s*\.\. include::\s+(\S+)\s*$")
+start_after_pat = re.compile(r"^\s+:start-after:\s*(.*?)\s*$")
+toctree_pat = re.compile(r"^(\s*)\.\. toctree::")
+orphan_pat = re.compile(r"^:orphan:\s*$")
+glob_option_pat = re.compile(r"^\s+:glob:\s*$")
+glob_chars_pat = re.compile(r"[*?\[]")
+
+# Every page below root, relative to root
+def find_pages(root):
+    pages = list()
+    for dirpath, dirs, files in os.walk(root, followlinks=True):
+        dirs[:] = sorted(d for d in dirs if d not in SKIPDIRS and not d.startswith('.'))
+        for fname in sorted(files):
+            if fname.endswith('.rst'):
+                pages.append(os.path.relpath(os.path.join(dirpath, fname), root))
+    return pages
+
+def _ref_target(text):
+    match = ref_target_pat.search(text)
+    return (match.group(1) if match else text).strip().lower()
+
+# What one page defines and refers to
+def scan_page(root, page):
+    entry = {"page": page, "labels": [], "refs": [], "includes": [],
+             "toctree": [], "orphan": False}
+    with open(os.path.join(root, page), errors='replace') as fp:
+        lines = fp.read().split('\n')
+    toctree_indent = None
+    toctree_glob = False
+    for lineno, line in enumerate(lines, 1):
+        if toctree_indent is not None:
+            if line.strip() and len(line) - len(line.lstrip()) <= toctree_indent:
+                toctree_indent = None
+            elif glob_option_pat.match(line):
+                toctree_glob = True
+                continue
+            elif line.strip() and not line.strip().startswith(':'):
+                name = line.strip()
+                entry["toctree"].append(
+                    (lineno, name, toctree_glob and bool(glob_chars_pat.search(name))))
+                continue
+            else:
+                continue
+        match = label_pat.match(line)
+        if match:
+            entry["labels"].append((lineno, match.group(1).strip().lower()))
+            continue
+        match = include_pat.match(line)
+        if match:
+            start_after = None
+            following = lines[lineno] if lineno < len(lines) else ""
+            after = start_after_pat.match(following)
+            if after:
+                start_after = after.group(1)
+            entry["includes"].append((lineno, match.group(1), start_after))
+            continue
+        match = toctree_pat.match(line)
+        if match:
+            toctree_indent = len(match.group(1))
+            toctree_glob = False
+            continue
+        if lineno <= 3 and orphan_pat.match(line):
+            entry["orphan"] = True
+        if ':ref:' in line:
+            entry["refs"].extend((lineno, _ref_target(text))
+                                 for text in ref_pat.findall(line))
+    return entry
+
+def _scan_many(root, pages):
+    return [scan_page(root, page) for page in pages]
+
+# Scan every page, in parallel worker processes
+def scan_tree(root, jobs):
+    pages = find_pages(root)
+    if jobs <= 1 or len(pages) < 2:
+        return _scan_many(root, pages)
+    chunk = max(1, len(pages) // (jobs * 8))
+    chunks = [pages[i:i + chunk] for i in range(0, len(pages), chunk)]
+    entries = list()
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        for result in pool.map(_scan_many, [root] * len(chunks), chunks):
+            entries.extend(result)
+    return entries
+
+# Does the included file exist and hold the start-after text?
+def _include_problem(root, page, path, start_after, texts):
+    if path.startswith('/'):
+        target = os.path.normpath(os.path.join(root, path.lstrip('/')))
+    else:
+        target = os.path.normpath(os.path.join(root, os.path.dirname(page), path))
+    if not os.path.isfile(target):
+        return f"{path}: no such file"
+    if start_after:
+        if target not in texts:
+            with open(target, errors='replace') as fp:
+                texts[target] = fp.read()
+        if start_after not in texts[target]:
+            return f"{path}: no \"{start_after}\" to start after"
+    return None
+
+# Regex for a toctree glob pattern, as sphinx translates it
+def _glob_regex(pattern):
+    out = list()
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+            continue
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = pattern.find(']', i + 1)
+            if end < 0:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append(f"[{body}]")
+                i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile(''.join(out) + '$')
+
+def check(root, entries, root_doc="index"):
+    problems = list()
+    def report(page, lineno, kind, detail):
+        problems.append({"page": page, "line": lineno, "kind": kind, "detail": detail})
+
+    defined = collections.defaultdict(list)
+    for entry in entries:
+        for lineno, label in entry["labels"]:
+            defined[label].append((entry["page"], lineno))
+    for label, places in sorted(defined.items()):
+        for page, lineno in places[1:]:
+            first_page, first_line = places[0]
+            report(page, lineno, "duplicate",
+                   f"label {label} also defined at {first_page}:{first_line}")
+
+    docnames = {entry["page"][:-len('.rst')] for entry in entries}
+    in_toctree = set()
+    texts = dict()
+    for entry in entries:
+        page = entry["page"]
+        for lineno, target in entry["refs"]:
+            if target not in defined and target not in STD_LABELS:
+                report(page, lineno, "unresolved", f":ref: target {target}")
+        for lineno, path, start_after in entry["includes"]:
+            problem = _include_problem(root, page, path, start_after, texts)
+            if problem:
+                report(page, lineno, "include", problem)
+        for lineno, name, glob in entry["toctree"]:
+            if glob:
+                if name.startswith('/'):
+                    pattern = name.lstrip('/')
+                else:
+                    pattern = os.path.join(os.path.dirname(page), name)
+                regex = _glob_regex(pattern)
+                matches = {docname for docname in docnames
+                           if regex.match(docname) and docname != page[:-len('.rst')]}
+                if matches:
+                    in_toctree |= matches
+                else:
+                    report(page, lineno, "toctree", f"no page matches {name}")
+                continue
+            if name.startswith('/'):
+                docname = os.path.normpath(name.lstrip('/'))
+            else:
+                docname = os.path.normpath(os.path.join(os.path.dirname(page), name))
+            if docname.endswith('.rst'):
+                docname = docname[:-len('.rst')]
+            if docname in docnames:
+                in_toctree.add(docname)
+            else:
+                report(page, lineno, "toctree", f"no page {name}")
+
+    for entry in entries:
+        docname = entry["page"][:-len('.rst')]
+        if docname != root_doc and docname not in in_toctree and not entry["orphan"]:
+            report(entry["page"], 1, "orphan", "in no toctree")
+    return problems
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('rst_dir', nargs='?', default="./rst/")
+    parser.add_argument('--jobs', type=int, default=fixcommon.default_jobs())
+    parser.add_argument('--report', default=None)
+    parser.add_argument('--root-doc', default="index")
+    parser.add_argument('--ignore', default="",
+                        help=f"kinds of problems to leave out: {','.join(KINDS)}")
+    args = parser.parse_args(argv[1:])
+    ignore = {kind for kind in args.ignore.split(',') if kind}
+    if ignore - set(KINDS):
+        parser.error(f"unknown kinds: {', '.join(sorted(ignore - set(KINDS)))}")
+    if not os.path.isdir(args.rst_dir):
+        parser.error(f"no directory {args.rst_dir}")
+
+    entries = scan_tree(args.rst_dir, args.jobs)
+    problems = [problem for problem in check(args.rst_dir, entries, args.root_doc)
+                if problem["kind"] not in ignore]
+    problems.sort(key=lambda problem: (problem["page"], problem["line"]))
+    for problem in problems:
+        print(f"{problem['page']}:{problem['line']}: {problem['kind']}: {problem['detail']}")
+
+    counts = collections.Counter(problem["kind"] for problem in problems)
+    if args.report:
+        with open(args.report, 'w') as fp:
+            json.dump({"pages": len(entries), "counts": dict(counts),
+                       "problems": problems}, fp, indent=1)
+    labels = sum(len(entry["labels"]) for entry in entries)
+    refs = sum(len(entry["refs"]) for entry in entries)
+    print(f"{APPNAME}: {len(entries)} pages, {labels} labels, {refs} refs, "
+          + (", ".join(f"{counts[kind]} {kind}" for kind in KINDS if counts[kind])
+             or "no problems"))
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+# Given two rendered man pages, or two trees of them, extract just the
+# alphanumeric text from each and compare them (replaces checktext.sh).
+#
+# Normalization (as checktext.sh did it with sed and grep)
+#  - Every character other than A-Z, a-z and 0-9 is removed from each line.
+#  - Lines that then contain PACKAGE, COPYRIGHT, MPIMPI or a year 2010-2029
+#    are dropped.
+#
+# Tree mode
+#  - Every page in <new_dir> is compared with the page of the same name in
+#    <orig_dir>, in parallel worker processes.
+#  - One JSON report lists every page with a similarity score (1.0 means
+#    the same text), the lines only in the new page (added) and the lines
+#    of the original it lost (removed), worst first.
+#  - The worst pages are printed, so the bad conversions can be looked at
+#    first.
+#
+# Usage
+#  checktext.py <new_page> <orig_page>
+#      Print the differences, in diff's format.
+#  checktext.py [--jobs <n>] [--report <json_file>] [--worst <n>]
+#               <new_dir> <orig_dir>
+
+import argparse
+import concurrent.futures
+import difflib
+import json
+import os
+import re
+import sys
+
+import fixcommon
+
+APPNAME=os.path.basename(__file__)
+
+# PATTERNS
+nonalnum_pat = re.compile("[^A-Za-z0-9]")
+drop_pat = re.compile("PACKAGE|COPYRIGHT|20[12][0-9]|MPIMPI")
+
+def normalize(fname):
+    lines = list()
+    with open(fname, errors='replace') as fp:
+        for line in fp:
+            line = nonalnum_pat.sub('', line)
+            if not drop_pat.search(line):
+                lines.append(line)
+    return lines
+
+def _range(lo, hi):
+    return f"{lo + 1}" if hi - lo == 1 else f"{lo + 1},{hi}"
+
+# Differences between two lists of lines, in diff's default format.
+def normal_diff(a, b):
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        if tag == 'replace':
+            yield f"{_range(i1, i2)}c{_range(j1, j2)}"
+        elif tag == 'delete':
+            yield f"{_range(i1, i2)}d{j1}"
+        else:
+            yield f"{i1}a{_range(j1, j2)}"
+        for line in a[i1:i2]:
+            yield f"< {line}"
+        if tag == 'replace':
+            yield "---"
+        for line in b[j1:j2]:
+            yield f"> {line}"
+
+# Compare one page pair.  Returns its report entry.
+def compare(name, new_fname, orig_fname):
+    entry = {"page": name, "similarity": 0.0, "added": 0, "removed": 0,
+             "new_lines": 0, "orig_lines": 0, "error": None}
+    try:
+        new = normalize(new_fname)
+        orig = normalize(orig_fname)
+    except OSError as err:
+        entry["error"] = str(err)
+        return entry
+    matcher = difflib.SequenceMatcher(None, new, orig, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != 'equal':
+            entry["added"] += i2 - i1
+            entry["removed"] += j2 - j1
+    entry["similarity"] = round(matcher.ratio(), 4)
+    entry["new_lines"] = len(new)
+    entry["orig_lines"] = len(orig)
+    return entry
+
+def compare_trees(new_dir, orig_dir, jobs):
+    with os.scandir(new_dir) as entries:
+        names = sorted(entry.name for entry in entries if not entry.is_dir())
+    report = list()
+    missing = list()
+    work = list()
+    for name in names:
+        orig_fname = os.path.join(orig_dir, name)
+        if os.path.isfile(orig_fname):
+            work.append((name, os.path.join(new_dir, name), orig_fname))
+        else:
+            missing.append(name)
+    with concurrent.futures.ProcessPoolExecutor(max(1, jobs)) as pool:
+        futures = [pool.submit(compare, *args) for args in work]
+        for future in futures:
+            report.append(future.result())
+    report.sort(key=lambda entry: (entry["similarity"], entry["page"]))
+    return report, missing
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('new')
+    parser.add_argument('orig')
+    parser.add_argument('--jobs', type=int, default=fixcommon.default_jobs())
+    parser.add_argument('--report', default=None)
+    parser.add_argument('--worst', type=int, default=20)
+    args = parser.parse_args(argv[1:])
+
+    if not os.path.isdir(args.new):
+        lines = list(normal_diff(normalize(args.new), normalize(args.orig)))
+        for line in lines:
+            print(line)
+        return 1 if lines else 0
+
+    report, missing = compare_trees(args.new, args.orig, args.jobs)
+    for name in missing:
+        print(f"Missing: {os.path.join(args.orig, name)}")
+    if args.report:
+        with open(args.report, 'w') as fp:
+            json.dump({"pages": report, "missing": missing}, fp, indent=1)
+    for entry in report[:args.worst]:
+        print(f"{entry['similarity']:.4f}  +{entry['added']:<5} "
+              f"-{entry['removed']:<5} {entry['page']}")
+    same = sum(1 for entry in report if entry["similarity"] == 1.0)
+    print(f"{APPNAME}: {len(report)} pages compared, {same} identical, "
+          f"{len(missing)} missing")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -77,32 +77,24 @@ html_static_path = []
 
 # -- Options for MAN output -------------------------------------------------
 
-def string_is_int(s):
-  try: 
-    int(s)
-    return True
-  except ValueError:
-    return False
-
 # This works
 #man_pages=[("ompi/mpi/man/man3/MPI_Abort.3in","ompi/mpi/man/man3/MPI_Abort.3in","MPI_Abort.3in","",3)]
 
 #man_make_section_directory='True'
+# The list comes from a manifest that is only rebuilt when the tree
+# changes (see manpages.py, copied here by README.sh)
 import os
-import glob
-from pathlib import Path
-man_pages=[]
-for path in Path('./').rglob('*.rst'):
-    sname=path.name
-    vsname=re.sub('\.[0-9]*\.rst','',path.name)
-    os.makedirs('../_build/man/' + str(path.parent),exist_ok = True)
-    print('../_build/man/' + str(path.parent))
-    snum=os.path.basename(os.path.dirname(path)).replace('man','')
-    if string_is_int(snum):
-      lname=(str(path.parent) + '/' + sname.replace('.rst',''))
-      man_pages.append((lname,vsname,"","",int(snum)))
-
-print(man_pages)
+import sys
+sys.path.insert(0, os.path.abspath('.'))
+import manpages
+man_pages = manpages.man_pages('.', '../_build/man/',
+                               manpages.manifest_path('.', '../_build/'))
+
+# Reading the man sources themselves, converted as they are read: the
+# source tree is made by "sphinx_man.py --link", which puts the extension
+# here
+if os.path.exists('sphinx_man.py'):
+    extensions.append('sphinx_man')
 
 # -- Open MPI-specific options -----------------------------------------------
 
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+# Incremental conversion cache.
+#
+# A persistent manifest (JSON) records, for every output file, hashes of
+# what produced it:
+#  - the source file it was converted from,
+#  - any other inputs (e.g. allrefs.txt for the fixers),
+#  - the tool that produced it (the pandoc version string, or the source of
+#    the fixer script and the modules it uses).
+# A page whose output exists and whose recorded hashes all still match is
+# a cache hit and is not converted again.  --force treats every page as a
+# miss.
+#
+# Usage (for the shell stages in README.sh)
+#  convcache.py stale [--force] --cache <manifest> --stage <name>
+#               [--tool <version>] [--dep <file>]... <pairs_file>
+#      Print the "<source> <output>" pairs that need converting and report
+#      hit/miss counts on stderr.
+#  convcache.py record --cache <manifest> --stage <name>
+#               [--tool <version>] [--dep <file>]... <pairs_file>
+#      Record the given pairs as freshly converted.
+#
+# pairs_file has one "<source> <output>" pair per line ('-' for stdin).
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+APPNAME=os.path.basename(__file__)
+
+# Hashes of files already read by this process: path -> (mtime, size,
+# inode, hash).  A file written since it was hashed is read again, so a
+# process that runs for long (watch_man.py) sees edits.
+_file_hashes = dict()
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(fname):
+    fname = os.path.abspath(fname)
+    stat = os.stat(fname)
+    stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    memo = _file_hashes.get(fname)
+    if memo is None or memo[:3] != stamp:
+        with open(fname, 'rb') as fp:
+            memo = _file_hashes[fname] = (*stamp, hash_bytes(fp.read()))
+    return memo[3]
+
+# Version of a tool made of several source files, e.g. a fixer script and
+# the modules it imports.
+def hash_files(fnames):
+    return hash_bytes("".join(hash_file(fname) for fname in fnames).encode())
+
+def hash_text(text):
+    return hash_bytes(text.encode())
+
+class ConversionCache:
+    def __init__(self, fname, force=False):
+        self.fname = fname
+        self.force = force
+        self.entries = dict()
+        self.hits = dict()
+        self.misses = dict()
+        if fname and os.path.exists(fname):
+            with open(fname) as fp:
+                self.entries = json.load(fp)
+
+    # What an output must have been built from to still be current.
+    def _key(self, stage, source, deps, tool):
+        return {
+            "stage": stage,
+            "source": hash_file(source),
+            "deps": {os.path.basename(dep): hash_file(dep) for dep in deps},
+            "tool": tool,
+        }
+
+    # True if out can be reused as is.  Counts a hit or a miss for stage.
+    def is_fresh(self, stage, source, out, deps=(), tool=""):
+        fresh = False
+        if not self.force and os.path.exists(out):
+            entry = self.entries.get(os.path.normpath(out))
+            try:
+                fresh = entry == self._key(stage, source, deps, tool)
+            except OSError:
+                fresh = False
+        counts = self.hits if fresh else self.misses
+        counts[stage] = counts.get(stage, 0) + 1
+        return fresh
+
+    def record(self, stage, source, out, deps=(), tool=""):
+        self.entries[os.path.normpath(out)] = self._key(stage, source, deps, tool)
+
+    def forget(self, out):
+        self.entries.pop(os.path.normpath(out), None)
+
+    # Split (source, output) pairs into (stale, fresh) lists.
+    def partition(self, stage, pairs, deps=(), tool=""):
+        stale = list()
+        fresh = list()
+        for source, out in pairs:
+            if self.is_fresh(stage, source, out, deps, tool):
+                fresh.append((source, out))
+            else:
+                stale.append((source, out))
+        return stale, fresh
+
+    def save(self):
+        if not self.fname:
+            return
+        os.makedirs(os.path.dirname(self.fname) or '.', exist_ok=True)
+        tmp = f"{self.fname}.tmp{os.getpid()}"
+        with open(tmp, 'w') as fp:
+            json.dump(self.entries, fp, indent=1, sort_keys=True)
+        os.replace(tmp, self.fname)
+
+    def report(self):
+        stages = sorted(set(self.hits) | set(self.misses))
+        return [f"{stage}: {self.hits.get(stage, 0)} hits, "
+                f"{self.misses.get(stage, 0)} misses" for stage in stages]
+
+def read_pairs(fname):
+    fp = sys.stdin if fname == '-' else open(fname)
+    pairs = list()
+    with fp:
+        for line in fp:
+            fields = line.split()
+            if len(fields) == 2:
+                pairs.append((fields[0], fields[1]))
+    return pairs
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('command', choices=['stale', 'record'])
+    parser.add_argument('pairs_file')
+    parser.add_argument('--cache', required=True)
+    parser.add_argument('--stage', required=True)
+    parser.add_argument('--tool', default="")
+    parser.add_argument('--dep', action='append', default=[])
+    parser.add_argument('--force', action='store_true')
+    args = parser.parse_args(argv[1:])
+
+    cache = ConversionCache(args.cache, args.force)
+    pairs = read_pairs(args.pairs_file)
+    tool = hash_text(args.tool)
+    if args.command == 'stale':
+        stale, fresh = cache.partition(args.stage, pairs, args.dep, tool)
+        for source, out in stale:
+            print(f"{source} {out}")
+        for line in cache.report():
+            print(f"{APPNAME}: {line}", file=sys.stderr)
+    else:
+        for source, out in pairs:
+            if os.path.exists(source) and os.path.exists(out):
+                cache.record(args.stage, source, out, args.dep, tool)
+        cache.save()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,58 +1,156 @@
 #!/usr/bin/env python3
 
 # This script walks through a man output file (e.g., man ./foobar > output),
-# and extracts just the text following a line beginning with "See also"
+# and extracts just the text following a "See also" heading, up to the next
+# section heading (an unindented line) or the page footer.
 #
+# Batch mode
+#  - Reads every page of two rendered trees (e.g. tmpman_new and
+#    tmpman_orig) in one process, stopping in each page at the end of its
+#    see-also section.
+#  - Picks the page names (MPI_Send, MPI_Send(3), mpirun(1), ...) out of
+#    each see-also section, giving a see-also graph for each tree.
+#  - Reports, per page, the see-also targets the new page is missing and
+#    those it has in addition to the original, as text and, with
+#    --report, as JSON.
+#
+# Usage
+#  extract_seealso.py <input_file> [<output_file>]
+#  extract_seealso.py --batch [--report <json_file>] <new_dir> <orig_dir>
+
+import argparse
+import json
 import re
 import sys
 import os
-from pathlib import Path
 
 APPNAME=os.path.basename(__file__)
 DIRNAME=os.path.dirname(__file__)
 
+# seealso: a "SEE ALSO" section heading, or a "See also" line on its own
+# (how sphinx renders a seealso directive)
+seealso = re.compile("[ ]*see also", flags = re.IGNORECASE )
+seealso_alone = re.compile("see also:?$", flags = re.IGNORECASE )
+# section heading or page footer: text starting in the first column
+heading = re.compile("[^ \t\n]")
+# word broken over two lines by hyphenation
+hyphenated = re.compile("[A-Za-z0-9_]-$")
+# page name, optionally followed by its section
+pagename = re.compile(r"([A-Za-z][A-Za-z0-9_.]*)(\([0-9][a-z]*\))?")
+
 def usage():
-    print(f"{APPNAME} <input_file> [<output_file>]\n")
+    print(f"{APPNAME} <input_file> [<output_file>]\n"
+          f"{APPNAME} --batch [--report <json_file>] <new_dir> <orig_dir>\n")
 
-# Get input and optional output files
-in_fname = sys.argv[1]
-CMDNAME = os.path.basename(in_fname).rsplit('.',100)[0]
-PARENTPATH = os.path.dirname(in_fname)
+# The lines of the see-also section, stripped.  Stops reading the file at
+# the end of the section.
+def seealso_lines(fp):
+    lines = list()
+    for line in fp:
+        if lines and heading.match(line):
+            break
+        curline = line.strip()
+        if lines or (seealso.match(line) and
+                     (heading.match(line) or seealso_alone.match(curline))):
+            lines.append(curline)
+    return lines
 
-out_fname=""
-if (len(sys.argv) > 2):
-    out_fname=sys.argv[2]
+# Page names referred to by a see-also section, lower-cased
+def seealso_targets(lines):
+    text = ""
+    for line in lines[1:]:
+        if hyphenated.search(text):
+            text = text[:-1] + line
+        else:
+            text = f"{text} {line}"
+    # the heading line itself may go on with the first names
+    first = seealso.sub('', lines[0], count=1) if lines else ""
+    targets = set()
+    for match in pagename.finditer(f"{first} {text}"):
+        name, section = match.groups()
+        name = name.rstrip('.')
+        if section or '_' in name:
+            targets.add(name.lower())
+    return targets
 
-output_lines = list()
+def read_graph(dirname):
+    graph = dict()
+    with os.scandir(dirname) as entries:
+        names = sorted(entry.name for entry in entries if entry.is_file())
+    for name in names:
+        with open(os.path.join(dirname, name), errors='replace') as fp:
+            graph[name] = seealso_targets(seealso_lines(fp))
+    return graph
 
-# Read input as an array of lines
-with open(in_fname) as fp:
-    in_lines = fp.readlines()
+# Per page: see-also targets missing from the new page, and extra ones.
+def diff_graphs(new, orig):
+    report = list()
+    for name in sorted(set(new) | set(orig)):
+        new_targets = new.get(name, set())
+        orig_targets = orig.get(name, set())
+        if new_targets != orig_targets:
+            report.append({
+                "page": name,
+                "in_new": name in new,
+                "in_orig": name in orig,
+                "missing": sorted(orig_targets - new_targets),
+                "extra": sorted(new_targets - orig_targets),
+            })
+    return report
 
-# seealso
-seealso = re.compile("[ ]*see also", flags = re.IGNORECASE )
+def batch(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('--batch', action='store_true', required=True)
+    parser.add_argument('--report', default=None)
+    parser.add_argument('new_dir')
+    parser.add_argument('orig_dir')
+    args = parser.parse_args(argv[1:])
+
+    new = read_graph(args.new_dir)
+    orig = read_graph(args.orig_dir)
+    report = diff_graphs(new, orig)
+    for entry in report:
+        if not entry["in_orig"]:
+            print(f"{entry['page']}: no original page")
+            continue
+        if not entry["in_new"]:
+            print(f"{entry['page']}: no new page")
+            continue
+        if entry["missing"]:
+            print(f"{entry['page']}: missing {' '.join(entry['missing'])}")
+        if entry["extra"]:
+            print(f"{entry['page']}: extra {' '.join(entry['extra'])}")
+    if args.report:
+        with open(args.report, 'w') as fp:
+            json.dump({"pages": report}, fp, indent=1)
+    edges = lambda graph: sum(len(targets) for targets in graph.values())
+    print(f"{APPNAME}: {len(new)} new pages ({edges(new)} see-also links), "
+          f"{len(orig)} original pages ({edges(orig)} links), "
+          f"{len(report)} pages differ")
+    return 0
+
+def main(argv):
+    if '--batch' in argv[1:]:
+        return batch(argv)
+    if len(argv) < 2 or argv[1].startswith('-'):
+        usage()
+        return 1
+
+    # Get input and optional output files
+    in_fname = argv[1]
+    out_fname = argv[2] if len(argv) > 2 else ""
+
+    with open(in_fname) as fp:
+        output_lines = seealso_lines(fp)
+
+    if (out_fname):
+        with open(out_fname,'w') as outfile:
+            for line in output_lines:
+                print(line, file=outfile)
+    else:
+        for line in output_lines:
+            print(line)
+    return 0
 
-SEEALSO=False
-seealsolist=""
-
-# Walk through all the lines, looking for "see also". 
-# Output all lines after "See Also"
-
-for i in range(len(in_lines)):
-  curline = in_lines[i].rstrip()
-  curline = curline.lstrip()
-  if seealso.match(curline):
-    SEEALSO=True
-
-  if SEEALSO:
-    output_lines.append(curline)
-
-if (out_fname):
-  with open(out_fname,'w') as outfile:
-    sys.stdout = outfile
-    for line in output_lines:
-      
-      print(line) 
-else:
-    for line in output_lines:
-      print(line) 
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
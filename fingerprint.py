@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+# This script checks that the conversion kept what matters in each man page,
+# without rendering anything: it reads the original nroff sources (*.Nin)
+# and the rst pages written by fixup_rst.py and compares a fingerprint of
+# each.
+#
+# Fingerprint of a page
+#  - sections   the section titles, upper-cased, in order (NAME and the
+#               page title left out)
+#  - params     the parameter names of the PARAMETER sections
+#  - literal    the lines of the literal and code blocks, with white space
+#               and ';' removed (fixup_rst.py drops ';' from SYNOPSIS code)
+#  - seealso    the pages named in the SEE ALSO section, lower-cased
+#               (an .nf block there too: fixup_rst.py puts the whole
+#               section in a ".. seealso::" block)
+#  - alias      for a ".so" page, the page it includes
+#
+# Only the nroff sources are checked.  The md pages (*.N.md), and the
+# nroff pages whose rst page is made from an md page next to them, are
+# left out.
+#
+# For each page the report lists what the rst page lost (missing) or gained
+# (extra) in each part of the fingerprint.  Exits with 1 if any page
+# differs, so it can run on every commit.  --trace <file> appends an event
+# per page to a trace (see buildtrace.py).
+#
+# Usage (from the top of the ompi tree)
+#  fingerprint.py [--rst <rst_dir>] [--jobs <n>] [--report <json_file>]
+#                 [--trace <trace_file>] [<man_dir> ...]
+
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+import sys
+import time
+
+import buildtrace
+import fixcommon
+import man2rst
+
+APPNAME=os.path.basename(__file__)
+
+MANDIRS=["ompi/mpi/man", "ompi/mpiext", "ompi/tools", "oshmem/shmem/man",
+         "opal/tools/wrappers", "oshmem/tools/oshmem_info"]
+
+# PATTERNS
+# nroff
+macro_pat = re.compile(r"^\.([A-Za-z]+)\s*(.*)$")
+escape_pat = re.compile(r"\\f[BIRP]|\\&|\\(?=-)")
+comment_pat = re.compile(r"^[.']\s*\\\"")
+# rst
+underline_pat = re.compile(r"^([=\-^~])\1*$")
+param_pat = re.compile(r"^\* ``(.*?)``:")
+literal_start_pat = re.compile(r"^(::|\.\. code-block::)")
+include_pat = re.compile(r"^\.\. include:: \.\./(\S+)\.rst")
+seealso_pat = re.compile(r"^\s*\.\. seealso::")
+ref_pat = re.compile(r":ref:`([^`]*)`")
+# both
+paramsect_pat = re.compile(".*PARAMETER")
+pagename_pat = re.compile(r"([A-Za-z][A-Za-z0-9_.]*)(\([0-9][a-z]*\))?")
+
+def new_fingerprint():
+    return {"sections": [], "params": [], "literal": [], "seealso": set(),
+            "alias": None}
+
+def literal_line(line):
+    return "".join(line.replace(';', '').split())
+
+def page_names(text):
+    names = set()
+    for match in pagename_pat.finditer(text):
+        name, section = match.groups()
+        name = name.rstrip('.')
+        if section or '_' in name:
+            names.add(name.lower())
+    return names
+
+def nroff_fingerprint(fname):
+    fp = new_fingerprint()
+    section = ""
+    literal = False
+    term = False
+    with open(fname, errors='replace') as src:
+        lines = src.readlines()
+    so_lines = [line for line in lines if man2rst.so_pat.match(line)]
+    if len(so_lines) == 1:
+        fields = so_lines[0].split()
+        fp["alias"] = fields[1] if len(fields) > 1 else ""
+        return fp
+    for line in lines:
+        line = line.rstrip('\n')
+        if comment_pat.match(line):
+            continue
+        text = escape_pat.sub('', line)
+        match = macro_pat.match(line)
+        macro = match.group(1) if match else None
+        if literal:
+            if macro == 'fi':
+                literal = False
+            elif not macro and literal_line(text):
+                fp["literal"].append(literal_line(text))
+            continue
+        if macro in ('SH', 'SS'):
+            section = " ".join(man2rst.roff_args(escape_pat.sub('', match.group(2)))).upper()
+            if section != "NAME":
+                fp["sections"].append(section)
+        elif macro == 'nf' and section != "SEE ALSO":
+            literal = True
+        elif macro == 'TP':
+            term = paramsect_pat.match(section) is not None
+        elif term and (not macro or macro in ('B', 'I')):
+            if macro:
+                text = " ".join(man2rst.roff_args(escape_pat.sub('', match.group(2))))
+            fp["params"].append(text.strip())
+            term = False
+        elif section == "SEE ALSO" and not macro:
+            fp["seealso"] |= page_names(text)
+    return fp
+
+def rst_fingerprint(fname):
+    fp = new_fingerprint()
+    with open(fname, errors='replace') as src:
+        lines = [line.rstrip('\n') for line in src]
+    title_seen = False
+    literal = False
+    seealso = False
+    for i, line in enumerate(lines):
+        match = include_pat.match(line)
+        if match:
+            fp["alias"] = match.group(1)
+            return fp
+        if seealso:
+            fp["seealso"] |= {ref.lower() for ref in ref_pat.findall(line)}
+            fp["seealso"] |= page_names(ref_pat.sub('', line))
+            continue
+        if seealso_pat.match(line):
+            fp["sections"].append("SEE ALSO")
+            seealso = True
+            fp["seealso"] |= page_names(seealso_pat.sub('', line))
+            fp["seealso"] |= {ref.lower() for ref in ref_pat.findall(line)}
+            continue
+        if (line.strip() and i+1 < len(lines) and underline_pat.match(lines[i+1])
+                and not underline_pat.match(line)):
+            literal = False
+            if title_seen:
+                fp["sections"].append(line.strip().upper())
+            title_seen = True
+            continue
+        if literal_start_pat.match(line):
+            literal = True
+            continue
+        if literal:
+            if line and not line[0].isspace():
+                literal = False
+            elif literal_line(line):
+                fp["literal"].append(literal_line(line))
+                continue
+        match = param_pat.match(line)
+        if match:
+            fp["params"].append(match.group(1).strip())
+    return fp
+
+def _sequence_diff(old, new):
+    missing = list(old)
+    extra = list()
+    for item in new:
+        if item in missing:
+            missing.remove(item)
+        else:
+            extra.append(item)
+    return missing, extra
+
+# Compare one page.  Returns its report entry, or None if it matches.
+def compare(source, rst):
+    entry = {"source": source, "rst": rst}
+    if not os.path.exists(rst):
+        entry["error"] = "no rst page"
+        return entry
+    old = nroff_fingerprint(source)
+    new = rst_fingerprint(rst)
+    differs = False
+    if old["alias"] is not None or new["alias"] is not None:
+        old_alias = old["alias"] and os.path.basename(old["alias"])
+        new_alias = new["alias"] and os.path.basename(new["alias"])
+        if old_alias != new_alias:
+            entry["alias"] = {"source": old["alias"], "rst": new["alias"]}
+            return entry
+        return None
+    for part in ("sections", "params", "literal"):
+        missing, extra = _sequence_diff(old[part], new[part])
+        if missing or extra:
+            entry[part] = {"missing": missing, "extra": extra}
+            differs = True
+    if old["seealso"] != new["seealso"]:
+        entry["seealso"] = {"missing": sorted(old["seealso"] - new["seealso"]),
+                            "extra": sorted(new["seealso"] - old["seealso"])}
+        differs = True
+    return entry if differs else None
+
+# compare, and the time it took
+def compare_timed(source, rst):
+    start = time.monotonic()
+    entry = compare(source, rst)
+    return entry, time.monotonic() - start
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('man_dirs', nargs='*', default=MANDIRS)
+    parser.add_argument('--rst', default="./rst/")
+    parser.add_argument('--jobs', type=int, default=fixcommon.default_jobs())
+    parser.add_argument('--report', default=None)
+    parser.add_argument('--trace', default=None)
+    args = parser.parse_args(argv[1:])
+
+    pairs = [(source, os.path.join(args.rst, man2rst.rst_name(source)))
+             for source in man2rst.find_sources(args.man_dirs)
+             if not os.path.exists(f"{source[:-len('in')]}.md")]
+    report = list()
+    start = time.monotonic()
+    with buildtrace.Trace(args.trace) as trace, \
+         concurrent.futures.ProcessPoolExecutor(max(1, args.jobs)) as pool:
+        futures = [pool.submit(compare_timed, source, rst) for source, rst in pairs]
+        for (source, rst), future in zip(pairs, futures):
+            entry, seconds = future.result()
+            trace.page("fingerprint", source, "differs" if entry else "ok", rst=rst,
+                       seconds=round(seconds, 6), in_bytes=buildtrace.file_size(source),
+                       out_bytes=buildtrace.file_size(rst))
+            if entry:
+                report.append(entry)
+        trace.stage("fingerprint", pages=len(pairs), differ=len(report),
+                    wall=round(time.monotonic() - start, 3))
+
+    for entry in report:
+        print(f"{entry['source']}:")
+        if "error" in entry:
+            print(f"   {entry['error']}")
+        if "alias" in entry:
+            print(f"   includes {entry['alias']['source']}, rst includes {entry['alias']['rst']}")
+        for part in ("sections", "params", "literal", "seealso"):
+            if part in entry:
+                for kind in ("missing", "extra"):
+                    if entry[part][kind]:
+                        print(f"   {part} {kind}: {', '.join(entry[part][kind])}")
+    if args.report:
+        with open(args.report, 'w') as fp:
+            json.dump({"pages": report}, fp, indent=1)
+    print(f"{APPNAME}: {len(pairs)} pages compared, {len(report)} differ")
+    return 1 if report else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
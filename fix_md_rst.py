@@ -15,49 +15,30 @@
 # See Also
 #  - Convert existing "SEE ALSO" sections into ".. :seealso::" 
 #  - Note that some SEE ALSO sections still require hand-editing.
+#
+# Usage
+#  fix_md_rst.py <input_file> [<output_file>]
+#  fix_md_rst.py --batch <input_dir> <output_dir>
+#  fix_md_rst.py --manifest <manifest_file>
+#
+# The batch forms fix every page in one process; see fixcommon.py.
+# Pages are streamed: lines are read and written as they are fixed.
+# The block structure of a page comes from rstdoc.py.
 
 import re
 import sys
 import os
 
-APPNAME=os.path.basename(__file__)
-DIRNAME=os.path.dirname(__file__)
-ALLREFSFILE=DIRNAME + "/allrefs.txt"
-SEEALSO=False
-INDENT=""
-
-def usage():
-    print(f"{APPNAME} <input_file> [<output_file>]\n")
-
-# Get input and optional output files
-in_fname = sys.argv[1]
-CMDNAME = os.path.basename(in_fname).rsplit('.',100)[0]
-
-# optionally print to output file
-out_fname=""
-if (len(sys.argv) > 2):
-    out_fname=sys.argv[2]
-
-# Populate list of all labels 
-with open(ALLREFSFILE) as fp:
-    allrefs_list = [line.rstrip('\n') for line in fp]
-
-
-# append to output_lines instead of printing lines
-output_lines = list()
-
-# if current file's CMDNAME is not in list, print out warning
-if not CMDNAME.lower() in allrefs_list:
-  print("WARNING: {} not in allrefs_list\n".format(CMDNAME.lower()))
-
-# Add a reference for each file
-refline=".. _{}:\n".format(CMDNAME.lower())
+import fixcommon
+import rstdoc
 
-output_lines.append(refline)
+APPNAME=os.path.basename(__file__)
 
+# PATTERNS
 # delimiter line (occurs after the heading text)
-dline=re.compile("^[=]+$")
+dline=re.compile("^[=]+")
 d2line=re.compile("^[-]+$")
+heading_pat=re.compile("^[=]+|^[-]+$")
 
 # literal
 codeblock=re.compile("\.\. .*code::")
@@ -72,141 +53,124 @@ name=re.compile("^name$", flags=re.IGNORECASE | re.MULTILINE)
 seealso = re.compile("^see also$", flags = re.IGNORECASE )
 mpicmd = re.compile(".*MPI[_A-Z0-9]", flags = re.IGNORECASE )
 shmemcmd = re.compile(".*shmem[_A-Z0-9]", flags = re.IGNORECASE )
+mpiseealso_pat = re.compile(r'([^A-Za-z]*)([Mm][Pp][Ii][^\\ (]*)(.*)')
+shmemseealso_pat = re.compile(r'([^A-Za-z]*)([Ss][Hh][Mm][Ee][Mm][^\\ (]*)(.*)')
+
+# cross-reference candidates
+mpiref_pat = re.compile(r'[\*]*[\`]*MPI_[A-Z][\*,()\[\]0-9A-Za-z_]*[()\[\]0-9A-Za-z_][\`]*[\*]*')
+shmemref_pat = re.compile(r'[\*]*[\`]*[Ss][Hh][Mm][Ee][Mm]_[A-Za-z][\*,()\[\]0-9A-Za-z_]*[()\[\]0-9A-Za-z_][\`]*[\*]*')
 
 # do not add as cross-ref
 function_call=re.compile(".*\(\)", re.IGNORECASE)
 brace_char=re.compile(".*[\]\(\)]", re.IGNORECASE)
 
-# repl functions
-# :ref:`my-reference-label`:
-def cmdrepl(match):
-    match = match.group()
-    match = match.replace('(3)','')
-    match = match.replace('(2)','')
-    match = match.replace('(1)','')
-    match = match.replace('`','')
-    match = match.replace('*','')
-    if match.lower() in allrefs_list:
-        return (':ref:`' + match + '`')
-    else:
-        return (match)
-
-def seealso_repl(match):
-    thecmd = match.group(2)
-    thecmd = thecmd.replace('`','')
-    thecmd = thecmd.replace('*','')
-    if thecmd.lower() in allrefs_list:
-        return (':ref:`' + thecmd + '` ')
-    else:
-        return (thecmd)
-
-# Read input as an array of lines
-with open(in_fname) as fp:
-    in_lines = fp.readlines()
-
-# PATTERNS
-# delimiter line (occurs after the heading text)
-dline=re.compile("^[=]+")
-
 # find SYNOPSIS (to remove ';'
 SYNOPSIS_pat = re.compile("^SYNOPSIS")
 
 # find lines that include the pattern "#include <"
 codeblockinclude=re.compile(".*\#include \<")
 
-# So we don't repeat combined or replaced lines
-SKIP=0
-
-# keep track of state
-LITERAL=True
-seealsolist=""
-INCODEBLOCK=False
-INCODEBLOCKINCLUDE=False
-INSYNOPSIS=False
+# What a block looks like in an rst page generated from md (see rstdoc.py)
+GRAMMAR = rstdoc.Grammar(underline=heading_pat, level1=dline,
+                         literal=codeblock, seealso=seealso)
 
-# Walk through all the lines, working on a section at a time
-# If the current line contains 'code::' then LITERAL=True 
-# If we hit a delimiter, then LITERAL=False
-# If LITERAL == False, then add references to all MPI commands. 
-for i in range(len(in_lines)):
-  curline = in_lines[i].rstrip()
-  nextline = curline
+# Fix up the lines of one rst page generated from md.  CMDNAME is the name
+# of the man page and allrefs the xref.LabelIndex of known labels.
+# in_lines can be any iterable of lines (e.g. an open file).  The page is
+# cut into sections by rstdoc.parse, so every line is looked at once.
+# Yields the output lines.
+def fixup_lines(in_lines, CMDNAME, allrefs):
+  # MPI_* and shmem_* cross-reference scanner (see xref.py)
+  xrefs = allrefs.scanner(mpiref_pat, shmemref_pat)
 
-  if (i < (len(in_lines) - 1)):
-      nextline = in_lines[i+1].rstrip()
-
-  if name.match(curline) and dline.match(nextline):
-      # Substitute program name because html index needs it.
-      # Only substitute delimeter for the first NAME heading because 
-      # build-doc seems to expect a single-rooted hierarchy.
-      output_lines.append(f"\n{CMDNAME}\n{re.sub('[A-Z,a-z,0-9,_,-, ]','=',CMDNAME)}")
-      output_lines.append("\n.. include_body\n")
-      SKIP += 2
+  def seealso_repl(match):
+    thecmd = match.group(2)
+    thecmd = thecmd.replace('`','')
+    thecmd = thecmd.replace('*','')
+    linked = thecmd in allrefs
+    allrefs.note_ref(linked)
+    if linked:
+      return (':ref:`' + thecmd + '` ')
+    else:
+      return (thecmd)
+
+  # if current file's CMDNAME is not in list, print out warning
+  # (on stderr, so a caller's stdout holds only what it prints itself)
+  if not CMDNAME in allrefs:
+    print("WARNING: {} not in allrefs_list\n".format(CMDNAME.lower()), file=sys.stderr)
+
+  # Add a reference for each file
+  refline=".. _{}:\n".format(CMDNAME.lower())
+
+  yield refline.rstrip()
+
+  # keep track of state
+  LITERAL=True
+  INCODEBLOCK=False
+  INCODEBLOCKINCLUDE=False
+
+  # If the current line contains 'code::' then LITERAL=True
+  # If we hit a delimiter, then LITERAL=False
+  # If LITERAL == False, then add references to all MPI commands.
+  def fix_line(curline):
+    nonlocal LITERAL, INCODEBLOCK, INCODEBLOCKINCLUDE
+    if codeblock.match(curline):
+      LITERAL=True
+      INCODEBLOCK=True
+    elif dline.match(curline):
       LITERAL=False
       INCODEBLOCK=False
-  
-  if seealso.match(curline) and dline.match(nextline):
-      SKIP += 2
+      curline = re.sub('=','-',curline)
+    elif d2line.match(curline):
       LITERAL=False
-      SEEALSO=True
-      INDENT="   "
-      d=1
-      seealsoline=""
-      while (d+i < len(in_lines)):
-        sline=in_lines[i+d].rstrip()
+      curline = re.sub('-','^',curline)
+
+    if not LITERAL and curline:
+      curline = xrefs.sub(curline)
+    elif LITERAL:
+      if INCODEBLOCK:
+        if codeblockinclude.match(curline):
+          INCODEBLOCKINCLUDE = True
+        else:
+          if INCODEBLOCKINCLUDE:
+            INCODEBLOCKINCLUDE = False
+            if (curline.rstrip() != ""):
+              yield ""
+    yield f"{curline}".rstrip()
+
+  # Walk through the page a section at a time
+  for section in rstdoc.parse(in_lines, GRAMMAR):
+    heading = section.heading
+    if section.blocks and isinstance(section.blocks[0], rstdoc.SeeAlso):
+      seealsolist=""
+      for sline in section.blocks[0].lines:
         cmdline=""
         if mpicmd.match(sline):
-          cmdline=re.sub(r'([^A-Za-z]*)([Mm][Pp][Ii][^\\ (]*)(.*)',seealso_repl,sline)
+          cmdline=mpiseealso_pat.sub(seealso_repl,sline)
         elif shmemcmd.match(sline):
-          cmdline=re.sub(r'([^A-Za-z]*)([Ss][Hh][Mm][Ee][Mm][^\\ (]*)(.*)',seealso_repl,sline)
-        else: 
-          SKIP += 1
+          cmdline=shmemseealso_pat.sub(seealso_repl,sline)
         seealsolist=f"{seealsolist}{cmdline}"
-        SKIP += 1
-        d+=1
-      output_lines.append(f'\n.. seealso:: {seealsolist}')
+      yield f'\n.. seealso:: {seealsolist}'.rstrip()
       break
 
-  elif (SKIP == 0):
-      if codeblock.match(curline):
-        LITERAL=True
-        INCODEBLOCK=True
-      elif dline.match(curline):
-        LITERAL=False
-        INCODEBLOCK=False
-        curline = re.sub('=','-',curline)
-      elif d2line.match(curline):
-        LITERAL=False
-        curline = re.sub('-','^',curline)
-
-      if not LITERAL and curline:
-        curline = re.sub(r'[\*]*[\`]*MPI_[A-Z][\*,()\[\]0-9A-Za-z_]*[()\[\]0-9A-Za-z_][\`]*[\*]*',cmdrepl,curline)
-        curline = re.sub(r'[\*]*[\`]*[Ss][Hh][Mm][Ee][Mm]_[A-Za-z][\*,()\[\]0-9A-Za-z_]*[()\[\]0-9A-Za-z_][\`]*[\*]*',cmdrepl,curline)
-      elif LITERAL:
-        if INCODEBLOCK:
-          if codeblockinclude.match(curline):
-            INCODEBLOCKINCLUDE = True
-          else:
-            if INCODEBLOCKINCLUDE:
-              INCODEBLOCKINCLUDE = False
-              if (curline.rstrip() != ""):
-                output_lines.append("")
-      output_lines.append(f"{curline}".rstrip())
-  else: 
-      SKIP -= 1
-
-#seealso='\n.. seealso::'
-#for k, v in seealsodict.items():
-#    if ( k != CMDNAME ):
-#        seealso=seealso + ' :ref:`' + k + '`'
-#
-#output_lines.append(seealso)
-
-if (out_fname):
-  with open(out_fname,'w') as outfile:
-    sys.stdout = outfile
-    for line in output_lines:
-      print(line.rstrip()) 
-else:
-    for line in output_lines:
-      print(line.rstrip()) 
+    if heading and name.match(heading.title) and dline.match(heading.underline):
+      # Substitute program name because html index needs it.
+      # Only substitute delimeter for the first NAME heading because
+      # build-doc seems to expect a single-rooted hierarchy.
+      yield f"\n{CMDNAME}\n{re.sub('[A-Z,a-z,0-9,_,-, ]','=',CMDNAME)}"
+      yield "\n.. include_body"
+      LITERAL=False
+      INCODEBLOCK=False
+    elif heading:
+      yield from fix_line(heading.title)
+      yield from fix_line(heading.underline)
+
+    for block in section.blocks:
+      if isinstance(block, rstdoc.Literal):
+        yield from fix_line(block.marker)
+      for curline in block.lines:
+        yield from fix_line(curline)
+
+
+if __name__ == "__main__":
+  sys.exit(fixcommon.main(fixup_lines, APPNAME, sys.argv))
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+
+# Helpers shared by fixup_rst.py and fix_md_rst.py.
+#
+# Both fixers expose a function that turns the lines of one pandoc-generated
+# rst page into the lines of the fixed page.  The helpers here load the
+# label list, read and write pages, and drive a fixer over a whole tree so
+# that a full run needs one interpreter instead of one per page.
+#
+# Batch mode
+#  - allrefs.txt is read once into a label index shared by every page.
+#  - Pages come from either a directory pair (every *.rst under the input
+#    directory is written to the same relative path under the output
+#    directory) or a manifest file with one "<input> <output>" pair per line.
+#  - A page that fails is reported and skipped; the rest of the run goes on.
+#  - --jobs N fans the pages out over N worker processes (default: one per
+#    CPU).  Each worker gets the label list once, when it starts.  Messages
+#    are collected per page and reported in input order, so the output
+#    tree and the log are the same as for a serial run (--jobs 1).
+#  - --cache <manifest> skips pages whose input and fixer source are
+#    unchanged since they were last fixed (see convcache.py), and which
+#    hold none of the labels added to or removed from allrefs.txt since
+#    (see tokenindex.py); --force fixes them all anyway.
+#  - An output page is only replaced if its contents changed, so the pages
+#    sphinx reads keep their times and a rebuild only reads what changed.
+#    The number of pages that changed is reported.
+#  - --trace <file> appends an event per page to a trace (see
+#    buildtrace.py): time, sizes, cross-references linked and not, and the
+#    warnings the fixer printed.
+
+import collections
+import contextlib
+import filecmp
+import io
+import multiprocessing
+import os
+import shutil
+import sys
+import inspect
+import time
+import traceback
+
+import buildtrace
+import convcache
+import tokenindex
+import xref
+
+DIRNAME=os.path.dirname(os.path.abspath(__file__))
+ALLREFSFILE=DIRNAME + "/allrefs.txt"
+
+# Populate the index of all labels
+def load_allrefs(fname=ALLREFSFILE):
+    return xref.LabelIndex.from_file(fname)
+
+# Name of the man page, e.g. MPI_Send for .../MPI_Send.3.rst
+def get_cmdname(in_fname):
+    return os.path.basename(in_fname).rsplit('.',100)[0]
+
+# Lines kept behind the current one by LineWindow.
+HISTORY=64
+# Write buffer for output pages.
+WRITEBUF=1 << 16
+
+# Iterate over a stream of lines while still being able to index the lines
+# around the current one, as the fixers did with a list from readlines().
+# Lines ahead are read only when asked for, and only the last HISTORY
+# lines are kept, so memory does not grow with the size of the page.
+class LineWindow:
+    def __init__(self, lines, history=HISTORY):
+        self.lines = iter(lines)
+        self.ahead = collections.deque()
+        self.behind = collections.deque(maxlen=history)
+        self.current = None
+        self.pos = -1
+
+    def __iter__(self):
+        while self.ahead or self._fill(1):
+            if self.pos >= 0:
+                self.behind.append(self.current)
+            self.current = self.ahead.popleft()
+            self.pos += 1
+            yield self.current
+
+    # Read until n lines are waiting ahead; False at end of input.
+    def _fill(self, n):
+        while len(self.ahead) < n:
+            try:
+                self.ahead.append(next(self.lines))
+            except StopIteration:
+                return False
+        return True
+
+    # True if line number i can still be read.
+    def has(self, i):
+        if i > self.pos:
+            return self._fill(i - self.pos)
+        return i >= 0 and i > self.pos - len(self.behind) - 1
+
+    def is_last(self):
+        return not self.has(self.pos + 1)
+
+    def __getitem__(self, i):
+        if i == self.pos:
+            return self.current
+        if not self.has(i):
+            raise IndexError(f"line {i} is outside the window")
+        if i > self.pos:
+            return self.ahead[i - self.pos - 1]
+        return self.behind[i - self.pos]
+
+# Put a finished temporary file in place of out_fname, unless out_fname
+# already has the same contents (sizes are compared first, then the bytes).
+# Returns whether out_fname changed.
+def replace_if_changed(tmp, out_fname):
+    try:
+        same = filecmp.cmp(tmp, out_fname, shallow=False)
+    except OSError:
+        same = False
+    if same:
+        os.remove(tmp)
+        return False
+    os.replace(tmp, out_fname)
+    return True
+
+# Copy src to dst the same way.  Returns whether dst changed.
+def copy_if_changed(src, dst):
+    try:
+        if filecmp.cmp(src, dst, shallow=False):
+            return False
+    except OSError:
+        pass
+    tmp = f"{dst}.tmp{os.getpid()}"
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+    return True
+
+# Write one line per entry, as print() would have.  Lines may come from a
+# generator; they are written through a large buffer as they are produced.
+# An output file is written to a temporary name and renamed when complete,
+# so a page that fails part way leaves the old output alone, and only if
+# it differs from the old output.  Returns whether the output changed.
+def write_lines(out_fname, lines):
+    if not out_fname:
+        sys.stdout.writelines(f"{line}\n" for line in lines)
+        return True
+    tmp = f"{out_fname}.tmp{os.getpid()}"
+    try:
+        with open(tmp, 'w', buffering=WRITEBUF) as outfile:
+            outfile.writelines(f"{line}\n" for line in lines)
+        return replace_if_changed(tmp, out_fname)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+# Pair every *.rst under in_dir with the same relative path under out_dir.
+# Sorted so that batch runs always visit pages in the same order.
+def find_pages(in_dir, out_dir):
+    pairs = list()
+    for root, dirs, files in os.walk(in_dir):
+        dirs.sort()
+        for fname in sorted(files):
+            if fname.endswith('.rst'):
+                in_fname = os.path.join(root, fname)
+                rel = os.path.relpath(in_fname, in_dir)
+                pairs.append((in_fname, os.path.join(out_dir, rel)))
+    return pairs
+
+# Manifest: one "<input> <output>" pair per line, '#' starts a comment.
+def read_manifest(fname):
+    pairs = list()
+    with open(fname) as fp:
+        for line in fp:
+            line = line.split('#',1)[0].strip()
+            if not line:
+                continue
+            fields = line.split()
+            if len(fields) != 2:
+                raise ValueError(f"{fname}: expected '<input> <output>': {line}")
+            pairs.append((fields[0], fields[1]))
+    return pairs
+
+# Fix one page.  fixfunc(in_lines, cmdname, allrefs) yields the output
+# lines; allrefs is an xref.LabelIndex.  Returns whether the output changed.
+def fix_page(fixfunc, in_fname, out_fname, allrefs):
+    if out_fname:
+        os.makedirs(os.path.dirname(out_fname) or '.', exist_ok=True)
+    with open(in_fname) as fp:
+        return write_lines(out_fname, fixfunc(fp, get_cmdname(in_fname), allrefs))
+
+# Fix one page, capturing what the fixer prints (warnings, on stderr).
+# Returns (messages, error, changed, names, stats); error is None or the
+# formatted traceback, names the names the page looked up in allrefs, stats
+# the page's figures for the trace (see buildtrace.py).
+def fix_page_captured(fixfunc, in_fname, out_fname, allrefs):
+    messages = io.StringIO()
+    allrefs.take_seen()
+    allrefs.take_counts()
+    start = time.monotonic()
+    try:
+        with contextlib.redirect_stdout(messages), contextlib.redirect_stderr(messages):
+            changed = fix_page(fixfunc, in_fname, out_fname, allrefs)
+        error = None
+    except Exception:
+        changed = False
+        error = traceback.format_exc()
+    stats = {"seconds": round(time.monotonic() - start, 6),
+             "in_bytes": buildtrace.file_size(in_fname),
+             "out_bytes": buildtrace.file_size(out_fname),
+             **allrefs.take_counts(),
+             "warnings": buildtrace.warning_lines(messages.getvalue())}
+    if error:
+        return (messages.getvalue(), error, False, set(), stats)
+    return (messages.getvalue(), None, changed, allrefs.take_seen(), stats)
+
+# Per-process state of the run_batch workers, set once by _init_worker.
+_worker_fixfunc = None
+_worker_allrefs = None
+
+def _init_worker(fixfunc, allrefs):
+    global _worker_fixfunc, _worker_allrefs
+    _worker_fixfunc = fixfunc
+    _worker_allrefs = allrefs
+
+def _fix_in_worker(pair):
+    return fix_page_captured(_worker_fixfunc, pair[0], pair[1], _worker_allrefs)
+
+def default_jobs():
+    return os.cpu_count() or 1
+
+# Fix every (input, output) pair, returning the list of pages that failed,
+# the number of output pages that changed and the names each output page
+# looked up in allrefs.
+# With jobs > 1 the pages are fixed by a pool of worker processes.
+# Each page is written to trace, if given, as a page of the stage.
+def run_batch(fixfunc, pairs, allrefs, jobs=1, verbose=True, trace=None, stage=None):
+    if jobs > 1 and len(pairs) > 1:
+        jobs = min(jobs, len(pairs))
+        chunksize = max(1, len(pairs) // (jobs * 8))
+        pool = multiprocessing.Pool(jobs, _init_worker, (fixfunc, allrefs))
+        results = pool.imap(_fix_in_worker, pairs, chunksize)
+    else:
+        pool = None
+        results = (fix_page_captured(fixfunc, in_fname, out_fname, allrefs)
+                   for in_fname, out_fname in pairs)
+
+    failed = list()
+    changed = 0
+    seen = dict()
+    try:
+        for (in_fname, out_fname), (messages, error, page_changed, names, stats) in zip(pairs, results):
+            if verbose:
+                print(f"Fixing {in_fname} as {out_fname}")
+            sys.stderr.write(messages)
+            if error:
+                print(f"ERROR: could not fix {in_fname}", file=sys.stderr)
+                sys.stderr.write(error)
+                failed.append(in_fname)
+            changed += page_changed
+            seen[out_fname] = names
+            if trace:
+                trace.page(stage, out_fname, "failed" if error else "ok",
+                           source=in_fname, changed=page_changed, **stats)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return failed, changed, seen
+
+# Source files of a module and of the modules of its directory it
+# imports, directly or not (for a fixer: rstdoc.py, xref.py, this file...).
+def _local_sources(module):
+    appdir = os.path.dirname(os.path.abspath(module.__file__))
+    sources = set()
+    todo = [module]
+    while todo:
+        module = todo.pop()
+        fname = getattr(module, '__file__', None)
+        if (not fname or fname in sources
+            or os.path.dirname(os.path.abspath(fname)) != appdir):
+            continue
+        sources.add(fname)
+        todo.extend(value for value in vars(module).values()
+                    if inspect.ismodule(value))
+    return sorted(sources)
+
+# Version of a fixer for the conversion cache: its own source and that of
+# every module of this directory it uses.
+def fixer_version(fixfunc):
+    return convcache.hash_files(_local_sources(inspect.getmodule(fixfunc)))
+
+# True if a fixed page can be kept: its input and the fixer are unchanged
+# (cache) and no label it looked up was added or removed (index).
+def is_fresh(cache, index, stage, in_fname, out_fname, tool):
+    return (cache.is_fresh(stage, in_fname, out_fname, tool=tool)
+            and index.is_current(out_fname))
+
+# Run a batch through the conversion cache, fixing only stale pages.
+def run_cached(fixfunc, appname, pairs, allrefs, jobs, cache_file, force, trace=None):
+    cache = convcache.ConversionCache(cache_file, force)
+    stage = appname.replace('.py','')
+    index = tokenindex.TokenIndex(tokenindex.index_file(cache_file, stage),
+                                  allrefs.labels)
+    tool = fixer_version(fixfunc)
+    stale = [(in_fname, out_fname) for in_fname, out_fname in pairs
+             if not is_fresh(cache, index, stage, in_fname, out_fname, tool)]
+    failed, changed, seen = run_batch(fixfunc, stale, allrefs, jobs,
+                                      trace=trace, stage=stage)
+    if trace:
+        stale_outputs = {out_fname for _, out_fname in stale}
+        for in_fname, out_fname in pairs:
+            if out_fname not in stale_outputs:
+                trace.page(stage, out_fname, "skipped", source=in_fname)
+    for in_fname, out_fname in stale:
+        if in_fname in failed:
+            cache.forget(out_fname)
+            index.forget(out_fname)
+        else:
+            cache.record(stage, in_fname, out_fname, tool=tool)
+            index.record(out_fname, seen[out_fname])
+    cache.save()
+    index.save()
+    for line in cache.report():
+        print(f"{appname}: cache {line}")
+    print(f"{appname}: {len(index.affected)} pages affected by label changes")
+    return failed, changed
+
+def usage(appname):
+    print(f"{appname} [--allrefs <allrefs_file>] <input_file> [<output_file>]\n"
+          f"{appname} [options] --batch <input_dir> <output_dir>\n"
+          f"{appname} [options] --manifest <manifest_file>\n"
+          f"options: --allrefs <allrefs_file> --jobs <n> --cache <manifest> --force\n"
+          f"         --trace <trace_file>\n")
+
+# Command line entry point shared by both fixers.
+def main(fixfunc, appname, argv):
+    args = argv[1:]
+    allrefs_file = ALLREFSFILE
+    jobs = default_jobs()
+    cache_file = ""
+    trace_file = ""
+    force = False
+    while args and args[0] in ('--allrefs', '--jobs', '--cache', '--force', '--trace'):
+        if args[0] == '--force':
+            force = True
+            args = args[1:]
+            continue
+        if len(args) < 2:
+            break
+        if args[0] == '--allrefs':
+            allrefs_file = args[1]
+        elif args[0] == '--jobs':
+            jobs = int(args[1])
+        elif args[0] == '--trace':
+            trace_file = args[1]
+        else:
+            cache_file = args[1]
+        args = args[2:]
+
+    if not args or args[0] in ('-h', '--help'):
+        usage(appname)
+        return 1
+
+    allrefs = load_allrefs(allrefs_file)
+    if args[0] == '--batch' and len(args) == 3:
+        pairs = find_pages(args[1], args[2])
+    elif args[0] == '--manifest' and len(args) == 2:
+        pairs = read_manifest(args[1])
+    elif not args[0].startswith('--') and len(args) <= 2:
+        out_fname = args[1] if len(args) > 1 else ""
+        fix_page(fixfunc, args[0], out_fname, allrefs)
+        return 0
+    else:
+        usage(appname)
+        return 1
+
+    stage = appname.replace('.py','')
+    start = time.monotonic()
+    with buildtrace.Trace(trace_file) as trace:
+        if cache_file:
+            failed, changed = run_cached(fixfunc, appname, pairs, allrefs, jobs,
+                                         cache_file, force, trace)
+        else:
+            failed, changed, seen = run_batch(fixfunc, pairs, allrefs, jobs,
+                                              trace=trace, stage=stage)
+        trace.stage(stage, pages=len(pairs), failed=len(failed), changed=changed,
+                    wall=round(time.monotonic() - start, 3))
+    print(f"{appname}: fixed {len(pairs) - len(failed)} of {len(pairs)} pages, "
+          f"{changed} changed")
+    for fname in failed:
+        print(f"{appname}: FAILED {fname}")
+    return 1 if failed else 0
@@ -9,7 +9,7 @@
 #  - Replace the top-level NAME heading with the name of the man page.
 #
 # Cross References
-#  - Put list of labels from all files into a dictionary, then turn MPI_*
+#  - Put list of labels from all files into a hashed index, then turn MPI_*
 #    and shmem_* into cross reference labels if in that dictionary and 
 #    not in a literal section:
 #        :ref:`my-reference-label`:
@@ -25,49 +25,24 @@
 # See Also
 #  - Convert existing "SEE ALSO" sections into ".. :seealso::" 
 #  - Note that some SEE ALSO sections still require hand-editing.
+#
+# Usage
+#  fixup_rst.py <input_file> [<output_file>]
+#  fixup_rst.py --batch <input_dir> <output_dir>
+#  fixup_rst.py --manifest <manifest_file>
+#
+# The batch forms fix every page in one process; see fixcommon.py.
+# Pages are streamed: lines are read and written as they are fixed.
+# The block structure of a page comes from rstdoc.py.
 
 import re
 import sys
 import os
-from pathlib import Path
-
-APPNAME=os.path.basename(__file__)
-DIRNAME=os.path.dirname(__file__)
-ALLREFSFILE=DIRNAME + "/allrefs.txt"
-
-def usage():
-    print(f"{APPNAME} <input_file> [<output_file>]\n")
-
-# Get input and optional output files
-in_fname = sys.argv[1]
-CMDNAME = os.path.basename(in_fname).rsplit('.',100)[0]
-PARENTPATH = os.path.dirname(in_fname)
-
-out_fname=""
-if (len(sys.argv) > 2):
-    out_fname=sys.argv[2]
-
-output_lines = list()
-
-# Populate list of all labels 
-with open(ALLREFSFILE) as fp:
-    allrefs_list = [line.rstrip('\n') for line in fp]
-
-# if current file's CMDNAME is not in list, print out warning
-if not CMDNAME.lower() in allrefs_list:
-  print("WARNING: {} not in allrefs_list\n".format(CMDNAME.lower()))
 
-# Add a reference for each file to enable cross-references
-refline=".. _{}:\n".format(CMDNAME.lower())
-output_lines.append(refline)
-output_lines.append("")
+import fixcommon
+import rstdoc
 
-output_lines.append(f"{CMDNAME}\n{re.sub('[A-Z,a-z,0-9,_,-, ]','=',CMDNAME)}")
-output_lines.append("\n.. include_body\n")
-
-# Read input as an array of lines
-with open(in_fname) as fp:
-    in_lines = fp.readlines()
+APPNAME=os.path.basename(__file__)
 
 # PATTERNS
 # include file
@@ -107,6 +82,12 @@ codeblockinclude=re.compile(".*\#include \<")
 # codeblock pattern
 literalpat=re.compile("^::")
 
+# cross-reference candidates; the last line of a page uses a looser pattern
+mpiref_pat = re.compile(r'[\*]*[\`]*MPI_[A-Z][\*,()\[\]0-9A-Za-z_]*[()\[\]0-9A-Za-z_][\`]*[\*]*')
+shmemref_pat = re.compile(r'[\*]*[\`]*shmem_[A-Za-z][\*,()\[\]0-9A-Za-z_]*[()\[\]0-9A-Za-z_][\`]*[\*]*')
+mpiref_last_pat = re.compile(r'[\*]*[\`]*MPI_[A-Z][\*,()\[\]0-9A-Za-z_]*[()\[\]0-9A-Za-z_]*[\`]*[\*]*')
+shmemref_last_pat = re.compile(r'[\*]*[\`]*shmem_[A-Z][\*,()\[\]0-9A-Za-z_]*[()\[\]0-9A-Za-z_]*[\`]*[\*]*')
+
 # seealso
 seealso = re.compile("^see also$", flags = re.IGNORECASE )
 mpicmd = re.compile(".*MPI[_A-Z0-9]", flags = re.IGNORECASE )
@@ -125,32 +106,6 @@ fortran_lang=re.compile(".*Fortran", re.IGNORECASE)
 cpp_lang=re.compile(".*C\+\+", re.IGNORECASE)
 c_lang=re.compile(".*C[^a-zA-Z]", re.IGNORECASE)
 
-# repl functions
-# :ref:`my-reference-label`:
-def cmdrepl(match):
-    match = match.group()
-    match = match.replace('(3)','')
-    match = match.replace('(2)','')
-    match = match.replace('(1)','')
-    match = match.replace('`','')
-    match = match.replace('*','')
-    if match.lower() in allrefs_list:
-        return (':ref:`' + match + '`')
-    else:
-        return (match)
-
-def seealso_repl(match):
-    thecmd = match.group(1)
-    thecmd = thecmd.replace('`','')
-    thecmd = thecmd.replace('*','')
-    if thecmd.lower() in allrefs_list:
-        return (':ref:`' + thecmd + '` ')
-    else:
-        return (match)
-
-# for labeling codeblocks
-LANGUAGE="FOOBAR_ERROR"
-
 # We only need to detect languages that ompi supports
 # Just pick the first match.
 def get_cb_language(aline):
@@ -164,163 +119,162 @@ def get_cb_language(aline):
       LANG="c" 
     return(LANG)
 
-# for keeping track of state
-BULLETITEM=False
-LITERAL=False
-INCODEBLOCK=False
-INCODEBLOCKINCLUDE = False
-INSYNOPSIS = False
-PARAM=False
-SEEALSO=False
-INDENT=""
-seealsolist=""
-
-# So we don't repeat combined or replaced lines
-SKIP=0
-
-# Walk through all the lines, working on a section at a time
-# Leave LITERAL sections alone.
-# In PARAMETER sections, combine bullets into a single line.
-# If not a LITERAL section, list MPI commands as a reference:
-# :ref:`my-reference-label`:
-# If a code-block section, add notation.
-for i in range(len(in_lines)):
-  curline = in_lines[i].rstrip()
-  if unliteral.match(curline):
-    LITERAL=False
-    INCODEBLOCK=False
-  if (i > 0):
-    prevline = in_lines[i-1].rstrip()
-  if (i == len(in_lines) - 1):
-    if ((not include_pat.match(curline)) and (not LITERAL)):
-      curline = re.sub(r'[\*]*[\`]*MPI_[A-Z][\*,()\[\]0-9A-Za-z_]*[()\[\]0-9A-Za-z_]*[\`]*[\*]*',cmdrepl,curline)
-      curline = re.sub(r'[\*]*[\`]*shmem_[A-Z][\*,()\[\]0-9A-Za-z_]*[()\[\]0-9A-Za-z_]*[\`]*[\*]*',cmdrepl,curline)
-    if (not SKIP):
-      output_lines.append(f"{INDENT}{curline}".rstrip())
-  else:
-    nextline = in_lines[i+1].rstrip()
-    if (i + 3 < len(in_lines)):
-      nextnextnextline = in_lines[i+3].rstrip()
-    else:
-      nextnextnextline = ""
-    if dline.match(nextline):
-      LITERAL=False
+# What a block looks like in a pandoc-generated page (see rstdoc.py)
+GRAMMAR = rstdoc.Grammar(underline=dline, literal=literalpat, text=unliteral,
+                         listitem=listitem_pat, params=paramsect)
+
+# Fix up the lines of one pandoc-generated page.  CMDNAME is the name of
+# the man page and allrefs the xref.LabelIndex of known labels.
+# in_lines can be any iterable of lines (e.g. an open file).  The page is
+# cut into blocks by rstdoc.parse and each block is fixed as a whole, so
+# every line is looked at once.
+# Yields the output lines.
+def fixup_lines(in_lines, CMDNAME, allrefs):
+  # MPI_* and shmem_* cross-reference scanners (see xref.py)
+  xrefs = allrefs.scanner(mpiref_pat, shmemref_pat)
+  last_xrefs = allrefs.scanner(mpiref_last_pat, shmemref_last_pat)
+
+  # if current file's CMDNAME is not in list, print out warning
+  # (on stderr, so a caller's stdout holds only what it prints itself)
+  if not CMDNAME in allrefs:
+    print("WARNING: {} not in allrefs_list\n".format(CMDNAME.lower()), file=sys.stderr)
+
+  # Add a reference for each file to enable cross-references
+  refline=".. _{}:\n".format(CMDNAME.lower())
+  yield refline
+  yield ""
+
+  yield f"{CMDNAME}\n{re.sub('[A-Z,a-z,0-9,_,-, ]','=',CMDNAME)}"
+  yield "\n.. include_body\n"
+
+  # for keeping track of state
+  INCODEBLOCK=False
+  INCODEBLOCKINCLUDE = False
+  INSYNOPSIS = False
+  PARAM=False
+  INDENT=""
+
+  # The last line of the page uses the looser cross-reference pattern
+  def last_line(line):
+    if not include_pat.match(line):
+      line = last_xrefs.sub(line)
+    return f"{INDENT}{line}".rstrip()
+
+  # Walk through the page a section at a time.
+  # Leave literal blocks alone.
+  # In PARAMETER sections, combine each parameter into a single line.
+  # Elsewhere, list MPI commands as a reference:
+  # :ref:`my-reference-label`:
+  # If a code-block section, add notation.
+  for section in rstdoc.parse(in_lines, GRAMMAR):
+    blocks = section.blocks
+    heading = section.heading
+    if heading:
+      title = heading.title
       INCODEBLOCK=False
       PARAM=False
-      SKIP+=1
-      if (SYNOPSIS_pat.match(curline)):
-        INSYNOPSIS = True
-      else:
-        INSYNOPSIS = False
-
-      if seealso.match(curline):
-         output_lines.append('\n.. seealso::')
-         SEEALSO=True
-         INDENT="   "
-         SKIP += 1
-      # output from seealso to eof with indentation
-      elif paramsect.match(curline):
+      INSYNOPSIS = bool(SYNOPSIS_pat.match(title))
+
+      if seealso.match(title):
+        # output from seealso to eof with indentation
+        yield '\n.. seealso::'
+        INDENT="   "
+        if blocks and blocks[0] is rstdoc.BLANK:
+          blocks = blocks[1:]
+      elif paramsect.match(title):
         PARAM=True
-        output_lines.append(f"\n{curline}\n{re.sub('[A-Z,a-z,0-9,_,-, ]','-',curline)}".rstrip())
-      elif (curline.isupper()):
-        if (name.match(curline)):
-          SKIP+=1
+        yield f"\n{title}\n{re.sub('[A-Z,a-z,0-9,_,-, ]','-',title)}".rstrip()
+      elif (title.isupper()):
+        if (name.match(title)):
+          if blocks and blocks[0] is rstdoc.BLANK:
+            blocks = blocks[1:]
         else:
           # level 0 heading
-          output_lines.append(f"\n{curline}\n{re.sub('[A-Z,a-z,0-9,_,-, ]','-',curline)}".rstrip())
+          yield f"\n{title}\n{re.sub('[A-Z,a-z,0-9,_,-, ]','-',title)}".rstrip()
       else:
           # level 2 heading
-          output_lines.append(f"\n{curline}\n{re.sub('=','^',nextline)}".rstrip())
-    elif (literalpat.match(curline)):
-          LITERAL=True
-          prevlangline=prevline
-          nextlangline=nextline
-          d=1
-          while (not prevlangline) or dline.match(prevlangline):
-            prevlangline = in_lines[i-d].rstrip()
-            curlangline = in_lines[i-d+1].rstrip()
-            d += 1
-          LANGUAGE = get_cb_language(prevlangline)
+          yield f"\n{title}\n{re.sub('=','^',heading.underline)}".rstrip()
+
+    for block in blocks:
+      if block is rstdoc.BLANK:
+        if not PARAM:
+          yield ""
+        continue
+
+      lines = block.lines
+      nlines = len(lines)
+      if isinstance(block, rstdoc.Literal):
+        if block.marker is not None:
+          if block.at_end and not lines:
+            yield last_line(block.marker)
+            continue
+          LANGUAGE = get_cb_language(block.prev)
           if (not LANGUAGE):
-            if not dline.match(nextnextnextline):
-              output_lines.append(f"{INDENT}{curline}".rstrip())
+            if not block.empty:
+              yield f"{INDENT}{block.marker}".rstrip()
           else:
-            # output_lines.append(f".. code-block:: {LANGUAGE}\n   :linenos:\n")
-            output_lines.append(f".. code-block:: {LANGUAGE}\n")
+            # yield f".. code-block:: {LANGUAGE}\n   :linenos:\n"
+            yield f".. code-block:: {LANGUAGE}\n"
             INCODEBLOCK = True
-            SKIP+=1
-    elif listitem_pat.match(curline):
-      d=1
-      nextpline=in_lines[i+d].rstrip()
-      while nextpline and (not listitem_pat.match(nextline)):
-        curline=curline + " " + nextpline.rstrip()
-        d += 1
-        nextpline=in_lines[i+d].rstrip()
-        SKIP += 1
-      output_lines.append("{INDENT}{curline}")
-    else:
-      if (SKIP == 0):
-        if LITERAL:
-          if INCODEBLOCK:
+            # the blank line after "::" is already in the notation
+            if lines and not lines[0]:
+              lines = lines[1:]
+              nlines -= 1
+        for j, curline in enumerate(lines):
+          if block.at_end and j == nlines-1:
+            yield f"{INDENT}{curline}".rstrip()
+          elif INCODEBLOCK:
             if INSYNOPSIS:
               curline = re.sub(';','',curline)
             if codeblockinclude.match(curline):
               INCODEBLOCKINCLUDE = True
-              output_lines.append(f"{curline}".rstrip())
-            else:
-              if INCODEBLOCKINCLUDE:
-                INCODEBLOCKINCLUDE = False
-                if (curline.rstrip() != ""):
-                  output_lines.append("")
-              output_lines.append(f"{curline}".rstrip())
+            elif INCODEBLOCKINCLUDE:
+              INCODEBLOCKINCLUDE = False
+              if (curline.rstrip() != ""):
+                yield ""
+            yield f"{curline}".rstrip()
           else:
-              output_lines.append(f"{curline}".rstrip())
-        elif PARAM:
-          # combine into parameter bullet-item (Note: check if multiline param)
-# double check this
-          # if not curline:
-          #   output_lines.append(f"{curline}".rstrip()) 
-          # else:
-          if curline:
-            paramline2=""
-            paramline1 = re.sub('^[ ]*','',curline)
-            if (contains_colon.match(curline)):
-              paramline1,paramline2 = re.split(r':',paramline1)
-            if not paramline2:
-              paramline2 = re.sub('^[ ]*','',nextline)
-              SKIP+=1
-            d=1
-            nextpline=in_lines[i+d].rstrip()
-            while (nextpline):
-              d += 1
-              nextpline=in_lines[i+d].rstrip()
-              paramline2 += ' ' + re.sub('^[ ]*','',nextpline)
-              SKIP += 1
-            output_lines.append(f"* ``{paramline1}``: {paramline2}\n".rstrip())
-              # e.g., turn **MPI_Abort** and *MPI_Abort* into ``MPI_Abort``
-        elif ((not LITERAL) and (not dline.match(nextline))):
-          curline = re.sub(r'[\*]*[\`]*MPI_[A-Z][\*,()\[\]0-9A-Za-z_]*[()\[\]0-9A-Za-z_][\`]*[\*]*',cmdrepl,curline)
-          curline = re.sub(r'[\*]*[\`]*shmem_[A-Za-z][\*,()\[\]0-9A-Za-z_]*[()\[\]0-9A-Za-z_][\`]*[\*]*',cmdrepl,curline)
+            yield f"{curline}".rstrip()
+        continue
+
+      # any text line ends the code block a literal would go on with
+      if any(unliteral.match(curline) for curline in lines):
+        INCODEBLOCK=False
+
+      if block.at_end and nlines == 1:
+        yield last_line(lines[0])
+      elif isinstance(block, rstdoc.ListItem):
+        yield "{INDENT}{curline}"
+      elif isinstance(block, rstdoc.Param):
+        # combine into parameter bullet-item
+        paramline2=""
+        paramline1 = re.sub('^[ ]*','',lines[0])
+        rest = lines[1:]
+        if (contains_colon.match(paramline1)):
+          paramline1,paramline2 = paramline1.split(':', 1)
+        if not paramline2 and rest:
+          paramline2 = re.sub('^[ ]*','',rest[0])
+          rest = rest[1:]
+        for nextpline in rest:
+          paramline2 += ' ' + re.sub('^[ ]*','',nextpline)
+        yield f"* ``{paramline1}``: {paramline2}".rstrip()
+      else:
+        for j, curline in enumerate(lines):
+          if block.at_end and j == nlines-1:
+            yield last_line(curline)
+            break
+          # e.g., turn **MPI_Abort** and *MPI_Abort* into :ref:`MPI_Abort`
+          curline = xrefs.sub(curline)
           if bullet.match(curline):
-            d=1
-            nextbline=in_lines[i+d].rstrip()
-            bline2 = nextline
-            while (nextbline):
-              d += 1
-              nextbline=in_lines[i+d].rstrip()
+            # combine the rest of the paragraph into the bullet item
+            rest = lines[j+1:]
+            bline2 = rest[0] if rest else ""
+            for nextbline in rest[1:]:
               bline2 += ' ' + re.sub('^[ ]*','',nextbline)
-              SKIP += 1
-            output_lines.append(f"{INDENT}{curline} {bline2}\n".rstrip())
-          else:
-            output_lines.append(f"{INDENT}{curline}".rstrip())
-      else: 
-        SKIP-=1
-
-if (out_fname):
-  with open(out_fname,'w') as outfile:
-    sys.stdout = outfile
-    for line in output_lines:
-      print(line) 
-else:
-    for line in output_lines:
-      print(line) 
+            yield f"{INDENT}{curline} {bline2}".rstrip()
+            break
+          yield f"{INDENT}{curline}".rstrip()
+
+
+if __name__ == "__main__":
+  sys.exit(fixcommon.main(fixup_lines, APPNAME, sys.argv))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+# This script finds the man page sources (*.Nin and *.N.md) changed in git
+# since a date or over a revision range, for converting only those
+# (replaces get_updated_man.sh).
+#
+# Change detection
+#  - One "git log --name-only" over the range, limited to the man dirs,
+#    gives every source touched; sources since deleted are left out.
+#  - A ".so" page shows the page it includes, so the pages that include a
+#    changed page (and the pages that include those) are added too.
+#
+# Output
+#  - The sources, one per line, on stdout or in --output, which man2rst.py
+#    and pipeline.py take as --only to convert just those pages.
+#  - --copy <dest_dir> copies them below <dest_dir>, keeping their
+#    directories, as get_updated_man.sh did.
+#
+# Usage (from the top of the ompi tree)
+#  get_updated_man.py [--since <date>] [<revision_range>] [--output <file>]
+#                     [--copy <dest_dir>] [--dirs <man_dir>,...]
+
+import argparse
+import collections
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+import man2rst
+
+APPNAME=os.path.basename(__file__)
+
+MANDIRS=["ompi/mpi/man", "ompi/mpiext", "ompi/tools", "oshmem/shmem/man",
+         "opal/tools/wrappers", "oshmem/tools/oshmem_info"]
+
+# PATTERNS
+source_pat = re.compile(r"\.[0-9]+in$|\.[0-9]+\.md$")
+
+# Every source touched in git over the range, relative to the current
+# directory.  One git run.
+def changed_sources(man_dirs, since=None, revisions=None):
+    command = ['git', 'log', '--name-only', '--format=', '--relative']
+    if since:
+        command.append(f"--since={since}")
+    if revisions:
+        command.append(revisions)
+    command.extend(['--', *man_dirs])
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    return {os.path.normpath(line) for line in result.stdout.split('\n')
+            if source_pat.search(line) and os.path.isfile(line)}
+
+# The sources a page includes with ".so": the page named, relative to the
+# directory above the page's, as nroff or md.  A page is read up to its
+# ".so" line.
+def included_sources(fname):
+    with open(fname, errors='replace') as fp:
+        for line in fp:
+            if man2rst.so_pat.match(line):
+                fields = line.split()
+                if len(fields) < 2:
+                    return []
+                target = os.path.join(os.path.dirname(os.path.dirname(fname)), fields[1])
+                return [os.path.normpath(f"{target}in"), os.path.normpath(f"{target}.md")]
+    return []
+
+# Pages including each source: source -> [stubs].
+def includers(man_dirs):
+    included_by = collections.defaultdict(list)
+    for fname in man2rst.find_sources(man_dirs):
+        for candidate in included_sources(fname):
+            included_by[candidate].append(os.path.normpath(fname))
+    return included_by
+
+# The changed sources and every page that includes one of them.
+def updated_sources(man_dirs, since=None, revisions=None):
+    updated = changed_sources(man_dirs, since, revisions)
+    if not updated:
+        return []
+    included_by = includers(man_dirs)
+    todo = list(updated)
+    while todo:
+        for fname in included_by.get(todo.pop(), []):
+            if fname not in updated:
+                updated.add(fname)
+                todo.append(fname)
+    return sorted(updated)
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('revisions', nargs='?', default=None)
+    parser.add_argument('--since', default=None)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--copy', default=None, metavar='DEST_DIR')
+    parser.add_argument('--dirs', default=",".join(MANDIRS))
+    args = parser.parse_args(argv[1:])
+    if not args.since and not args.revisions:
+        parser.error("give --since and/or a revision range")
+
+    man_dirs = [d for d in args.dirs.split(',') if os.path.isdir(d)]
+    if not man_dirs:
+        parser.error(f"none of {args.dirs} found here")
+    try:
+        sources = updated_sources(man_dirs, args.since, args.revisions)
+    except subprocess.CalledProcessError as err:
+        print(f"{APPNAME}: git failed: {err.stderr.strip()}", file=sys.stderr)
+        return 1
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.writelines(f"{fname}\n" for fname in sources)
+    else:
+        for fname in sources:
+            print(fname)
+    if args.copy:
+        for fname in sources:
+            dest = os.path.join(args.copy, fname)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copy2(fname, dest)
+    print(f"{APPNAME}: {len(sources)} sources to convert", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
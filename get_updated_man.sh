@@ -1,19 +1,10 @@
 #!/bin/bash
 
-destdir=$1
-
-mkdir -p $destdir
-
-function copytodest() {
-    local infile=$1
-    local indir=$( dirname $infile )
-    local outdir=$(cd $destdir; mkdir -p $indir ; cd $indir; pwd -P )
-    cp $infile ${outdir}/
-}
-
-for f in $( find . -name \*\.[0-9]in ) ; do
-    r=$( git log $f | head -3 | grep 2021 |\
-         grep '[May|Jun|Jul|Aug|Sep|Oct|Nov|Dec]' )
-    [[ -z $r ]] || echo $f
-    [[ -z $r ]] || copytodest $f 
-done
+# Copies the man sources changed in git since May 2021, and the pages that
+# include them, below <dest_dir>.  See get_updated_man.py, which does the
+# work in one git run; give it a revision range or --since for other ranges.
+#
+# Usage (from the top of the ompi tree)
+#  get_updated_man.sh <dest_dir>
+
+exec python3 $(dirname $0)/get_updated_man.py --since 2021-05-01 --copy "$1"
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# This script builds the list of cross-reference labels (allrefs.txt) from
+# a tree of rst files, replacing getcrossrefs.sh.
+#
+# allrefs.txt
+#  - Same format as before: every ".. _label:" found in the first 3 lines
+#    of each *rst file except index.rst, lower-cased, sorted and
+#    de-duplicated.
+#
+# allrefs.json (the label index)
+#  - For every label: the file that defines it, its man section and, if the
+#    page is a stub made from a ".so" man page, the page it includes.
+#  - For every file: its size and mtime and what was read from it, so the
+#    next run only re-reads files that changed.
+#  - The fixers can load this file in place of allrefs.txt.
+#
+# Only the first few KiB of each file are read, and files are read in
+# parallel.
+#
+# Usage
+#  getcrossrefs.py [--jobs <n>] [--out <allrefs_file>] [--index <json_file>]
+#                  [<rst_dir>]
+
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+import sys
+
+APPNAME=os.path.basename(__file__)
+
+# Bytes read from each file.  A stub written by README.sh is much smaller
+# than this, so a file that does not fit is never a stub.
+HEADBYTES=4096
+
+# PATTERNS
+# what "grep -w index.rst" left out
+index_pat = re.compile(r"(?<![A-Za-z0-9_])index.rst(?![A-Za-z0-9_])")
+# label line, as matched by "grep '.. _'"
+label_pat = re.compile(".. _")
+# man section from the file name, e.g. MPI_Send.3.rst
+section_pat = re.compile(r"\.([0-9]+)\.rst$")
+# stub written by README.sh for a ".so" man page
+stub_include_pat = re.compile(r"^\.\. include:: (\S+)\s*$", flags = re.MULTILINE)
+stub_start_pat = re.compile(r"^\s*:start-after: \.\. include_body\s*$", flags = re.MULTILINE)
+
+# Every *rst file below root, relative to root, except index.rst.
+def find_rst_files(root):
+    found = list()
+    for dirpath, dirs, files in os.walk(root):
+        dirs.sort()
+        for fname in sorted(files):
+            if fname.endswith('rst'):
+                path = os.path.relpath(os.path.join(dirpath, fname), root)
+                if not index_pat.search(path):
+                    found.append(path)
+    return found
+
+# Labels in the first 3 lines, as "head -n 3 | grep '.. _' | sed | awk"
+# would print them.  A file without a label contributes an empty label.
+def parse_labels(head):
+    labels = list()
+    for line in head.split('\n')[:3]:
+        if label_pat.search(line):
+            labels.append(label_pat.sub('', line, count=1).split(':')[0])
+    return labels or [""]
+
+def scan_file(root, path, stat):
+    with open(os.path.join(root, path), 'rb') as fp:
+        head = b"".join(fp.readline() for i in range(3))
+        head += fp.read(max(0, HEADBYTES - len(head)))
+    head = head.decode('utf-8', errors='replace')
+    alias_of = None
+    if stat.st_size <= HEADBYTES:
+        match = stub_include_pat.search(head)
+        if match and stub_start_pat.search(head, match.end()):
+            alias_of = os.path.normpath(os.path.join(os.path.dirname(path),
+                                                     match.group(1)))
+    match = section_pat.search(path)
+    return {
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "labels": parse_labels(head),
+        "section": int(match.group(1)) if match else None,
+        "alias_of": alias_of,
+    }
+
+def load_index(fname):
+    if fname and os.path.exists(fname):
+        with open(fname) as fp:
+            return json.load(fp)
+    return {"files": {}, "labels": {}}
+
+# Scan root, re-reading only files whose size or mtime changed since
+# old_index.  Returns (index, number of files re-read).
+def build_index(root, old_index=None, jobs=None):
+    old_files = (old_index or {}).get("files", {})
+    files = dict()
+    todo = list()
+    for path in find_rst_files(root):
+        stat = os.stat(os.path.join(root, path))
+        old = old_files.get(path)
+        if old and old["mtime"] == stat.st_mtime_ns and old["size"] == stat.st_size:
+            files[path] = old
+        else:
+            todo.append((path, stat))
+
+    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        results = pool.map(lambda item: scan_file(root, *item), todo)
+        for (path, stat), entry in zip(todo, results):
+            files[path] = entry
+
+    labels = dict()
+    for path in sorted(files):
+        entry = files[path]
+        for label in entry["labels"]:
+            label = label.lower()
+            if label and label not in labels:
+                labels[label] = {
+                    "path": path,
+                    "section": entry["section"],
+                    "alias": entry["alias_of"] is not None,
+                    "alias_of": entry["alias_of"],
+                }
+    return {"files": dict(sorted(files.items())), "labels": labels}, len(todo)
+
+# The allrefs.txt lines: lower-cased, sorted, de-duplicated.
+def allrefs_lines(index):
+    labels = set()
+    for entry in index["files"].values():
+        labels.update(label.lower() for label in entry["labels"])
+    return sorted(labels)
+
+def write_file(fname, text):
+    tmp = f"{fname}.tmp{os.getpid()}"
+    with open(tmp, 'w') as fp:
+        fp.write(text)
+    os.replace(tmp, fname)
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('root', nargs='?', default='.')
+    parser.add_argument('--out', default='allrefs.txt')
+    parser.add_argument('--index', default=None,
+                        help="label index (default: allrefs.json next to --out)")
+    parser.add_argument('--jobs', type=int, default=None)
+    args = parser.parse_args(argv[1:])
+    index_file = args.index or os.path.join(os.path.dirname(args.out), 'allrefs.json')
+
+    index, rescanned = build_index(args.root, load_index(index_file), args.jobs)
+    write_file(args.out, "".join(f"{label}\n" for label in allrefs_lines(index)))
+    write_file(index_file, json.dumps(index, indent=1) + "\n")
+    print(len(index["files"]))
+    print(f"{APPNAME}: re-read {rescanned} of {len(index['files'])} files",
+          file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
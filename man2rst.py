@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+
+# This script is the man -> rst conversion stage for the nroff man page
+# sources (*.Nin), run before pandoc.
+#
+# Classify
+#  - Every source is read once and sorted into one of three kinds:
+#      stub    a page that only includes another (".so man3/MPI_Foo.3")
+#      native  a page that only uses the macros converted here
+#      pandoc  anything else
+#
+# .so stubs
+#  - Written straight into the rst tree: label, title, underline and an
+#    ".. include::" of the page it names, starting after ".. include_body",
+#    the same text README.sh used to write with echo.
+#
+# Native conversion
+#  - Handles the subset of man macros the MPI pages are written in:
+#    .TH .SH .SS .TP .PP/.LP/.P .sp .nf/.fi .B .I ".ft R" and comments,
+#    with the \fB \fI \fR \fP \- \& escapes.
+#  - Writes rst shaped like "pandoc -f man -t rst" output (72 column
+#    paragraphs, "::" literal blocks, definition lists for .TP), so
+#    fixup_rst.py fixes both the same way.
+#  - A page that uses anything else, or text that rst would need escaped,
+#    is left to pandoc.
+#
+# Usage
+#  man2rst.py --rst <rst_dir> --tmprst <tmprst_dir> --pairs <pairs_file>
+#             [--log <log_file>] [--no-native] [--only <list_file>]
+#             [--cache <manifest>] [--trace <trace_file>] <man_dir>...
+#
+# --only converts just the sources listed in <list_file>, one per line (see
+# get_updated_man.py).  --trace appends an event per source to a trace
+# (see buildtrace.py).
+#
+# --cache is the conversion cache pandoc_stage.py uses (see convcache.py).
+# A page written here drops out of it: when the page goes back to being one
+# pandoc converts (an edit reverted, or --no-native), pandoc must not take
+# the page written here for its own earlier output.
+#
+# Stubs go to <rst_dir>, native conversions to <tmprst_dir>.  The
+# "<source> <output>" pairs that still need pandoc are written to
+# <pairs_file>.
+
+import argparse
+import fnmatch
+import os
+import re
+import sys
+import textwrap
+import time
+
+import buildtrace
+import convcache
+import fixcommon
+
+APPNAME=os.path.basename(__file__)
+
+# pandoc's line width for rst
+WIDTH=72
+
+# PATTERNS
+# ".so" line, as matched by "grep -w '^\.so'"
+so_pat = re.compile(r"^\.so(?![A-Za-z0-9_])")
+# man section suffix of a source file name: MPI_Send.3in -> MPI_Send.3
+section_in_pat = re.compile(r"\.([0-9]*)in")
+# roff comment lines and trailing comments
+comment_pat = re.compile(r"^[.']\s*\\\"|^\.\s*$")
+trailing_comment_pat = re.compile(r'\\".*')
+# font changes
+font_pat = re.compile(r"\\f([BIRP])")
+# escapes that have a plain text equivalent
+plain_escapes = {r"\-": "-", r"\&": "", r"\e": "\\", r"\\": "\\"}
+escape_pat = re.compile(r"\\[-&e\\]")
+# macro name and arguments
+macro_pat = re.compile(r"^\.([A-Za-z]+)\s*(.*)$")
+arg_pat = re.compile(r'"([^"]*)"|(\S+)')
+# rst would read these as markup, so pandoc escapes them
+rst_special_pat = re.compile(r"[*`|\\]|::|_(?![A-Za-z0-9])")
+# a paragraph or term that rst would read as a list or a comment
+rst_start_pat = re.compile(r"^([-+*]\s|[0-9]+[.)]\s|[A-Za-z][.)]\s|\(|#\.|\.\.)")
+# characters allowed before and after inline markup
+markup_before = " \t-:/'\"<([{"
+markup_after = " \t-.,:;!?\\/'\")]}>"
+
+# Raised for anything the native converter does not handle
+class Unsupported(Exception):
+    pass
+
+def roff_args(text):
+    return [quoted if quoted or not plain else plain
+            for quoted, plain in arg_pat.findall(text)]
+
+# The text of a roff line, with escapes replaced and font changes dropped
+# (for literal blocks).
+def plain_text(line):
+    if '\\' in escape_pat.sub('', font_pat.sub('', line)):
+        raise Unsupported(f"escape in {line!r}")
+    return font_pat.sub('', escape_pat.sub(lambda m: plain_escapes[m.group()], line))
+
+# roff text (one paragraph, lines joined) to rst text with inline markup.
+def inline_text(text):
+    pieces = re.split(r"(\\f[BIRP])", text)
+    font = prev_font = 'R'
+    out = ""
+    for piece in pieces:
+        match = font_pat.fullmatch(piece)
+        if match:
+            new_font = match.group(1)
+            if new_font == 'P':
+                new_font = prev_font
+            prev_font, font = font, new_font
+            continue
+        if '\\' in escape_pat.sub('', piece):
+            raise Unsupported(f"escape in {piece!r}")
+        piece = escape_pat.sub(lambda m: plain_escapes[m.group()], piece)
+        if rst_special_pat.search(piece):
+            raise Unsupported(f"rst markup in {piece!r}")
+        core = piece.strip()
+        if font == 'R' or not core:
+            out += piece
+            continue
+        mark = "**" if font == 'B' else "*"
+        lead = piece[:len(piece) - len(piece.lstrip())]
+        trail = piece[len(piece.rstrip()):]
+        if not lead and out and out[-1] not in markup_before:
+            raise Unsupported(f"markup after {out[-1]!r}")
+        out += f"{lead}{mark}{core}{mark}{trail}"
+        if not trail:
+            # checked against the next piece once it is known
+            out += "\0"
+    # inline markup must be followed by a space or punctuation
+    for i, char in enumerate(out):
+        if char == "\0" and i+1 < len(out) and out[i+1] not in markup_after + "\0":
+            raise Unsupported(f"markup before {out[i+1]!r}")
+    return " ".join(out.replace("\0", "").split())
+
+def wrap(text, indent=""):
+    if rst_start_pat.match(text):
+        raise Unsupported(f"list-like text {text!r}")
+    return textwrap.wrap(text, WIDTH, initial_indent=indent,
+                         subsequent_indent=indent, break_long_words=False,
+                         break_on_hyphens=False)
+
+# Convert the lines of a man page.  Returns the rst lines, or raises
+# Unsupported.
+def convert(lines):
+    out = list()
+    para = list()          # roff lines of the current paragraph
+    literal = None         # lines of the current .nf block
+    term = None            # .TP term, once read
+    in_tp = False          # next text line is a .TP term
+    indent = ""            # "   " in a .TP description
+
+    def block(new_lines):
+        if out:
+            out.append("")
+        out.extend(new_lines)
+
+    def flush():
+        nonlocal para, term
+        if term is not None:
+            block([term] + wrap(inline_text(" ".join(para)), "   "))
+            term = None
+        elif para:
+            block(wrap(inline_text(" ".join(para)), indent))
+        para = list()
+
+    for line in lines:
+        line = line.rstrip('\n')
+        if comment_pat.match(line):
+            continue
+        line = trailing_comment_pat.sub('', line).rstrip()
+
+        if literal is not None:
+            match = macro_pat.match(line)
+            if match and match.group(1) == 'fi':
+                while literal and not literal[-1]:
+                    literal.pop()
+                if literal:
+                    block(["::", ""] + [f"   {text}" if text else "" for text in literal])
+                literal = None
+            elif match and match.group(1) in ('B', 'I'):
+                literal.append(" ".join(roff_args(match.group(2))))
+            elif match and match.group(1) == 'sp':
+                if literal:
+                    literal.append("")
+            elif match and match.group(1) == 'ft':
+                pass
+            elif line.startswith(('.', "'")):
+                raise Unsupported(f"macro in literal block {line!r}")
+            elif '\t' in line:
+                raise Unsupported("tab in literal block")
+            elif line or literal:
+                literal.append(plain_text(line))
+            continue
+
+        if line.startswith("'"):
+            raise Unsupported(f"control line {line!r}")
+        match = macro_pat.match(line) if line.startswith('.') else None
+        if line.startswith('.') and not match:
+            raise Unsupported(f"macro {line!r}")
+
+        if not match:
+            if not line:
+                flush()
+                if indent:
+                    in_tp = False
+            elif in_tp:
+                term = inline_text(line)
+                if rst_start_pat.match(term):
+                    raise Unsupported(f"list-like term {term!r}")
+                in_tp = False
+            elif indent and term is None:
+                raise Unsupported("indented paragraph after .TP")
+            else:
+                para.append(line)
+            continue
+
+        macro, args = match.groups()
+        if macro == 'TH':
+            continue
+        elif macro == 'ft':
+            if args not in ('', 'R', 'P'):
+                raise Unsupported(f".ft {args}")
+        elif macro in ('B', 'I'):
+            text = f"\\f{macro}{' '.join(roff_args(args))}\\fR"
+            if not roff_args(args):
+                raise Unsupported(f".{macro} without text")
+            if in_tp:
+                term = inline_text(text)
+                in_tp = False
+            elif indent and term is None:
+                raise Unsupported("indented paragraph after .TP")
+            else:
+                para.append(text)
+        elif macro in ('SH', 'SS'):
+            flush()
+            title = " ".join(roff_args(args))
+            if not title:
+                raise Unsupported(f".{macro} without a title")
+            title = inline_text(title)
+            if '*' in title:
+                raise Unsupported("markup in heading")
+            block([title, ("=" if macro == 'SH' else "-") * len(title)])
+            indent = ""
+            in_tp = False
+        elif macro in ('PP', 'LP', 'P'):
+            flush()
+            indent = ""
+            in_tp = False
+        elif macro == 'sp':
+            flush()
+        elif macro == 'TP':
+            flush()
+            indent = "   "
+            in_tp = True
+        elif macro == 'nf':
+            if indent:
+                raise Unsupported(".nf in a .TP description")
+            flush()
+            literal = list()
+        else:
+            raise Unsupported(f".{macro}")
+
+    if literal is not None:
+        raise Unsupported(".nf without .fi")
+    flush()
+    return out
+
+# The rst stub README.sh wrote for a page that includes another.
+def stub_lines(out, so_line):
+    fields = so_line.split()
+    fname = f"{fields[1]}.rst" if len(fields) > 1 else ""
+    if not fname:
+        print(f"WARNING: ERROR: See {fname}")
+    pname = os.path.basename(out).split('.')[0]
+    delim = re.sub(r"[a-zA-Z0-9_,\\-]", "=", pname)
+    return [
+        f".. _{pname.lower()}:",
+        " ",
+        pname,
+        delim,
+        "    .. include_body",
+        "",
+        f".. include:: ../{fname}",
+        "    :start-after: .. include_body",
+        "",
+    ]
+
+# Every "*.*in" source below the man dirs, in a fixed order.
+def find_sources(man_dirs):
+    sources = list()
+    for man_dir in man_dirs:
+        for root, dirs, files in os.walk(man_dir):
+            dirs.sort()
+            for fname in sorted(files):
+                path = os.path.join(root, fname)
+                if fnmatch.fnmatch(fname, '*.*in') and os.path.isfile(path):
+                    sources.append(path)
+    return sources
+
+# The sources listed in a --only file
+def read_source_list(fname):
+    with open(fname) as fp:
+        return {os.path.normpath(line.strip()) for line in fp if line.strip()}
+
+# Sort one source into ("stub", so_line), ("native", rst_lines) or
+# ("pandoc", reason).
+def classify(fname, native=True):
+    with open(fname, errors='replace') as fp:
+        return classify_lines(fp.readlines(), native)
+
+# The same, for the lines of a source already read
+def classify_lines(lines, native=True):
+    so_lines = [line for line in lines if so_pat.match(line)]
+    if len(so_lines) == 1:
+        return "stub", so_lines[0]
+    if not native:
+        return "pandoc", "native conversion disabled"
+    if so_lines:
+        return "pandoc", "more than one .so"
+    try:
+        return "native", convert(lines)
+    except Unsupported as err:
+        return "pandoc", str(err)
+
+# rst file name for a source: ompi/.../MPI_Send.3in -> ompi/.../MPI_Send.3.rst
+def rst_name(fname):
+    return section_in_pat.sub(r".\1", fname, count=1) + ".rst"
+
+# Convert one source: write its stub or native conversion, if it changed.
+# Returns (kind, output file, reason, changed).  For kind "pandoc" nothing
+# is written; the output file is where the pandoc conversion belongs and
+# reason says why the page was not converted here.
+def convert_source(fname, rst_dir, tmprst_dir, native=True):
+    kind, result = classify(fname, native)
+    if kind == "stub":
+        out = os.path.join(rst_dir, rst_name(fname))
+        lines = stub_lines(out, result)
+    else:
+        out = os.path.join(tmprst_dir, rst_name(fname))
+        if kind == "pandoc":
+            return kind, out, result, False
+        lines = result
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    return kind, out, "", fixcommon.write_lines(out, lines)
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('man_dirs', nargs='+')
+    parser.add_argument('--rst', required=True, help="rst tree for .so stubs")
+    parser.add_argument('--tmprst', required=True, help="tree for converted pages")
+    parser.add_argument('--pairs', required=True,
+                        help="where to list the pages left to pandoc")
+    parser.add_argument('--log', default=None)
+    parser.add_argument('--no-native', action='store_true')
+    parser.add_argument('--only', default=None)
+    parser.add_argument('--cache', default=None)
+    parser.add_argument('--trace', default=None)
+    args = parser.parse_args(argv[1:])
+
+    sources = find_sources(args.man_dirs)
+    if args.only:
+        only = read_source_list(args.only)
+        sources = [fname for fname in sources if os.path.normpath(fname) in only]
+
+    counts = {"stub": 0, "native": 0, "pandoc": 0, "changed": 0}
+    cache = convcache.ConversionCache(args.cache)
+    log = open(args.log, 'a') if args.log else open(os.devnull, 'w')
+    start = time.monotonic()
+    with log, open(args.pairs, 'w') as pairs, buildtrace.Trace(args.trace) as trace:
+        for fname in sources:
+            page_start = time.monotonic()
+            kind, out, reason, changed = convert_source(fname, args.rst, args.tmprst,
+                                                        not args.no_native)
+            trace.page(APPNAME.replace('.py',''), fname, kind=kind, out=out,
+                       changed=changed, seconds=round(time.monotonic() - page_start, 6),
+                       in_bytes=buildtrace.file_size(fname),
+                       out_bytes=buildtrace.file_size(out) if kind != "pandoc" else None)
+            counts[kind] += 1
+            counts["changed"] += changed
+            if kind == "pandoc":
+                print(f"{fname} {out}", file=pairs)
+                print(f"{fname}: pandoc: {reason}", file=log)
+            else:
+                cache.forget(out)
+                print(f"converting {fname} to {out}", file=log)
+        trace.stage(APPNAME.replace('.py',''), pages=len(sources), **counts,
+                    wall=round(time.monotonic() - start, 3))
+    cache.save()
+
+    print(f"{APPNAME}: {counts['stub']} stubs, {counts['native']} converted, "
+          f"{counts['pandoc']} left to pandoc, {counts['changed']} files changed")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+# This script packages the man pages sphinx wrote to _build/man for
+# installing: one manN directory per section, the pages gzipped, and the
+# alias pages made from ".so" stubs written as references to their page
+# instead of full copies of it.
+#
+# Aliases
+#  - sphinx writes a whole page for every stub README.sh made from a ".so"
+#    man page (PMPI_Send.3 is a second copy of MPI_Send.3).  Stubs are
+#    found in the rst tree, as getcrossrefs.py finds them; a stub of a stub
+#    refers to the last page in the chain.
+#  - --aliases so (the default) writes a ".so man3/MPI_Send.3" page, as
+#    the original man pages did; --aliases symlink makes a link to the
+#    page's file instead.  A stub whose page sphinx did not write stays a
+#    whole page.
+#
+# Pages
+#  - Pages are gzipped (-9, no name or time in the header, so the same
+#    page gives the same bytes) by a pool of --jobs threads; with --no-gzip
+#    they are copied as they are.
+#  - A file is only replaced if its contents changed, and files of earlier
+#    runs that are no longer wanted are removed.
+#
+# Manifest
+#  - <out_dir>/manifest.json lists every file with its kind ("page", "so"
+#    or "symlink"), the page it refers to and its size before and after,
+#    with the totals.
+#
+# Usage (from the build directory, as README.sh)
+#  manpackage.py [--buildman <man_dir>] [--rst <rst_dir>] [--out <out_dir>]
+#                [--aliases so|symlink] [--no-gzip] [--jobs <n>]
+
+import argparse
+import concurrent.futures
+import gzip
+import json
+import os
+import re
+import sys
+
+import fixcommon
+import getcrossrefs
+
+APPNAME=os.path.basename(__file__)
+
+FORMAT=1
+
+# Longest chain of stubs followed
+MAXALIASES=8
+
+# PATTERNS
+# man page file name: MPI_Send.3, ompi_info.1
+section_pat = re.compile(r"\.([0-9][a-z]*)$")
+
+# Alias page -> the page it refers to, by man page name, from the rst
+# stubs: PMPI_Send.3 -> MPI_Send.3
+def find_aliases(rst_dir, jobs=None):
+    index, _ = getcrossrefs.build_index(rst_dir, None, jobs)
+    alias_of = dict()
+    for path, entry in index["files"].items():
+        if entry["alias_of"]:
+            alias_of[_man_name(path)] = _man_name(entry["alias_of"])
+    # a stub of a stub refers to the last page of the chain
+    resolved = dict()
+    for name, target in alias_of.items():
+        for _ in range(MAXALIASES):
+            if target not in alias_of or target == name:
+                break
+            target = alias_of[target]
+        if target != name:
+            resolved[name] = target
+    return resolved
+
+def _man_name(rst_path):
+    return os.path.basename(rst_path)[:-len('.rst')]
+
+def _section(name):
+    match = section_pat.search(name)
+    return match.group(1) if match else None
+
+# Packaged file of a page: man3/MPI_Send.3.gz
+def packaged_name(name, compress=True):
+    return os.path.join(f"man{_section(name)[0]}", f"{name}.gz" if compress else name)
+
+def _write_if_changed(data, out):
+    tmp = f"{out}.tmp{os.getpid()}"
+    with open(tmp, 'wb') as fp:
+        fp.write(data)
+    return fixcommon.replace_if_changed(tmp, out)
+
+# Write one page; returns (size after, whether the file changed)
+def package_page(src, out, compress):
+    with open(src, 'rb') as fp:
+        data = fp.read()
+    if compress:
+        data = gzip.compress(data, compresslevel=9, mtime=0)
+    return len(data), _write_if_changed(data, out)
+
+# A symlink is remade only if it points somewhere else
+def _symlink(target, out):
+    if os.path.islink(out) and os.readlink(out) == target:
+        return False
+    if os.path.lexists(out):
+        os.remove(out)
+    os.symlink(target, out)
+    return True
+
+def package(buildman, rst_dir, out_dir, aliases="so", compress=True, jobs=None):
+    with os.scandir(buildman) as entries:
+        names = sorted(entry.name for entry in entries
+                       if entry.is_file() and _section(entry.name))
+    built = set(names)
+    alias_of = {name: target for name, target in find_aliases(rst_dir, jobs).items()
+                if name in built and target in built}
+
+    files = list()
+    wanted = set()
+    for name in names:
+        out = packaged_name(name, compress)
+        os.makedirs(os.path.join(out_dir, os.path.dirname(out)), exist_ok=True)
+        wanted.add(out)
+        files.append({"page": name, "file": out,
+                      "kind": "page" if name not in alias_of else aliases,
+                      "alias_of": alias_of.get(name),
+                      "size_before": os.path.getsize(os.path.join(buildman, name))})
+
+    changed = 0
+    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        futures = dict()
+        for entry in files:
+            out = os.path.join(out_dir, entry["file"])
+            target = entry["alias_of"]
+            if entry["kind"] == "page":
+                futures[entry["file"]] = pool.submit(
+                    package_page, os.path.join(buildman, entry["page"]), out, compress)
+            elif entry["kind"] == "so":
+                data = f".so man{_section(target)[0]}/{target}\n".encode()
+                if compress:
+                    data = gzip.compress(data, compresslevel=9, mtime=0)
+                entry["size_after"] = len(data)
+                changed += _write_if_changed(data, out)
+            else:
+                link = os.path.relpath(os.path.join(out_dir, packaged_name(target, compress)),
+                                       os.path.dirname(out))
+                entry["size_after"] = 0
+                changed += _symlink(link, out)
+        for entry in files:
+            if entry["file"] in futures:
+                entry["size_after"], page_changed = futures[entry["file"]].result()
+                changed += page_changed
+
+    # files of earlier runs
+    removed = 0
+    for dirpath, dirs, fnames in os.walk(out_dir):
+        for fname in fnames:
+            path = os.path.relpath(os.path.join(dirpath, fname), out_dir)
+            if os.path.dirname(path) and path not in wanted:
+                os.remove(os.path.join(out_dir, path))
+                removed += 1
+
+    totals = {"pages": sum(1 for entry in files if entry["kind"] == "page"),
+              "aliases": len(alias_of),
+              "size_before": sum(entry["size_before"] for entry in files),
+              "size_after": sum(entry["size_after"] for entry in files),
+              "changed": changed, "removed": removed}
+    manifest = {"format": FORMAT, "compress": compress, "aliases": aliases,
+                "totals": totals, "files": files}
+    _write_if_changed((json.dumps(manifest, indent=1) + "\n").encode(),
+                      os.path.join(out_dir, "manifest.json"))
+    return totals
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('--buildman', default="man/")
+    parser.add_argument('--rst', default="rst/")
+    parser.add_argument('--out', default="man-install/")
+    parser.add_argument('--aliases', choices=["so", "symlink"], default="so")
+    parser.add_argument('--no-gzip', action='store_true')
+    parser.add_argument('--jobs', type=int, default=fixcommon.default_jobs())
+    args = parser.parse_args(argv[1:])
+    if not os.path.isdir(args.buildman):
+        parser.error(f"no directory {args.buildman}")
+
+    os.makedirs(args.out, exist_ok=True)
+    totals = package(args.buildman, args.rst, args.out, args.aliases,
+                     not args.no_gzip, args.jobs)
+    print(f"{APPNAME}: {totals['pages']} pages, {totals['aliases']} aliases as "
+          f"{args.aliases}, {totals['size_before']} bytes -> {totals['size_after']}, "
+          f"{totals['changed']} files changed, {totals['removed']} removed, "
+          f"see {os.path.join(args.out, 'manifest.json')}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# This module builds the man_pages list for conf.py: one
+# (source, name, description, authors, section) tuple for every
+# <dir>/manN/<page>.N.rst below the sphinx source directory, or for every
+# <page>.Nin and <page>.N.md man source when sphinx reads those (see
+# sphinx_man.py).  Any other *.rst file in a manN directory is a page too,
+# named as conf.py's loop over the tree used to name it (<page>.rst keeps
+# its .rst).
+#
+# Walking the whole tree each time sphinx loads conf.py is slow, so the
+# list is kept in a manifest together with, for every directory it came
+# from, the directory's modification time and the sorted names of its
+# pages and subdirectories.  A directory whose time is unchanged is taken
+# as is.  One whose time changed is listed again: the fixers write each
+# page through a temporary file in its directory, which changes the time
+# even when no page was added or removed, so only a change in the names
+# builds the list again (and a directory that went away).  The new times
+# are saved, so the next load takes the fast path again.
+#
+# The manifest must live outside the tree, or writing it would change the
+# time of its directory.  Each tree has its own (manifest_path), as the
+# rst tree and the man source tree are both read from the same build
+# directory.
+#
+# The output directories of the man builder are made once per directory
+# of pages, not once per page.  Nothing is printed.
+#
+# It is copied next to conf.py (see README.sh), so it must not import the
+# other modules of this directory.
+#
+# Usage
+#  manpages.py [--manifest <json_file>] [<rst_dir>]
+#      Print the man_pages list, building the manifest if needed.
+
+import argparse
+import json
+import os
+import re
+import sys
+
+APPNAME=os.path.basename(__file__)
+
+FORMAT=3
+
+# PATTERNS
+mandir_pat = re.compile(r"^man([0-9]+)$")
+page_pat = re.compile(r"^(.*)\.rst$|^((.*?)\.[0-9]+)(in|\.md)$")
+# what conf.py's loop took off an rst file name for the page name
+rst_section_pat = re.compile(r"\.[0-9]*\.rst")
+
+# The manifest of the tree at root, in manifest_dir
+def manifest_path(root, manifest_dir):
+    name = os.path.basename(os.path.realpath(root)) or "root"
+    return os.path.join(manifest_dir, f"man_pages.{name}.json")
+
+# The pages and subdirectories of a directory, sorted
+def _dir_names(path):
+    with os.scandir(path) as entries:
+        return sorted(entry.name for entry in entries
+                      if page_pat.match(entry.name) or entry.is_dir())
+
+def _dir_state(root, d):
+    return [os.stat(os.path.join(root, d)).st_mtime_ns,
+            _dir_names(os.path.join(root, d))]
+
+def scan(root):
+    pages = list()
+    dirs = list()
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+        dirnames.sort()
+        reldir = os.path.relpath(dirpath, root)
+        dirs.append(reldir)
+        match = mandir_pat.match(os.path.basename(dirpath))
+        if not match:
+            continue
+        for fname in sorted(filenames):
+            page = page_pat.match(fname)
+            if page:
+                if page.group(1):
+                    docname, name = page.group(1), rst_section_pat.sub('', fname)
+                else:
+                    docname, name = page.group(2, 3)
+                pages.append((os.path.join(reldir, docname), name, "", "",
+                              int(match.group(1))))
+    return pages, {d: _dir_state(root, d) for d in dirs}
+
+# The pages of the manifest, or None if it is out of date
+def _load(path, root):
+    try:
+        with open(path) as fp:
+            manifest = json.load(fp)
+        if manifest.get("format") != FORMAT:
+            return None
+        dirs = manifest["dirs"]
+        touched = False
+        for d, (mtime, names) in dirs.items():
+            if os.stat(os.path.join(root, d)).st_mtime_ns == mtime:
+                continue
+            state = _dir_state(root, d)
+            if state[1] != names:
+                return None
+            dirs[d] = state
+            touched = True
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    pages = [tuple(page) for page in manifest["pages"]]
+    if touched:
+        _save(path, pages, dirs)
+    return pages
+
+def _save(path, pages, dirs):
+    tmp = f"{path}.tmp{os.getpid()}"
+    try:
+        with open(tmp, 'w') as fp:
+            json.dump({"format": FORMAT, "dirs": dirs, "pages": pages}, fp)
+        os.replace(tmp, path)
+    except OSError:
+        # no manifest just means scanning again next time
+        pass
+
+# The man_pages list for the rst tree at root, from the manifest if it is
+# given and still up to date.  Makes the directories the man builder writes
+# into below out_dir, if out_dir is given.
+def man_pages(root=".", out_dir=None, manifest=None):
+    pages = _load(manifest, root) if manifest else None
+    if pages is None:
+        pages, dirs = scan(root)
+        if manifest:
+            _save(manifest, pages, dirs)
+    if out_dir:
+        for parent in {os.path.dirname(page[0]) for page in pages}:
+            os.makedirs(os.path.join(out_dir, parent), exist_ok=True)
+    return pages
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('root', nargs='?', default=".")
+    parser.add_argument('--manifest', default=None)
+    args = parser.parse_args(argv[1:])
+
+    for page in man_pages(args.root, manifest=args.manifest):
+        print(page)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
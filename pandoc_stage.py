@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# This script runs the pandoc conversion stages (man -> rst, md -> rst) of
+# README.sh through a bounded pool of pandoc processes.
+#
+# Conversions
+#  - Up to --jobs pandoc processes run at once (default: one per CPU).
+#  - Each page is converted from its own directory, as README.sh did, and
+#    its output replaces the old file only if pandoc succeeded.
+#  - A conversion that runs longer than --timeout seconds is killed and
+#    tried again, up to --retries times.
+#  - Pages whose source, and the pandoc version, are unchanged since the
+#    last run are skipped (see convcache.py).
+#
+# Error log
+#  - One JSON object per page, in input order: source, output, status
+#    ("ok", "failed", "timeout"), return code, attempts, seconds, number of
+#    WARNING lines and pandoc's stderr.
+#  - The WARNING count README.sh used to grep for is printed at the end.
+#  - --trace <file> also appends an event per page, skipped pages
+#    included, to a trace (see buildtrace.py).
+#
+# Usage
+#  pandoc_stage.py --from <man|gfm> [--jobs <n>] [--timeout <s>]
+#                  [--retries <n>] [--log <log_file>]
+#                  [--cache <manifest> --stage <name> [--force]]
+#                  [--trace <trace_file>] <pairs_file>
+#
+# pairs_file has one "<source> <output>" pair per line.
+
+import argparse
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+import time
+
+import buildtrace
+import convcache
+import fixcommon
+
+APPNAME=os.path.basename(__file__)
+
+def pandoc_version():
+    try:
+        result = subprocess.run(['pandoc', '--version'], capture_output=True,
+                                text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+    return result.stdout.split('\n')[0]
+
+def count_warnings(text):
+    return sum(1 for line in text.split('\n') if 'WARNING' in line)
+
+# Run pandoc on one page.  Returns its output (None if pandoc failed) and
+# its log entry.
+def run_pandoc(source, reader, timeout, retries):
+    entry = {"source": source, "status": "failed", "returncode": None,
+             "attempts": 0, "seconds": 0.0, "warnings": 0, "stderr": ""}
+    output = None
+    start = time.monotonic()
+    for attempt in range(1, retries + 2):
+        entry["attempts"] = attempt
+        try:
+            result = subprocess.run(
+                ['pandoc', '-f', reader, '-t', 'rst', os.path.basename(source)],
+                cwd=os.path.dirname(source) or '.', capture_output=True,
+                timeout=timeout)
+        except subprocess.TimeoutExpired:
+            entry["status"] = "timeout"
+            entry["stderr"] = f"timed out after {timeout}s"
+            continue
+        except OSError as err:
+            entry["stderr"] = str(err)
+            break
+        entry["returncode"] = result.returncode
+        entry["stderr"] = result.stderr.decode('utf-8', errors='replace')
+        if result.returncode == 0:
+            output = result.stdout
+            entry["status"] = "ok"
+        else:
+            entry["status"] = "failed"
+        break
+    entry["seconds"] = round(time.monotonic() - start, 3)
+    entry["warnings"] = count_warnings(entry["stderr"])
+    return output, entry
+
+# Convert one page.  Returns its log entry.
+def convert(source, out, reader, timeout, retries):
+    output, entry = run_pandoc(source, reader, timeout, retries)
+    entry = {"source": source, "out": out, **entry}
+    if output is not None:
+        os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+        tmp = f"{out}.tmp{os.getpid()}"
+        with open(tmp, 'wb', buffering=fixcommon.WRITEBUF) as fp:
+            fp.write(output)
+        os.replace(tmp, out)
+    return entry
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('pairs_file')
+    parser.add_argument('--from', dest='reader', required=True,
+                        help="pandoc reader, e.g. man or gfm")
+    parser.add_argument('--jobs', type=int, default=fixcommon.default_jobs())
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--retries', type=int, default=1)
+    parser.add_argument('--log', default=None)
+    parser.add_argument('--cache', default=None)
+    parser.add_argument('--stage', default=None)
+    parser.add_argument('--force', action='store_true')
+    parser.add_argument('--trace', default=None)
+    args = parser.parse_args(argv[1:])
+    stage = args.stage or f"{args.reader}2rst"
+
+    pairs = convcache.read_pairs(args.pairs_file)
+    tool = convcache.hash_text(pandoc_version())
+    cache = convcache.ConversionCache(args.cache, args.force)
+    stale, fresh = cache.partition(stage, pairs, tool=tool)
+
+    failed = 0
+    warnings = 0
+    log = open(args.log, 'w') if args.log else open(os.devnull, 'w')
+    trace = buildtrace.Trace(args.trace)
+    start = time.monotonic()
+    for source, out in fresh:
+        trace.page(stage, source, "skipped", out=out)
+    with log, trace, concurrent.futures.ThreadPoolExecutor(max(1, args.jobs)) as pool:
+        entries = pool.map(lambda pair: convert(*pair, args.reader,
+                                                args.timeout, args.retries),
+                           stale)
+        for entry in entries:
+            log.write(json.dumps(entry) + "\n")
+            trace.page(stage, entry["source"], entry["status"], out=entry["out"],
+                       seconds=entry["seconds"], attempts=entry["attempts"],
+                       in_bytes=buildtrace.file_size(entry["source"]),
+                       out_bytes=buildtrace.file_size(entry["out"]),
+                       warnings=buildtrace.warning_lines(entry["stderr"]))
+            warnings += entry["warnings"]
+            if entry["status"] == "ok":
+                cache.record(stage, entry["source"], entry["out"], tool=tool)
+            else:
+                failed += 1
+                cache.forget(entry["out"])
+                print(f"ERROR: could not convert {entry['source']}: "
+                      f"{entry['status']}", file=sys.stderr)
+        trace.stage(stage, pages=len(pairs), converted=len(stale) - failed,
+                    failed=failed, skipped=len(fresh), warnings=warnings,
+                    wall=round(time.monotonic() - start, 3))
+    cache.save()
+
+    print(f"{APPNAME}: {stage}: converted {len(stale) - failed} of "
+          f"{len(stale)} pages, {len(fresh)} unchanged")
+    print(f"WARNING messages from {args.log or 'pandoc'}: {warnings}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,583 @@
+#!/usr/bin/env python3
+
+# This script runs the README.sh stages as one pipeline.
+#
+# Stages
+#  - The stages form a DAG.  Page stages handle one page at a time and
+#    hand each page to the next stage as soon as it is done, so a page is
+#    fixed up while others are still in pandoc.  Tree stages (copying
+#    Open-MPI.5.rst, the sphinx builds) run once, when every stage they
+#    depend on has finished.
+#      man2rst     .so stubs and simple man pages (man2rst.py)
+#      pandoc-man  the other man pages, through pandoc
+#      md2rst      md pages, through pandoc
+#      fixup       fixup_rst.py on the man pages
+#      fixmd       fix_md_rst.py on the md pages
+#      copy        Open-MPI.5.rst into the rst tree
+#      html, man   sphinx_build.py (not run unless asked for)
+#      package     manpackage.py on the man pages (not run unless asked
+#                  for)
+#      render      render_man.py on the new and original pages (not run
+#                  unless asked for)
+#  - --stages picks the stages to run.  A stage is fed by the selected
+#    stages upstream of it or, if none is selected, from what is already on
+#    disk (e.g. "--stages fixup" fixes every page in the tmprst tree).
+#  - Each stage has its own pool: threads for the stages that run other
+#    programs, processes for the fixers.  --jobs sets the default size and
+#    --stage-jobs <stage>=<n> changes it for one stage.
+#  - The pandoc and fixup stages skip pages whose inputs are unchanged
+#    since the last run (see convcache.py) and, for the fixers, which hold
+#    no label added to or removed from allrefs (see tokenindex.py);
+#    --force does them all.
+#  - --only <list_file> converts just the sources it lists, one per line
+#    (see get_updated_man.py); the fixers still see every page on disk.
+#
+# Metrics
+#  - For every stage: pages done, failed and skipped, output files that
+#    changed (an unchanged output is not rewritten), wall-clock time from
+#    its first page to its last, busy time summed over the workers, the
+#    largest and mean number of pages waiting or running, and pages per
+#    second.  Printed at the end, and written as JSON with --metrics.
+#  - --trace <file> appends an event per page and per stage to a trace
+#    (see buildtrace.py).
+#
+# Usage (from the top of the ompi tree, as README.sh)
+#  pipeline.py [--stages <stage>,...] [--jobs <n>] [--stage-jobs <stage>=<n>]
+#              [--tmpdir <dir>] [--builddir <dir>] [--rst <dir>]
+#              [--allrefs <allrefs_file>] [--force] [--metrics <json_file>]
+#              [--only <list_file>] [--trace <trace_file>] [<man_dir> ...]
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import time
+
+import buildtrace
+import convcache
+import fix_md_rst
+import fixcommon
+import fixup_rst
+import man2rst
+import manpackage
+import pandoc_stage
+import render_man
+import tokenindex
+
+APPNAME=os.path.basename(__file__)
+
+MANDIRS=["ompi/mpi/man", "ompi/mpiext", "ompi/tools", "oshmem/shmem/man",
+         "opal/tools/wrappers", "oshmem/tools/oshmem_info"]
+
+DEFAULT_STAGES=["man2rst", "pandoc-man", "md2rst", "fixup", "fixmd", "copy"]
+
+# Worker processes are started by a fork server, not forked from this
+# process: a worker forked while a thread is starting pandoc would hold on
+# to that pandoc's pipes and hang it.
+MP_CONTEXT = multiprocessing.get_context('forkserver')
+
+# md page name: MPI_Comm_split.3.md -> MPI_Comm_split.3
+md_section_pat = re.compile(r"\.([0-9]*).md")
+
+# Runs in the stage's worker; returns the result and the time it took.
+def _timed(func, item):
+    start = time.monotonic()
+    result = func(item)
+    return result, time.monotonic() - start
+
+def _man_work(item):
+    return man2rst.convert_source(*item)
+
+def _pandoc_work(item):
+    return pandoc_stage.convert(*item)
+
+# Returns whether the copy changed
+def _copy_work(item):
+    src, dst = item
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    return fixcommon.copy_if_changed(src, dst)
+
+def _render_work(item):
+    args, tmpdir = item
+    pages = list()
+    buildman = os.path.join(args.builddir, "man")
+    if os.path.isdir(buildman):
+        pages.extend(render_man.new_pages(buildman, os.path.join(tmpdir, "tmpman_new")))
+    pages.extend(render_man.orig_pages(".", args.man_dirs,
+                                       os.path.join(tmpdir, "tmpman_orig")))
+    cache = convcache.ConversionCache(os.path.join(tmpdir, "rendercache.json"),
+                                      args.force)
+    rendered, skipped, failed = render_man.render_all(pages, args.jobs, cache)
+    return not failed
+
+def _package_work(item):
+    builddir, rst, jobs = item
+    manpackage.package(os.path.join(builddir, "man"), rst,
+                       os.path.join(builddir, "man-install"), jobs=jobs)
+    return True
+
+# sphinx runs in its own process, with its own pool of -j workers
+def _sphinx_work(item):
+    builddir, builder, jobs = item
+    result = subprocess.run([sys.executable,
+                             os.path.join(fixcommon.DIRNAME, "sphinx_build.py"),
+                             '--builders', builder, '--jobs', str(jobs)],
+                            cwd=builddir, stdout=subprocess.DEVNULL)
+    return result.returncode == 0
+
+class StageMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.changed = 0
+        self.busy = 0.0
+        self.start = None
+        self.end = None
+        self.depth = 0
+        self.max_depth = 0
+        self.depth_total = 0
+        self.samples = 0
+
+    def as_dict(self):
+        wall = (self.end - self.start) if self.start is not None and self.end else 0.0
+        return {
+            "stage": self.name,
+            "done": self.done,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "changed": self.changed,
+            "wall": round(wall, 3),
+            "busy": round(self.busy, 3),
+            "max_queue": self.max_depth,
+            "mean_queue": round(self.depth_total / self.samples, 2) if self.samples else 0,
+            "per_second": round(self.done / wall, 2) if wall > 0 else 0,
+        }
+
+# A pipeline stage.  Subclasses say where pages come from (seed), which
+# can be skipped (skip), what to run (work) and where pages go next (route).
+class Stage:
+    tree = False
+    processes = False
+
+    def __init__(self, name, deps, jobs):
+        self.name = name
+        self.deps = deps
+        self.jobs = max(1, jobs)
+        self.metrics = StageMetrics(name)
+
+    def executor(self):
+        if self.processes:
+            return concurrent.futures.ProcessPoolExecutor(
+                self.jobs, mp_context=MP_CONTEXT)
+        return concurrent.futures.ThreadPoolExecutor(self.jobs)
+
+    # Pages already on disk, for a stage with no selected upstream stage.
+    def seed(self, run):
+        return []
+
+    def skip(self, run, item):
+        return False
+
+    # Next (stage, page) pairs for a page that is done.  result is None for
+    # a skipped page.
+    def route(self, run, item, result):
+        return []
+
+    def close(self, run):
+        pass
+
+    # The page name and figures of a finished page, for the trace (see
+    # buildtrace.py).  result is None for a page that failed.
+    def trace_page(self, item, result):
+        return item[0], {}
+
+class ManStage(Stage):
+    work = staticmethod(_man_work)
+
+    def seed(self, run):
+        return [(fname, run.args.rst, run.tmprst, True)
+                for fname in run.sources(man2rst.find_sources(run.args.man_dirs))]
+
+    def route(self, run, item, result):
+        kind, out, reason, changed = result
+        self.metrics.changed += changed
+        if kind != "pandoc":
+            # written here, not by pandoc: see man2rst.py's --cache
+            run.cache.forget(out)
+        if kind == "native":
+            return [("fixup", run.rst_pair(run.tmprst, out))]
+        if kind == "pandoc":
+            return [("pandoc-man", (item[0], out, "man", run.args.timeout,
+                                    run.args.retries))]
+        return []
+
+    def trace_page(self, item, result):
+        if result is None:
+            return item[0], {}
+        kind, out, reason, changed = result
+        return item[0], {"kind": kind, "out": out, "changed": changed,
+                         "in_bytes": buildtrace.file_size(item[0]),
+                         "out_bytes": buildtrace.file_size(out) if kind != "pandoc" else None}
+
+class PandocStage(Stage):
+    work = staticmethod(_pandoc_work)
+
+    def __init__(self, name, deps, jobs, reader, next_stage, out_dir):
+        super().__init__(name, deps, jobs)
+        self.reader = reader
+        self.next_stage = next_stage
+        self.out_dir = out_dir
+        self.tool = None
+        self.log = None
+
+    def seed(self, run):
+        out_dir = getattr(run, self.out_dir)
+        if self.reader == "man":
+            pairs = [(fname, os.path.join(out_dir, man2rst.rst_name(fname)))
+                     for fname in run.sources(man2rst.find_sources(run.args.man_dirs))
+                     if man2rst.classify(fname)[0] == "pandoc"]
+        else:
+            pairs = [(fname, os.path.join(out_dir, md_rst_name(fname)))
+                     for fname in run.sources(find_md_sources(run.args.man_dirs))]
+        return [(source, out, self.reader, run.args.timeout, run.args.retries)
+                for source, out in pairs]
+
+    def skip(self, run, item):
+        if self.tool is None:
+            self.tool = convcache.hash_text(pandoc_stage.pandoc_version())
+        return run.cache.is_fresh(self.name, item[0], item[1], tool=self.tool)
+
+    def route(self, run, item, result):
+        source, out = item[0], item[1]
+        if result is not None:
+            if self.log is None:
+                self.log = open(os.path.join(run.args.tmpdir, f"{self.name}.json"), 'w')
+            self.log.write(json.dumps(result) + "\n")
+            if result["status"] != "ok":
+                run.cache.forget(out)
+                print(f"ERROR: could not convert {source}: {result['status']}",
+                      file=sys.stderr)
+                return None
+            run.cache.record(self.name, source, out, tool=self.tool)
+        return [(self.next_stage, run.rst_pair(getattr(run, self.out_dir), out))]
+
+    def close(self, run):
+        if self.log:
+            self.log.close()
+
+    def trace_page(self, item, result):
+        if result is None:
+            return item[0], {}
+        return item[0], {"out": item[1], "attempts": result["attempts"],
+                         "in_bytes": buildtrace.file_size(item[0]),
+                         "out_bytes": buildtrace.file_size(item[1]),
+                         "warnings": buildtrace.warning_lines(result["stderr"])}
+
+class FixStage(Stage):
+    processes = True
+    work = staticmethod(fixcommon._fix_in_worker)
+
+    def __init__(self, name, deps, jobs, fixfunc, in_dir):
+        super().__init__(name, deps, jobs)
+        self.fixfunc = fixfunc
+        self.in_dir = in_dir
+        self.tool = fixcommon.fixer_version(fixfunc)
+        self.index = None
+
+    def executor(self):
+        return concurrent.futures.ProcessPoolExecutor(
+            self.jobs, mp_context=MP_CONTEXT, initializer=fixcommon._init_worker,
+            initargs=(self.fixfunc, self.allrefs))
+
+    def seed(self, run):
+        tmp = getattr(run, self.in_dir)
+        pairs = list()
+        for man_dir in run.args.man_dirs:
+            pairs.extend(fixcommon.find_pages(os.path.join(tmp, man_dir),
+                                              os.path.join(run.args.rst, man_dir)))
+        return pairs
+
+    # Names the pages looked up in allrefs (see tokenindex.py)
+    def token_index(self, run):
+        if self.index is None:
+            self.index = tokenindex.TokenIndex(
+                tokenindex.index_file(run.cache.fname, self.name),
+                self.allrefs.labels)
+        return self.index
+
+    def skip(self, run, item):
+        return fixcommon.is_fresh(run.cache, self.token_index(run), self.name,
+                                  item[0], item[1], self.tool)
+
+    def route(self, run, item, result):
+        if result is None:
+            return []
+        messages, error, changed, names, stats = result
+        sys.stderr.write(messages)
+        if error:
+            print(f"ERROR: could not fix {item[0]}", file=sys.stderr)
+            sys.stderr.write(error)
+            run.cache.forget(item[1])
+            self.token_index(run).forget(item[1])
+            return None
+        self.metrics.changed += changed
+        run.cache.record(self.name, item[0], item[1], tool=self.tool)
+        self.token_index(run).record(item[1], names)
+        return []
+
+    def close(self, run):
+        if self.index:
+            self.index.save()
+
+    def trace_page(self, item, result):
+        if result is None:
+            return item[1], {"source": item[0]}
+        return item[1], {"source": item[0], "changed": result[2], **result[4]}
+
+class TreeStage(Stage):
+    tree = True
+
+    def __init__(self, name, deps, work, item):
+        super().__init__(name, deps, 1)
+        self.work = work
+        self.item = item
+
+    def route(self, run, item, result):
+        return [] if result else None
+
+    def trace_page(self, item, result):
+        return self.name, {}
+
+# Copies a file; a copy that did not change it is done too.
+class CopyStage(TreeStage):
+    def __init__(self, name, deps, item):
+        super().__init__(name, deps, _copy_work, item)
+
+    def route(self, run, item, result):
+        self.metrics.changed += result
+        return []
+
+    def trace_page(self, item, result):
+        return self.name, {} if result is None else {"changed": result}
+
+# rst file name for an md page: .../MPI_Comm_split.3.md -> .../MPI_Comm_split.3.rst
+def md_rst_name(fname):
+    return md_section_pat.sub(r".\1", fname, count=1) + ".rst"
+
+def find_md_sources(man_dirs):
+    sources = list()
+    for man_dir in man_dirs:
+        for root, dirs, files in os.walk(man_dir):
+            dirs.sort()
+            sources.extend(os.path.join(root, fname)
+                           for fname in sorted(files) if fname.endswith('.md'))
+    return sources
+
+class Run:
+    def __init__(self, args, stages):
+        self.args = args
+        self.stages = stages
+        self.tmprst = os.path.join(args.tmpdir, "tmprst")
+        self.mdtmprst = os.path.join(args.tmpdir, "tmpmdrst")
+        self.cache = convcache.ConversionCache(
+            os.path.join(args.tmpdir, "convcache.json"), args.force)
+        self.selected = [stage for stage in stages if stage.name in args.stages]
+        self.by_name = {stage.name: stage for stage in self.selected}
+        self.pending = dict()
+        self.closed = set()
+        self.started = set()
+        self.executors = dict()
+        self.only = man2rst.read_source_list(args.only) if args.only else None
+        self.trace = buildtrace.Trace(args.trace)
+
+    # The sources to convert: all of them, or those listed with --only
+    def sources(self, fnames):
+        if self.only is None:
+            return fnames
+        return [fname for fname in fnames if os.path.normpath(fname) in self.only]
+
+    # (tmp page, rst page) pair for a page written under tmp
+    def rst_pair(self, tmp, fname):
+        return (fname, os.path.join(self.args.rst, os.path.relpath(fname, tmp)))
+
+    def upstream(self, stage):
+        return [name for name in stage.deps if name in self.by_name]
+
+    def submit(self, stage, item):
+        metrics = stage.metrics
+        if metrics.start is None:
+            metrics.start = time.monotonic()
+        if not stage.tree and stage.skip(self, item):
+            self.trace.page(stage.name, stage.trace_page(item, None)[0], "skipped")
+            metrics.skipped += 1
+            metrics.end = time.monotonic()
+            self.forward(stage.route(self, item, None))
+            return
+        future = self.executors[stage.name].submit(_timed, stage.work, item)
+        self.pending[future] = (stage, item)
+        metrics.depth += 1
+        metrics.max_depth = max(metrics.max_depth, metrics.depth)
+
+    def forward(self, routes):
+        for name, item in routes or []:
+            if name in self.by_name:
+                self.submit(self.by_name[name], item)
+
+    def finish(self, future):
+        stage, item = self.pending.pop(future)
+        metrics = stage.metrics
+        metrics.depth -= 1
+        metrics.end = time.monotonic()
+        try:
+            result, seconds = future.result()
+        except Exception as err:
+            print(f"ERROR: {stage.name}: {item}: {err}", file=sys.stderr)
+            self.trace.page(stage.name, stage.trace_page(item, None)[0], "failed",
+                            error=str(err))
+            metrics.failed += 1
+            return
+        metrics.busy += seconds
+        routes = stage.route(self, item, result)
+        page, fields = stage.trace_page(item, result)
+        self.trace.page(stage.name, page, "failed" if routes is None else "ok",
+                        **{"seconds": round(seconds, 6), **fields})
+        if routes is None:
+            metrics.failed += 1
+        else:
+            metrics.done += 1
+            self.forward(routes)
+
+    # Start tree stages whose inputs are complete; close drained stages.
+    def advance(self):
+        changed = True
+        while changed:
+            changed = False
+            for stage in self.selected:
+                if stage.name in self.closed:
+                    continue
+                if not all(name in self.closed for name in self.upstream(stage)):
+                    continue
+                if stage.tree and stage.name not in self.started:
+                    self.started.add(stage.name)
+                    self.submit(stage, stage.item)
+                if stage.metrics.depth == 0:
+                    self.closed.add(stage.name)
+                    stage.close(self)
+                    self.trace.write({"event": "stage", **stage.metrics.as_dict()})
+                    changed = True
+
+    def run(self):
+        for stage in self.selected:
+            self.executors[stage.name] = stage.executor()
+        try:
+            for stage in self.selected:
+                if not stage.tree and not self.upstream(stage):
+                    for item in stage.seed(self):
+                        self.submit(stage, item)
+            self.advance()
+            while self.pending:
+                done, _ = concurrent.futures.wait(
+                    self.pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    self.finish(future)
+                for stage in self.selected:
+                    if stage.name not in self.closed:
+                        stage.metrics.depth_total += stage.metrics.depth
+                        stage.metrics.samples += 1
+                self.advance()
+        finally:
+            for executor in self.executors.values():
+                executor.shutdown()
+            self.cache.save()
+            self.trace.close()
+        return [stage.metrics.as_dict() for stage in self.selected]
+
+def make_stages(args, jobs_for):
+    builddir = args.builddir
+    fixup = FixStage("fixup", ["man2rst", "pandoc-man"], jobs_for("fixup"),
+                     fixup_rst.fixup_lines, "tmprst")
+    fixmd = FixStage("fixmd", ["md2rst"], jobs_for("fixmd"),
+                     fix_md_rst.fixup_lines, "mdtmprst")
+    allrefs = fixcommon.load_allrefs(args.allrefs)
+    fixup.allrefs = fixmd.allrefs = allrefs
+    openmpi5 = (os.path.join(fixcommon.DIRNAME, "Open-MPI.5.rst"),
+                os.path.join(args.rst, "ompi/mpi/man/man5/Open-MPI.5.rst"))
+    sphinx_deps = ["fixup", "fixmd", "copy"]
+    return [
+        ManStage("man2rst", [], jobs_for("man2rst")),
+        PandocStage("pandoc-man", ["man2rst"], jobs_for("pandoc-man"), "man", "fixup",
+                    "tmprst"),
+        PandocStage("md2rst", [], jobs_for("md2rst"), "gfm", "fixmd",
+                    "mdtmprst"),
+        fixup,
+        fixmd,
+        CopyStage("copy", ["fixup"], openmpi5),
+        TreeStage("html", sphinx_deps, _sphinx_work,
+                  (builddir, "html", jobs_for("html"))),
+        # after html, so the pages are read once (see sphinx_build.py)
+        TreeStage("man", sphinx_deps + ["html"], _sphinx_work,
+                  (builddir, "man", jobs_for("man"))),
+        TreeStage("package", ["man"], _package_work,
+                  (builddir, args.rst, jobs_for("package"))),
+        TreeStage("render", ["man"], _render_work, (args, args.tmpdir)),
+    ]
+
+def report(metrics):
+    print(f"{'stage':12} {'done':>6} {'failed':>6} {'skipped':>7} {'changed':>7} {'wall s':>8} "
+          f"{'busy s':>8} {'maxq':>5} {'meanq':>6} {'pages/s':>8}")
+    for m in metrics:
+        print(f"{m['stage']:12} {m['done']:6} {m['failed']:6} {m['skipped']:7} {m['changed']:7} "
+              f"{m['wall']:8.2f} {m['busy']:8.2f} {m['max_queue']:5} "
+              f"{m['mean_queue']:6.1f} {m['per_second']:8.1f}")
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('man_dirs', nargs='*', default=MANDIRS)
+    parser.add_argument('--stages', default=",".join(DEFAULT_STAGES),
+                        help="comma-separated stages to run")
+    parser.add_argument('--jobs', type=int, default=fixcommon.default_jobs())
+    parser.add_argument('--stage-jobs', action='append', default=[],
+                        metavar='STAGE=N')
+    parser.add_argument('--tmpdir', default="/tmp/ompiman")
+    parser.add_argument('--builddir', default="./_build/")
+    parser.add_argument('--rst', default="./rst/")
+    parser.add_argument('--allrefs', default=fixcommon.ALLREFSFILE)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--retries', type=int, default=1)
+    parser.add_argument('--force', action='store_true')
+    parser.add_argument('--metrics', default=None)
+    parser.add_argument('--only', default=None)
+    parser.add_argument('--trace', default=None)
+    args = parser.parse_args(argv[1:])
+
+    stage_jobs = dict()
+    for spec in args.stage_jobs:
+        name, _, count = spec.partition('=')
+        stage_jobs[name] = int(count)
+    jobs_for = lambda name: stage_jobs.get(name, args.jobs)
+
+    stages = make_stages(args, jobs_for)
+    args.stages = args.stages.split(',')
+    unknown = set(args.stages) - {stage.name for stage in stages}
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    os.makedirs(args.tmpdir, exist_ok=True)
+
+    start = time.monotonic()
+    metrics = Run(args, stages).run()
+    elapsed = time.monotonic() - start
+    report(metrics)
+    print(f"{APPNAME}: {elapsed:.2f}s end to end")
+    if args.metrics:
+        with open(args.metrics, 'w') as fp:
+            json.dump({"elapsed": round(elapsed, 3), "stages": metrics}, fp, indent=1)
+    return 1 if any(m["failed"] for m in metrics) else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
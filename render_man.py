@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# This script renders man pages to text for the verification stages of
+# README.sh:
+#  - every page sphinx wrote to _build/man goes to tmpman_new/<page>,
+#  - every original nroff source (*.Nin) below the man dirs goes to
+#    tmpman_orig/<page> (the source name without the trailing "in").
+#
+# All pages go through one pool of "man" processes fed from a single
+# queue, so a slow page holds up one worker, not a batch.  A page whose
+# source (and the man version) is unchanged since it was last rendered,
+# and whose rendering is still there, is skipped (see convcache.py);
+# --force renders them all.  For a ".so" page the page it includes (and
+# the page that one includes, if it is a ".so" page too) is a source as
+# well, so editing a page renders the pages including it again.
+#
+# Usage
+#  render_man.py [--jobs <n>] [--force] [--cache <manifest>]
+#                [--new <rendered_dir>] [--orig <rendered_dir>]
+#                [--buildman <man_dir>] [--manhome <ompi_dir>] [<man_dir> ...]
+
+import argparse
+import concurrent.futures
+import os
+import subprocess
+import sys
+
+import convcache
+import fixcommon
+import man2rst
+
+APPNAME=os.path.basename(__file__)
+
+MANDIRS=["ompi/mpi/man", "ompi/mpiext", "ompi/tools", "oshmem/shmem/man",
+         "opal/tools/wrappers", "oshmem/tools/oshmem_info"]
+
+# Longest chain of ".so" pages followed
+MAXSO=8
+
+def man_version():
+    try:
+        result = subprocess.run(['man', '--version'], capture_output=True,
+                                text=True)
+    except OSError:
+        return ""
+    return result.stdout.split('\n')[0]
+
+# Pages are rendered from the directory README.sh ran man in, so that ".so"
+# requests resolve the same way.  Both functions return
+# (page, rendering, directory to run man in) triples.
+
+# The pages sphinx wrote
+def new_pages(buildman, out_dir):
+    with os.scandir(buildman) as entries:
+        names = sorted(entry.name for entry in entries if not entry.is_dir())
+    return [(os.path.join(buildman, name), os.path.join(out_dir, name), buildman)
+            for name in names]
+
+# The original man sources
+def orig_pages(manhome, man_dirs, out_dir):
+    pages = list()
+    for source in man2rst.find_sources(os.path.join(manhome, d) for d in man_dirs):
+        name = os.path.basename(source)
+        if name.endswith('in'):
+            name = name[:-2]
+        pages.append((source, os.path.join(out_dir, name), manhome))
+    return pages
+
+# The file a ".so" page includes, None if it is not one.  man looks for
+# it from the directory it runs in; the sources name it from their man
+# directory ("man3/MPI_Send.3" for MPI_Send.3in).
+def so_target(fname, root):
+    with open(fname, errors='replace') as fp:
+        for line in fp:
+            if man2rst.so_pat.match(line):
+                fields = line.split()
+                if len(fields) < 2:
+                    return None
+                for base in (root, os.path.dirname(os.path.dirname(fname))):
+                    for name in (fields[1], f"{fields[1]}in"):
+                        target = os.path.normpath(os.path.join(base, name))
+                        if os.path.isfile(target):
+                            return target
+                return None
+    return None
+
+# Every file the rendering of a page reads besides the page itself
+def so_deps(source, root):
+    deps = list()
+    fname = source
+    for _ in range(MAXSO):
+        try:
+            fname = so_target(fname, root)
+        except OSError:
+            break
+        if fname is None or fname == source or fname in deps:
+            break
+        deps.append(fname)
+    return deps
+
+# "cd root; man ./page > out 2>&1"
+def render(source, out, root):
+    page = os.path.join('.', os.path.relpath(source, root))
+    tmp = f"{out}.tmp{os.getpid()}"
+    with open(tmp, 'w') as fp:
+        result = subprocess.run(['man', page], cwd=root, stdout=fp,
+                                stderr=subprocess.STDOUT)
+    os.replace(tmp, out)
+    return result.returncode
+
+# Render every page through one pool.  Returns (rendered, skipped, failed).
+def render_all(pages, jobs, cache=None, stage="render"):
+    tool = convcache.hash_text(man_version())
+    roots = {(source, out): root for source, out, root in pages}
+    pairs = list(roots)
+    deps = {pair: so_deps(pair[0], roots[pair]) for pair in pairs}
+    if cache:
+        stale = list()
+        fresh = list()
+        for pair in pairs:
+            if cache.is_fresh(stage, *pair, deps[pair], tool):
+                fresh.append(pair)
+            else:
+                stale.append(pair)
+    else:
+        stale, fresh = pairs, []
+    for source, out in stale:
+        os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+
+    failed = list()
+    with concurrent.futures.ThreadPoolExecutor(max(1, jobs)) as pool:
+        futures = {pool.submit(render, source, out, roots[source, out]): (source, out)
+                   for source, out in stale}
+        for future in concurrent.futures.as_completed(futures):
+            source, out = futures[future]
+            try:
+                returncode = future.result()
+            except OSError as err:
+                print(f"ERROR: could not render {source}: {err}", file=sys.stderr)
+                returncode = None
+            if returncode == 0:
+                if cache:
+                    cache.record(stage, source, out, deps[source, out], tool)
+            else:
+                failed.append(source)
+                if cache:
+                    cache.forget(out)
+    if cache:
+        cache.save()
+    return len(stale) - len(failed), len(fresh), failed
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('man_dirs', nargs='*', default=MANDIRS)
+    parser.add_argument('--jobs', type=int, default=fixcommon.default_jobs())
+    parser.add_argument('--buildman', default="./_build/man/")
+    parser.add_argument('--manhome', default=".")
+    parser.add_argument('--new', default="/tmp/ompiman/tmpman_new/")
+    parser.add_argument('--orig', default="/tmp/ompiman/tmpman_orig/")
+    parser.add_argument('--cache', default="/tmp/ompiman/rendercache.json")
+    parser.add_argument('--force', action='store_true')
+    args = parser.parse_args(argv[1:])
+
+    pages = list()
+    if os.path.isdir(args.buildman):
+        pages.extend(new_pages(args.buildman, args.new))
+    pages.extend(orig_pages(args.manhome, args.man_dirs, args.orig))
+
+    cache = convcache.ConversionCache(args.cache, args.force)
+    rendered, skipped, failed = render_all(pages, args.jobs, cache)
+    print(f"{APPNAME}: rendered {rendered}, unchanged {skipped}, "
+          f"failed {len(failed)}")
+    print(f"new man page output in {args.new}")
+    print(f"original man page output in {args.orig}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# Block-level model of a pandoc-generated rst page, shared by fixup_rst.py
+# and fix_md_rst.py.
+#
+# A page is read once, line by line, and cut into sections.  Each section
+# has a heading (a title line followed by an underline) and a list of
+# blocks:
+#  - BLANK      a blank line
+#  - Paragraph  a run of non-blank text lines
+#  - Param      a paragraph in a parameter section ("buf" + description)
+#  - ListItem   a "- item" or "* item" line and its continuation lines
+#  - Literal    a literal or code block: the line that starts it ("::" or
+#               ".. code:: c") and every line up to the end of the block
+#  - SeeAlso    the lines of a see-also section
+#
+# What counts as an underline, a literal block, a list item and so on
+# differs between the two fixers, so each passes its own Grammar.
+#
+# Sections are yielded as soon as they are complete, so only one section
+# is held in memory at a time.  Blocks end where the text says they end
+# (a blank line, the next heading, the end of the page); nothing ever
+# reads past the end of the page.
+
+import fixcommon
+
+class Grammar:
+    __slots__ = ('underline', 'level1', 'literal', 'text', 'listitem',
+                 'params', 'seealso')
+
+    # underline  line under a heading title
+    # level1     underline of a top-level heading (default: any underline)
+    # literal    line that starts a literal block
+    # text       line that ends a literal block; None: it runs to the next
+    #            heading
+    # listitem   line that starts a list item; None: no list items
+    # params     title of a section made of parameter descriptions
+    # seealso    title of a top-level see-also section that runs to the end
+    #            of the page
+    def __init__(self, underline, literal, level1=None, text=None,
+                 listitem=None, params=None, seealso=None):
+        self.underline = underline
+        self.level1 = level1 or underline
+        self.literal = literal
+        self.text = text
+        self.listitem = listitem
+        self.params = params
+        self.seealso = seealso
+
+class Heading:
+    __slots__ = ('title', 'underline')
+
+    def __init__(self, title, underline):
+        self.title = title
+        self.underline = underline
+
+class Blank:
+    __slots__ = ()
+    lines = ("",)
+    at_end = False
+
+# All blank lines are the same
+BLANK = Blank()
+
+# at_end is set on the block that holds the last line of the page.
+class Paragraph:
+    __slots__ = ('lines', 'at_end')
+
+    def __init__(self, line):
+        self.lines = [line]
+        self.at_end = False
+
+class Param(Paragraph):
+    __slots__ = ()
+
+class ListItem(Paragraph):
+    __slots__ = ()
+
+class SeeAlso(Paragraph):
+    __slots__ = ()
+
+    def __init__(self):
+        self.lines = list()
+        self.at_end = False
+
+class Literal:
+    # marker  the line that started the block, or None if the block goes on
+    #         after a list item that interrupted it
+    # prev    the last line before the marker that is neither blank nor an
+    #         underline (it usually names the language)
+    # empty   the next heading starts two lines after the marker
+    __slots__ = ('marker', 'lines', 'prev', 'empty', 'at_end')
+
+    def __init__(self, marker, prev="", empty=False):
+        self.marker = marker
+        self.lines = list()
+        self.prev = prev
+        self.empty = empty
+        self.at_end = False
+
+class Section:
+    # heading is None for the lines before the first heading
+    __slots__ = ('heading', 'blocks')
+
+    def __init__(self, heading=None):
+        self.heading = heading
+        self.blocks = list()
+
+# Cut lines (any iterable, e.g. an open file) into sections.
+# Yields Section objects in page order.
+def parse(lines, grammar):
+    window = fixcommon.LineWindow(lines)
+    underline = grammar.underline
+    section = Section()
+    block = None         # block that the next non-blank line may extend
+    literal = None       # open literal block
+    resume = False       # go back to literal once the list item ends
+    inparams = False
+    inseealso = False
+    prev = ""
+    skip = 0
+
+    for i, line in enumerate(window):
+        line = line.rstrip()
+        if skip:
+            # the underline of the heading just started
+            skip -= 1
+        elif inseealso:
+            block.lines.append(line)
+        elif window.has(i+1) and underline.match(window[i+1].rstrip()):
+            yield section
+            section = Section(Heading(line, window[i+1].rstrip()))
+            block = literal = None
+            resume = False
+            skip = 1
+            inparams = bool(grammar.params and grammar.params.match(line))
+            if (grammar.seealso and grammar.seealso.match(line)
+                and grammar.level1.match(section.heading.underline)):
+                inseealso = True
+                block = SeeAlso()
+                section.blocks.append(block)
+        elif grammar.literal.match(line):
+            empty = window.has(i+3) and bool(underline.match(window[i+3].rstrip()))
+            block = literal = Literal(line, prev, empty)
+            resume = False
+            section.blocks.append(block)
+        elif grammar.listitem and grammar.listitem.match(line):
+            resume = resume or literal is not None
+            literal = None
+            block = ListItem(line)
+            section.blocks.append(block)
+        elif literal and not (grammar.text and grammar.text.match(line)):
+            literal.lines.append(line)
+        elif not line:
+            block = literal = None
+            if resume:
+                # a list item interrupted a literal block, which goes on
+                block = literal = Literal(None)
+                literal.lines.append(line)
+                resume = False
+                section.blocks.append(block)
+            else:
+                section.blocks.append(BLANK)
+        elif block and not literal:
+            block.lines.append(line)
+            if resume and grammar.text and grammar.text.match(line):
+                resume = False
+        else:
+            literal = None
+            block = Param(line) if inparams else Paragraph(line)
+            section.blocks.append(block)
+
+        if line and not underline.match(line):
+            prev = line
+
+    if block:
+        block.at_end = True
+    yield section
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+# This script builds the html and man pages from the rst tree (replaces the
+# two sphinx-build runs of README.sh).
+#
+# Features
+#  - The rst tree is read once: every builder uses the same doctree
+#    directory, so the first builder reads and resolves the pages and
+#    pickles the environment, and the others start from it.
+#  - The doctree directory is kept between runs, so a later build reads
+#    again only the pages that changed (--fresh reads them all).
+#  - Pages are read and written by <n> parallel processes (sphinx-build's
+#    -j); conf.py and the extensions it loads must be parallel safe.
+#  - The messages of each builder go to sphinx-build_rst2<builder>.output,
+#    as before.
+#
+# Usage (from the build directory, as README.sh)
+#  sphinx_build.py [--builders html,man] [--jobs <n>] [--rst <rst_dir>]
+#                  [--doctrees <dir>] [--fresh] [-v]
+
+import argparse
+import os
+import sys
+
+import fixcommon
+
+APPNAME=os.path.basename(__file__)
+
+BUILDERS=["html", "man"]
+
+# Build one output tree; returns sphinx's exit status.
+def build(builder, srcdir, outdir, doctreedir, jobs, fresh=False, verbosity=0):
+    # sphinx is only needed here, not by the modules importing this one
+    from sphinx.application import Sphinx
+    from sphinx.util.docutils import docutils_namespace, patch_docutils
+
+    errorfile = f"sphinx-build_rst2{builder}.output"
+    with open(errorfile, 'w') as fp:
+        # as sphinx-build's main does
+        with patch_docutils(srcdir), docutils_namespace():
+            app = Sphinx(srcdir, srcdir, outdir, doctreedir, builder,
+                         status=fp, warning=fp, freshenv=fresh,
+                         verbosity=verbosity, parallel=jobs)
+            app.build()
+    return app.statuscode
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('--builders', default=",".join(BUILDERS))
+    parser.add_argument('--jobs', type=int, default=fixcommon.default_jobs())
+    parser.add_argument('--rst', default="rst/")
+    parser.add_argument('--doctrees', default="doctrees/")
+    parser.add_argument('--fresh', action='store_true')
+    parser.add_argument('-v', dest='verbosity', action='count', default=0)
+    args = parser.parse_args(argv[1:])
+
+    status = 0
+    fresh = args.fresh
+    for builder in args.builders.split(','):
+        result = build(builder, args.rst, f"{builder}/", args.doctrees,
+                       args.jobs, fresh, args.verbosity)
+        print(f"{APPNAME}: {builder} build {'failed' if result else 'done'}, "
+              f"see sphinx-build_rst2{builder}.output")
+        status = status or result
+        # the environment is up to date now
+        fresh = False
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
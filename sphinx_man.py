@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+# This module is a sphinx extension that reads the man page sources
+# themselves (*.Nin and *.N.md), converting each page in memory while
+# sphinx reads it, instead of going through the tmprst and tmpmdrst trees
+# and the rst tree.
+#
+# Conversion, for each page
+#  - nroff: a ".so" page becomes the page it includes, under its own
+#    name; a simple page is converted by man2rst.py, any other by pandoc;
+#    then fixup_rst.py's fixes are applied.
+#  - md: pandoc, then fix_md_rst.py's fixes.
+#  - The rst is handed to sphinx's rst parser.
+#
+# Rebuilds
+#  - sphinx reads again the pages whose source changed.  A ".so" page
+#    and every page also depend on the page they include and on the
+#    allrefs file, so a change to either reads them again too.
+#
+# Source tree
+#  - sphinx reads a tree of links to the sources, made by --link: one link
+#    per page, the md page winning over the nroff page of the same name,
+#    and a link to this file, next to conf.py, which loads the extension
+#    when it finds it.  Pages written by hand (Open-MPI.5.rst) are copied
+#    in instead of their sources.
+#
+# Usage
+#  sphinx_man.py --link <src_dir> [<man_dir> ...]
+#  in conf.py: extensions.append('sphinx_man')
+
+import argparse
+import contextlib
+import io
+import os
+import re
+import sys
+
+# The other modules of this directory, found through the link to this
+# file in the source tree
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+import fix_md_rst
+import fixcommon
+import fixup_rst
+import man2rst
+import pandoc_stage
+
+APPNAME=os.path.basename(__file__)
+
+MANDIRS=["ompi/mpi/man", "ompi/mpiext", "ompi/tools", "oshmem/shmem/man",
+         "opal/tools/wrappers", "oshmem/tools/oshmem_info"]
+
+# Pages written by hand, by name in the source tree
+OVERRIDES={"ompi/mpi/man/man5/Open-MPI.5": os.path.join(fixcommon.DIRNAME, "Open-MPI.5.rst")}
+
+# Largest number of ".so" pages followed from one page
+MAXINCLUDES=4
+
+# PATTERNS
+# page sources: MPI_Send.3in, MPI_Comm_split.3.md
+nroff_pat = re.compile(r"^(.*\.[0-9]+)in$")
+md_pat = re.compile(r"^(.*\.[0-9]+)\.md$")
+include_body_pat = re.compile(r"^\s*\.\. include_body")
+
+# The allrefs index, loaded once per process
+_allrefs = dict()
+
+def allrefs_for(fname):
+    if fname not in _allrefs:
+        _allrefs[fname] = fixcommon.load_allrefs(fname)
+    return _allrefs[fname]
+
+# Run a fixer over lines, passing on what it prints
+def _fix(fixfunc, lines, source, allrefs, messages):
+    with contextlib.redirect_stdout(messages), contextlib.redirect_stderr(messages):
+        return list(fixfunc(lines, fixcommon.get_cmdname(source), allrefs))
+
+def _pandoc(source, reader, config):
+    output, entry = pandoc_stage.run_pandoc(os.path.realpath(source), reader,
+                                            config.ompi_man_timeout,
+                                            config.ompi_man_retries)
+    if output is None:
+        raise RuntimeError(f"pandoc {entry['status']}: {entry['stderr'].strip()}")
+    return output.decode('utf-8', errors='replace').splitlines(keepends=True)
+
+# The source a ".so" line refers to, as the rst stub's include did:
+# relative to the directory above the page's
+def _included_source(source, so_line):
+    fields = so_line.split()
+    if len(fields) < 2:
+        raise RuntimeError(f"empty .so request in {source}")
+    target = os.path.join(os.path.dirname(os.path.dirname(source)), fields[1])
+    for candidate in (f"{target}in", f"{target}.md"):
+        if os.path.exists(candidate):
+            return candidate
+    raise RuntimeError(f"{source}: no source for .so {fields[1]}")
+
+# The rst lines for one page source.  depends collects the other files the
+# page was made from.
+def convert_page(source, text, config, depends, messages, level=0):
+    allrefs = allrefs_for(config.ompi_man_allrefs)
+    depends.append(config.ompi_man_allrefs)
+    if md_pat.match(os.path.basename(source)):
+        return _fix(fix_md_rst.fixup_lines, _pandoc(source, "gfm", config),
+                    source, allrefs, messages)
+
+    kind, result = man2rst.classify_lines(text.splitlines(keepends=True),
+                                          config.ompi_man_native)
+    if kind == "stub":
+        if level >= MAXINCLUDES:
+            raise RuntimeError(f"{source}: too many nested .so requests")
+        target = _included_source(source, result)
+        depends.append(target)
+        with open(target, errors='replace') as fp:
+            body = convert_page(target, fp.read(), config, depends, messages,
+                                level + 1)
+        # the stub's heading, then what its include would have read
+        lines = man2rst.stub_lines(source, result)
+        heading = lines[:lines.index("    .. include_body") + 1]
+        for i, line in enumerate(body):
+            if include_body_pat.match(line):
+                return heading + [""] + body[i+1:]
+        return heading + [""] + body
+    if kind == "native":
+        lines = [f"{line}\n" for line in result]
+    else:
+        lines = _pandoc(source, "man", config)
+    return _fix(fixup_rst.fixup_lines, lines, source, allrefs, messages)
+
+def link_sources(src_dir, man_dirs, overrides=OVERRIDES):
+    pages = dict()
+    for man_dir in man_dirs:
+        for root, dirs, files in os.walk(man_dir):
+            dirs.sort()
+            for fname in sorted(files):
+                match = nroff_pat.match(fname) or md_pat.match(fname)
+                if not match:
+                    continue
+                page = os.path.join(root, match.group(1))
+                # md pages replace the nroff ones, as fix_md_rst.py's
+                # output replaces fixup_rst.py's
+                if page not in pages or fname.endswith('.md'):
+                    pages[page] = os.path.join(root, fname)
+
+    wanted = set()
+    for page, source in sorted(pages.items()):
+        if page in overrides:
+            dest = os.path.join(src_dir, f"{page}.rst")
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            fixcommon.copy_if_changed(overrides[page], dest)
+            wanted.add(dest)
+            continue
+        dest = os.path.join(src_dir, os.path.relpath(source))
+        wanted.add(dest)
+        target = os.path.abspath(source)
+        if os.path.islink(dest) and os.readlink(dest) == target:
+            continue
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if os.path.lexists(dest):
+            os.remove(dest)
+        os.symlink(target, dest)
+
+    # links to sources that went away
+    removed = 0
+    for root, dirs, files in os.walk(src_dir):
+        for fname in files:
+            path = os.path.join(root, fname)
+            if os.path.islink(path) and path not in wanted and root != src_dir:
+                os.remove(path)
+                removed += 1
+
+    ext = os.path.join(src_dir, APPNAME)
+    if not os.path.lexists(ext):
+        os.symlink(os.path.abspath(__file__), ext)
+    return len(wanted), removed
+
+# Everything below runs inside sphinx only.
+
+try:
+    from sphinx.parsers import RSTParser
+    from sphinx.util import logging
+except ImportError:
+    RSTParser = object
+
+class ManPageParser(RSTParser):
+    supported = ('ompi-man',)
+
+    def parse(self, inputstring, document):
+        logger = logging.getLogger(__name__)
+        source = document['source']
+        env = document.settings.env
+        depends = list()
+        messages = io.StringIO()
+        try:
+            lines = convert_page(source, inputstring, env.config, depends, messages)
+        except (OSError, RuntimeError) as err:
+            logger.warning(f"could not convert: {err}", location=env.docname)
+            lines = []
+        for message in messages.getvalue().split('\n'):
+            if message.strip():
+                logger.info(message, location=env.docname)
+        for dep in depends:
+            env.note_dependency(os.path.abspath(dep))
+        super().parse("".join(f"{line}\n" for line in lines), document)
+
+def setup(app):
+    app.add_config_value('ompi_man_allrefs', fixcommon.ALLREFSFILE, 'env')
+    app.add_config_value('ompi_man_native', True, 'env')
+    app.add_config_value('ompi_man_timeout', 60, '')
+    app.add_config_value('ompi_man_retries', 1, '')
+    # "in" so that MPI_Send.3in is the page MPI_Send.3, as in the rst tree
+    app.add_source_suffix('in', 'ompi-man')
+    app.add_source_suffix('.md', 'ompi-man', override=True)
+    app.add_source_parser(ManPageParser)
+    return {'version': '1', 'env_version': 1,
+            'parallel_read_safe': True, 'parallel_write_safe': True}
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('man_dirs', nargs='*', default=MANDIRS)
+    parser.add_argument('--link', required=True, metavar='SRC_DIR')
+    args = parser.parse_args(argv[1:])
+
+    linked, removed = link_sources(args.link, args.man_dirs)
+    print(f"{APPNAME}: {linked} pages in {args.link}, {removed} old links removed")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
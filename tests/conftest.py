@@ -0,0 +1,11 @@
+# The scripts are top-level modules of the repository, not a package:
+# make them importable from the tests.
+
+import os
+import sys
+
+REPODIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+if REPODIR not in sys.path:
+    sys.path.insert(0, REPODIR)
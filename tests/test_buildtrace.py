@@ -0,0 +1,93 @@
+# buildtrace.py: the trace format and its summary.
+
+import json
+
+import buildtrace
+
+def write_trace(fname):
+    with buildtrace.Trace(fname) as trace:
+        trace.page("fixup_rst", "rst/MPI_Send.3.rst", seconds=0.5, in_bytes=100,
+                   out_bytes=120, resolved=3, unresolved=2,
+                   warnings=["WARNING: MPI_Foo not in allrefs_list"])
+        trace.page("fixup_rst", "rst/MPI_Recv.3.rst", "failed", seconds=1.5,
+                   in_bytes=50, resolved=1, unresolved=4,
+                   warnings=["WARNING: MPI_Foo not in allrefs_list",
+                             "WARNING: MPI_Bar not in allrefs_list"])
+        trace.page("fixup_rst", "rst/MPI_Wait.3.rst", "skipped")
+        trace.stage("fixup_rst", pages=3, wall=1.25)
+        trace.page("man2rst", "man/MPI_Send.3in", seconds=0.25, out_bytes=80)
+    with open(fname, 'a') as fp:
+        fp.write('{"event": "page", "stage": "man2rst", "pa\n\n')
+    with buildtrace.Trace(fname) as trace:
+        trace.page("man2rst", "man/MPI_Recv.3in", seconds=2.0)
+
+def test_trace_lines(tmp_path):
+    fname = str(tmp_path / "trace.jsonl")
+    with buildtrace.Trace(fname) as trace:
+        trace.page("man2rst", "man/MPI_Send.3in", kind="native", seconds=0.1)
+        trace.stage("man2rst", wall=0.2)
+    with open(fname) as fp:
+        events = [json.loads(line) for line in fp]
+    assert all(isinstance(event.pop("time"), float) for event in events)
+    assert events == [
+        {"event": "page", "stage": "man2rst", "page": "man/MPI_Send.3in",
+         "status": "ok", "kind": "native", "seconds": 0.1},
+        {"event": "stage", "stage": "man2rst", "wall": 0.2}]
+
+def test_no_file_no_trace(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with buildtrace.Trace() as trace:
+        trace.page("man2rst", "man/MPI_Send.3in")
+    assert list(tmp_path.iterdir()) == []
+
+def test_bad_lines_are_skipped(tmp_path, capsys):
+    fname = str(tmp_path / "trace.jsonl")
+    write_trace(fname)
+    events = buildtrace.read_events(fname)
+    assert len(events) == 6
+    assert "skipping bad line" in capsys.readouterr().err
+
+def test_summary(tmp_path):
+    fname = str(tmp_path / "trace.jsonl")
+    write_trace(fname)
+    summary = buildtrace.summarize(buildtrace.read_events(fname), top=2)
+    assert summary["events"] == 6
+    assert summary["stages"] == [
+        {"stage": "man2rst", "pages": 2, "statuses": {"ok": 2}, "seconds": 2.25,
+         "max_seconds": 2.0, "in_bytes": 0, "out_bytes": 80, "resolved": 0,
+         "unresolved": 0, "warnings": 0, "mean_seconds": 1.125},
+        {"stage": "fixup_rst", "pages": 3,
+         "statuses": {"ok": 1, "failed": 1, "skipped": 1}, "seconds": 2.0,
+         "max_seconds": 1.5, "in_bytes": 150, "out_bytes": 120, "resolved": 4,
+         "unresolved": 6, "warnings": 3, "wall": 1.25, "mean_seconds": 0.6667}]
+    assert summary["slowest_pages"] == [
+        {"stage": "man2rst", "page": "man/MPI_Recv.3in", "seconds": 2.0},
+        {"stage": "fixup_rst", "page": "rst/MPI_Recv.3.rst", "seconds": 1.5}]
+    assert summary["most_unresolved"] == [
+        {"stage": "fixup_rst", "page": "rst/MPI_Recv.3.rst", "unresolved": 4},
+        {"stage": "fixup_rst", "page": "rst/MPI_Send.3.rst", "unresolved": 2}]
+    assert summary["warnings"] == [
+        {"warning": "WARNING: MPI_Foo not in allrefs_list", "count": 2},
+        {"warning": "WARNING: MPI_Bar not in allrefs_list", "count": 1}]
+
+def test_stage_filter(tmp_path, capsys):
+    fname = str(tmp_path / "trace.jsonl")
+    write_trace(fname)
+    assert buildtrace.main([buildtrace.APPNAME, "--stage", "fixup_rst", "--json",
+                            fname]) == 0
+    summary = json.loads(capsys.readouterr().out)
+    assert [stage["stage"] for stage in summary["stages"]] == ["fixup_rst"]
+    assert summary["stages"][0]["wall"] == 1.25
+    assert summary["events"] == 4
+    assert {event["stage"] for event in summary["slowest_pages"]} == {"fixup_rst"}
+
+def test_printed_summary(tmp_path, capsys):
+    fname = str(tmp_path / "trace.jsonl")
+    write_trace(fname)
+    assert buildtrace.main([buildtrace.APPNAME, fname]) == 0
+    out = capsys.readouterr().out.split('\n')
+    # man2rst has no stage event: no wall time
+    assert out[1].split() == ["man2rst", "2", "0", "2.25", "2.000", "1.1250",
+                              "-", "0", "0"]
+    assert out[2].split() == ["fixup_rst", "3", "1", "2.00", "1.500", "0.6667",
+                              "1.25", "6", "3"]
@@ -0,0 +1,51 @@
+# checkrefs.py: toctree entries, plain and :glob:.
+
+import checkrefs
+
+def write_tree(root, pages):
+    for name, text in pages.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+
+def problems(root):
+    entries = checkrefs.scan_tree(str(root), 1)
+    return sorted((p["page"], p["line"], p["kind"], p["detail"])
+                  for p in checkrefs.check(str(root), entries))
+
+def test_glob_entries_match_pages(tmp_path):
+    write_tree(tmp_path, {
+        "index.rst": ".. toctree::\n   :glob:\n   :maxdepth: 1\n\n"
+                     "   intro\n   man3/MPI_*\n   man1/*\n   man[57]/**\n",
+        "intro.rst": "Intro\n",
+        "man3/MPI_Send.3.rst": "send\n",
+        "man3/MPI_Recv.3.rst": "recv\n",
+        "man3/shmem_put.3.rst": "put\n",
+        "man1/mpirun.1.rst": "run\n",
+        "man1/sub/deep.1.rst": "deep\n",
+        "man5/dir/conf.5.rst": "conf\n",
+    })
+    # * stays within a directory, ** does not
+    assert problems(tmp_path) == [
+        ("man1/sub/deep.1.rst", 1, "orphan", "in no toctree"),
+        ("man3/shmem_put.3.rst", 1, "orphan", "in no toctree"),
+    ]
+
+def test_glob_matching_nothing(tmp_path):
+    write_tree(tmp_path, {
+        "index.rst": ".. toctree::\n   :glob:\n\n   intro\n   man7/*\n   gone\n",
+        "intro.rst": "Intro\n",
+    })
+    assert problems(tmp_path) == [
+        ("index.rst", 5, "toctree", "no page matches man7/*"),
+        ("index.rst", 6, "toctree", "no page gone"),
+    ]
+
+# Without :glob:, sphinx reads a * as part of the page name
+def test_pattern_without_glob_option(tmp_path):
+    write_tree(tmp_path, {
+        "index.rst": ".. toctree::\n   :glob:\n\n   a*\n\n"
+                     ".. toctree::\n\n   a*\n",
+        "a1.rst": "a1\n",
+    })
+    assert problems(tmp_path) == [("index.rst", 8, "toctree", "no page a*")]
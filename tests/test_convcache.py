@@ -0,0 +1,18 @@
+# convcache.py's file hashes in a process that runs for long.
+
+import convcache
+
+# An edit after a page was recorded makes it stale, in the same process.
+def test_edit_after_record_is_seen(tmp_path):
+    source = tmp_path / "MPI_Send.3in"
+    out = tmp_path / "MPI_Send.3.rst"
+    source.write_text(".TH MPI_Send 3\n")
+    out.write_text("page\n")
+    cache = convcache.ConversionCache(None)
+    cache.record("man2rst", str(source), str(out))
+    assert cache.is_fresh("man2rst", str(source), str(out))
+
+    source.write_text(".TH MPI_Send 3\n.SH NAME\n")
+    assert not cache.is_fresh("man2rst", str(source), str(out))
+    cache.record("man2rst", str(source), str(out))
+    assert cache.is_fresh("man2rst", str(source), str(out))
@@ -0,0 +1,38 @@
+# fingerprint.py on a page converted by man2rst.py and fixup_rst.py.
+
+import fingerprint
+import fixup_rst
+import man2rst
+import xref
+
+# A SEE ALSO section written as an .nf block
+SIMPLE = """.TH MPI_Simple 3
+.SH NAME
+MPI_Simple \\- A simple page.
+.SH SYNTAX
+.nf
+int MPI_Simple(int x);
+.fi
+.SH DESCRIPTION
+Calls MPI_Send.
+.SH SEE ALSO
+.nf
+MPI_Send
+MPI_Recv
+.fi
+"""
+
+def test_nf_block_in_see_also(tmp_path):
+    source = tmp_path / "MPI_Simple.3in"
+    source.write_text(SIMPLE)
+    kind, lines = man2rst.classify(str(source))
+    assert kind == "native"
+    allrefs = xref.LabelIndex(["MPI_Simple", "MPI_Send", "MPI_Recv"])
+    rst = tmp_path / "MPI_Simple.3.rst"
+    rst.write_text("".join(f"{line}\n" for line in
+                           fixup_rst.fixup_lines(iter(f"{line}\n" for line in lines),
+                                                 "MPI_Simple", allrefs)))
+    old = fingerprint.nroff_fingerprint(str(source))
+    assert old["seealso"] == {"mpi_send", "mpi_recv"}
+    assert old["literal"] == ["intMPI_Simple(intx)"]
+    assert fingerprint.compare(str(source), str(rst)) is None
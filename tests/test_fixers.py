@@ -0,0 +1,122 @@
+# The fixers against pages fixed by the fixers as they were before they
+# were rebuilt on rstdoc.py's block model, and the changes that rebuild
+# made on purpose.
+#
+# tests/fixtures/<fixer>/in holds pandoc output (two real pages of each
+# kind, one made by hand to reach every kind of block and a few pages from
+# a generator of well-formed pages); tests/fixtures/<fixer>/expected holds
+# what the earlier fixers made of them, with tests/fixtures/allrefs.txt.
+
+import inspect
+import os
+
+import pytest
+
+import convcache
+import fix_md_rst
+import fixcommon
+import fixup_rst
+import rstdoc
+import xref
+from conftest import FIXTURES
+
+FIXERS = {"fixup_rst": fixup_rst.fixup_lines, "fix_md_rst": fix_md_rst.fixup_lines}
+
+def fixture_pages():
+    return [(fixer, page) for fixer in sorted(FIXERS)
+            for page in sorted(os.listdir(os.path.join(FIXTURES, fixer, "in")))]
+
+@pytest.fixture(scope="module")
+def allrefs():
+    return fixcommon.load_allrefs(os.path.join(FIXTURES, "allrefs.txt"))
+
+@pytest.mark.parametrize("fixer,page", fixture_pages())
+def test_fixture_page(allrefs, tmp_path, fixer, page):
+    out = tmp_path / page
+    fixcommon.fix_page(FIXERS[fixer], os.path.join(FIXTURES, fixer, "in", page),
+                       str(out), allrefs)
+    with open(os.path.join(FIXTURES, fixer, "expected", page)) as fp:
+        assert out.read_text() == fp.read()
+
+def fix(text, fixfunc=fixup_rst.fixup_lines):
+    allrefs = xref.LabelIndex(["MPI_Send", "MPI_Recv"])
+    return list(fixfunc(iter(text.splitlines(True)), "MPI_Send", allrefs))
+
+# The lines after the page's own heading and include_body
+def body(lines):
+    return lines[lines.index("\n.. include_body\n") + 1:]
+
+@pytest.mark.parametrize("fixer", sorted(FIXERS))
+def test_warning_on_stderr(capsys, fixer):
+    allrefs = xref.LabelIndex(["MPI_Send"])
+    list(FIXERS[fixer](iter(["Text.\n"]), "MPI_Unlisted", allrefs))
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert "WARNING: mpi_unlisted not in allrefs_list" in captured.err
+
+# Changed: "name: description" kept only the first line of the description.
+def test_param_with_colon_keeps_its_second_line():
+    lines = fix("INPUT PARAMETERS\n================\n\n"
+                "buf: Initial address\n   of send buffer.\n\n"
+                "count\n   Number of elements.\n")
+    assert body(lines)[1:3] == ["* ``buf``:  Initial address of send buffer.",
+                                "* ``count``: Number of elements."]
+
+# Changed: a description holding a colon raised ValueError.
+def test_param_with_more_than_one_colon():
+    lines = fix("INPUT PARAMETERS\n================\n\n"
+                "comm: communicator: handle\n\nDESCRIPTION\n===========\n\nText.\n")
+    assert body(lines)[1] == "* ``comm``:  communicator: handle"
+
+# Changed: a page ending inside a parameter raised IndexError.
+def test_page_ending_inside_a_parameter():
+    lines = fix("INPUT PARAMETERS\n================\n\nbuf\n   Initial address")
+    assert body(lines)[1:] == ["* ``buf``: Initial address"]
+
+# Changed: a page ending inside a bullet item raised IndexError.
+def test_page_ending_inside_a_bullet():
+    lines = fix("DESCRIPTION\n===========\n\n   - a bullet\n   continued")
+    assert body(lines)[-1] == "   - a bullet    continued"
+
+# Changed: a parameter running into the next heading left a SKIP count
+# that swallowed the heading's first lines of text.
+def test_skip_count_does_not_carry_into_the_next_block():
+    lines = fix("INPUT PARAMETERS\n================\n\nbuf\n   Initial address\n"
+                "DESCRIPTION\n===========\n\n"
+                "First line of MPI_Recv text.\nSecond line.\n")
+    assert body(lines)[1:] == ["* ``buf``: Initial address",
+                               "\nDESCRIPTION\n-----------",
+                               "",
+                               "First line of :ref:`MPI_Recv` text.",
+                               "Second line."]
+
+# The cache's version of a fixer covers every module of its directory it
+# uses, so an edit to the block model makes the pages it fixed stale.
+def test_fixer_version_covers_rstdoc():
+    for fixfunc in FIXERS.values():
+        sources = fixcommon._local_sources(inspect.getmodule(fixfunc))
+        assert os.path.abspath(rstdoc.__file__) in map(os.path.abspath, sources)
+
+def test_block_model_edit_makes_pages_stale(tmp_path, monkeypatch):
+    appdir = tmp_path / "app"
+    appdir.mkdir()
+    (appdir / "testfix_blocks.py").write_text("def parse(lines):\n    return lines\n")
+    (appdir / "testfix_fixer.py").write_text(
+        "import testfix_blocks\n\n"
+        "def fixup_lines(lines, name, allrefs):\n"
+        "    return testfix_blocks.parse(lines)\n")
+    monkeypatch.syspath_prepend(str(appdir))
+    import testfix_fixer
+    source = tmp_path / "MPI_Send.3.rst.in"
+    out = tmp_path / "MPI_Send.3.rst"
+    source.write_text("page\n")
+    out.write_text("page\n")
+    cache = convcache.ConversionCache(None)
+    cache.record("fixup_rst", str(source), str(out),
+                 tool=fixcommon.fixer_version(testfix_fixer.fixup_lines))
+    assert cache.is_fresh("fixup_rst", str(source), str(out),
+                          tool=fixcommon.fixer_version(testfix_fixer.fixup_lines))
+
+    (appdir / "testfix_blocks.py").write_text("def parse(lines):\n    return lines[1:]\n")
+    assert not cache.is_fresh("fixup_rst", str(source), str(out),
+                              tool=fixcommon.fixer_version(testfix_fixer.fixup_lines))
@@ -0,0 +1,122 @@
+# man2rst.py: the pages it converts, the .so stubs it writes, the pages it
+# leaves to pandoc, and the pandoc stage's conversion cache.
+#
+# tests/fixtures/man2rst/in holds nroff pages man2rst converts itself;
+# tests/fixtures/man2rst/expected what it makes of them, checked by hand
+# against the shape of "pandoc -f man -t rst" output.
+
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import convcache
+import man2rst
+from conftest import FIXTURES
+
+# README.sh's conversion of a .so page, as it was before man2rst.py
+README_STUB = r"""
+f=$1
+out=$2
+fname=$( grep -w '^\.so' $f | awk '{printf"%s.rst",$2}' )
+[[ -z "${fname}" ]] && echo "WARNING: ERROR: See $fname"
+pname=$( basename $out | awk -F\. '{print $1}' )
+pnamelower=$( echo $pname | tr 'A-Z' 'a-z')
+delim=$( echo $pname | sed -e "s/[a-z,A-Z,0-9,_,\-]/=/g" )
+echo ".. _${pnamelower}:" > $out
+echo " " >> $out
+echo $pname >> $out
+echo $delim >> $out
+echo "    .. include_body" >> $out
+echo "" >> $out
+echo ".. include:: ../${fname}" >> $out
+echo "    :start-after: .. include_body" >> $out
+echo "" >> $out
+"""
+
+def native_pages():
+    return sorted(os.listdir(os.path.join(FIXTURES, "man2rst", "in")))
+
+# (sources relative to the top of the tree, as README.sh runs it)
+@pytest.mark.parametrize("page", native_pages())
+def test_native_page(tmp_path, monkeypatch, page):
+    monkeypatch.chdir(os.path.join(FIXTURES, "man2rst", "in"))
+    kind, out, reason, changed = man2rst.convert_source(
+        page, str(tmp_path / "rst"), str(tmp_path / "tmprst"))
+    assert (kind, reason, changed) == ("native", "", True)
+    with open(out) as fp:
+        got = fp.read()
+    with open(os.path.join(FIXTURES, "man2rst", "expected", man2rst.rst_name(page))) as fp:
+        assert got == fp.read()
+
+@pytest.mark.skipif(shutil.which("bash") is None, reason="needs bash")
+@pytest.mark.parametrize("name,so_line", [
+    ("MPI_Comm_rank_f08.3in", ".so man3/MPI_Comm_rank.3\n"),
+    ("MPI-Type_c.3in", ".so man3/MPI_Type.3 extra\n"),
+    ("shmem_int_put.3in", ".so man3/shmem_put.3\n"),
+])
+def test_stub_as_readme_wrote_it(tmp_path, monkeypatch, name, so_line):
+    monkeypatch.chdir(tmp_path)
+    source = tmp_path / name
+    source.write_text(f".\\\" a comment\n{so_line}")
+    kind, out, reason, changed = man2rst.convert_source(name, "rst", "tmprst")
+    assert kind == "stub"
+    # README.sh took the page name from the output file's
+    expected = tmp_path / "readme" / os.path.basename(out)
+    expected.parent.mkdir()
+    subprocess.run(["bash", "-c", README_STUB, "stub", str(source), str(expected)],
+                   check=True)
+    with open(out, 'rb') as fp:
+        assert fp.read() == expected.read_bytes()
+
+# Pages man2rst.py does not convert go to pandoc
+@pytest.mark.parametrize("lines,reason", [
+    ([".TH MPI_X 3\n", ".SH NAME\n", ".RS\n", "text\n", ".RE\n"], ".RS"),
+    ([".TH MPI_X 3\n", ".IP \\(bu\n", "item\n"], ".IP"),
+    ([".TH MPI_X 3\n", ".nf\n", "\tint x;\n", ".fi\n"], "tab in literal block"),
+    ([".TH MPI_X 3\n", ".nf\n", "int x;\n"], ".nf without .fi"),
+    ([".TH MPI_X 3\n", "see \\(em this\n"], "escape in"),
+    ([".TH MPI_X 3\n", "a *b* c\n"], "rst markup in"),
+    ([".TH MPI_X 3\n", "- a list item\n"], "list-like text"),
+    ([".so man3/a.3\n", ".so man3/b.3\n"], "more than one .so"),
+])
+def test_unsupported_goes_to_pandoc(lines, reason):
+    kind, result = man2rst.classify_lines(lines)
+    assert kind == "pandoc"
+    assert result.startswith(reason)
+
+def test_no_native_goes_to_pandoc(tmp_path, monkeypatch):
+    monkeypatch.chdir(os.path.join(FIXTURES, "man2rst", "in"))
+    kind, out, reason, changed = man2rst.convert_source(
+        native_pages()[0], str(tmp_path / "rst"), str(tmp_path / "tmprst"),
+        native=False)
+    assert (kind, reason, changed) == ("pandoc", "native conversion disabled", False)
+    assert not os.path.exists(out)
+
+NATIVE = ".TH MPI_Native 3\n.SH NAME\nMPI_Native \\- A page man2rst converts.\n"
+
+# A page pandoc converted, then man2rst: pandoc's cache entry must go, or
+# pandoc takes man2rst's page for its own once the page is pandoc's again.
+# (run from the top of the tree, as README.sh runs it)
+def test_native_page_leaves_the_pandoc_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("man/man3")
+    source = "man/man3/MPI_Native.3in"
+    with open(source, 'w') as fp:
+        fp.write(NATIVE)
+    out = os.path.join("tmprst", man2rst.rst_name(source))
+    os.makedirs(os.path.dirname(out))
+    with open(out, 'w') as fp:
+        fp.write("pandoc's page\n")
+    cache = convcache.ConversionCache("convcache.json")
+    cache.record("man2rst", source, out, tool="pandoc 1")
+    cache.save()
+
+    assert man2rst.main([man2rst.APPNAME, "--rst", "rst", "--tmprst", "tmprst",
+                         "--pairs", "pairs", "--cache", "convcache.json", "man"]) == 0
+    with open(out) as fp:
+        assert "MPI_Native" in fp.read()
+    cache = convcache.ConversionCache("convcache.json")
+    assert not cache.is_fresh("man2rst", source, out, tool="pandoc 1")
+    assert os.path.normpath(out) not in cache.entries
@@ -0,0 +1,148 @@
+# manpackage.py: aliases from the rst stubs, gzip, cleanup and the
+# manifest, on a small build tree.
+
+import gzip
+import json
+import os
+
+import pytest
+
+import man2rst
+import manpackage
+
+PAGES = {"MPI_Send.3": ".TH MPI_Send 3\nThe send page.\n",
+         "MPI_Recv.3": ".TH MPI_Recv 3\nThe receive page, a little longer.\n",
+         "PMPI_Send.3": ".TH PMPI_Send 3\nThe send page.\n",
+         "MPI_Send_c.3": ".TH MPI_Send_c 3\nThe send page.\n",
+         "MPI_Gone_c.3": ".TH MPI_Gone_c 3\nA page of its own.\n",
+         "mpirun.1": ".TH mpirun 1\nRun.\n"}
+
+def write(fname, text):
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    with open(fname, 'w') as fp:
+        fp.write(text)
+
+def stub(rst, name, target):
+    out = os.path.join(rst, "man3", f"{name}.rst")
+    write(out, "\n".join(man2rst.stub_lines(out, f".so man3/{target}\n")) + "\n")
+
+# What sphinx and README.sh leave: the pages in _build/man, the rst tree
+# with a stub for each alias
+@pytest.fixture
+def tree(tmp_path):
+    buildman = str(tmp_path / "man")
+    rst = str(tmp_path / "rst")
+    for name, text in PAGES.items():
+        write(os.path.join(buildman, name), text)
+    write(os.path.join(rst, "man3", "MPI_Send.3.rst"), ".. _mpi_send:\n\nMPI_Send\n")
+    write(os.path.join(rst, "man3", "MPI_Recv.3.rst"), ".. _mpi_recv:\n\nMPI_Recv\n")
+    stub(rst, "PMPI_Send.3", "MPI_Send.3")
+    # a stub of a stub
+    stub(rst, "MPI_Send_c.3", "PMPI_Send.3")
+    # sphinx did not write MPI_Gone.3
+    stub(rst, "MPI_Gone_c.3", "MPI_Gone.3")
+    return buildman, rst, str(tmp_path / "out")
+
+def read_gz(fname):
+    with gzip.open(fname, 'rt') as fp:
+        return fp.read()
+
+def manifest(out):
+    with open(os.path.join(out, "manifest.json")) as fp:
+        return json.load(fp)
+
+def test_find_aliases(tree):
+    buildman, rst, out = tree
+    assert manpackage.find_aliases(rst, 1) == {"PMPI_Send.3": "MPI_Send.3",
+                                               "MPI_Send_c.3": "MPI_Send.3",
+                                               "MPI_Gone_c.3": "MPI_Gone.3"}
+
+def test_alias_chain_stops_at_maxaliases(tmp_path):
+    rst = str(tmp_path / "rst")
+    names = [f"MPI_A{i}.3" for i in range(manpackage.MAXALIASES + 3)]
+    for name, target in zip(names, names[1:]):
+        stub(rst, name, target)
+    aliases = manpackage.find_aliases(rst, 1)
+    assert aliases[names[0]] == names[manpackage.MAXALIASES + 1]
+    assert aliases[names[-3]] == names[-1]
+
+def test_alias_loop(tmp_path):
+    rst = str(tmp_path / "rst")
+    stub(rst, "MPI_A.3", "MPI_B.3")
+    stub(rst, "MPI_B.3", "MPI_A.3")
+    assert manpackage.find_aliases(rst, 1) == {}
+
+def test_so_aliases(tree):
+    buildman, rst, out = tree
+    totals = manpackage.package(buildman, rst, out, jobs=2)
+    assert read_gz(os.path.join(out, "man3", "PMPI_Send.3.gz")) == ".so man3/MPI_Send.3\n"
+    assert read_gz(os.path.join(out, "man3", "MPI_Send_c.3.gz")) == ".so man3/MPI_Send.3\n"
+    assert read_gz(os.path.join(out, "man3", "MPI_Gone_c.3.gz")) == PAGES["MPI_Gone_c.3"]
+    assert read_gz(os.path.join(out, "man3", "MPI_Send.3.gz")) == PAGES["MPI_Send.3"]
+    assert read_gz(os.path.join(out, "man1", "mpirun.1.gz")) == PAGES["mpirun.1"]
+
+    files = {entry["page"]: entry for entry in manifest(out)["files"]}
+    assert {name: (entry["kind"], entry["alias_of"]) for name, entry in files.items()} == {
+        "MPI_Gone_c.3": ("page", None), "MPI_Recv.3": ("page", None),
+        "MPI_Send.3": ("page", None), "MPI_Send_c.3": ("so", "MPI_Send.3"),
+        "PMPI_Send.3": ("so", "MPI_Send.3"), "mpirun.1": ("page", None)}
+    for entry in files.values():
+        assert entry["size_before"] == len(PAGES[entry["page"]])
+        assert entry["size_after"] == os.path.getsize(os.path.join(out, entry["file"]))
+    assert totals == manifest(out)["totals"]
+    assert totals == {"pages": 4, "aliases": 2,
+                      "size_before": sum(map(len, PAGES.values())),
+                      "size_after": sum(entry["size_after"] for entry in files.values()),
+                      "changed": 6, "removed": 0}
+
+    # the same again changes nothing
+    assert manpackage.package(buildman, rst, out, jobs=2)["changed"] == 0
+
+def test_symlink_aliases(tree):
+    buildman, rst, out = tree
+    totals = manpackage.package(buildman, rst, out, aliases="symlink", jobs=2)
+    link = os.path.join(out, "man3", "MPI_Send_c.3.gz")
+    assert os.readlink(link) == "MPI_Send.3.gz"
+    assert read_gz(link) == PAGES["MPI_Send.3"]
+    assert not os.path.islink(os.path.join(out, "man3", "MPI_Gone_c.3.gz"))
+    assert totals["aliases"] == 2
+    assert totals["size_after"] == sum(
+        os.path.getsize(os.path.join(out, "man3", name + ".gz"))
+        for name in ("MPI_Send.3", "MPI_Recv.3", "MPI_Gone_c.3")) + os.path.getsize(
+        os.path.join(out, "man1", "mpirun.1.gz"))
+
+    # back to .so pages: the links are replaced
+    manpackage.package(buildman, rst, out, aliases="so", jobs=2)
+    assert not os.path.islink(link)
+    assert read_gz(link) == ".so man3/MPI_Send.3\n"
+
+def test_files_of_earlier_runs_are_removed(tree):
+    buildman, rst, out = tree
+    manpackage.package(buildman, rst, out, jobs=2)
+    write(os.path.join(out, "man7", "Old.7.gz"), "old")
+    os.remove(os.path.join(buildman, "MPI_Recv.3"))
+    totals = manpackage.package(buildman, rst, out, jobs=2)
+    assert totals["removed"] == 2
+    assert totals["changed"] == 0
+    assert not os.path.exists(os.path.join(out, "man7", "Old.7.gz"))
+    assert not os.path.exists(os.path.join(out, "man3", "MPI_Recv.3.gz"))
+    assert os.path.exists(os.path.join(out, "manifest.json"))
+
+def test_no_gzip(tree):
+    buildman, rst, out = tree
+    manpackage.package(buildman, rst, out, jobs=2)
+    assert manpackage.main([manpackage.APPNAME, "--buildman", buildman, "--rst", rst,
+                            "--out", out, "--no-gzip", "--jobs", "2"]) == 0
+    with open(os.path.join(out, "man3", "MPI_Send.3")) as fp:
+        assert fp.read() == PAGES["MPI_Send.3"]
+    with open(os.path.join(out, "man3", "PMPI_Send.3")) as fp:
+        assert fp.read() == ".so man3/MPI_Send.3\n"
+    # the gzipped files of the first run are gone
+    assert sorted(os.listdir(os.path.join(out, "man3"))) == [
+        "MPI_Gone_c.3", "MPI_Recv.3", "MPI_Send.3", "MPI_Send_c.3", "PMPI_Send.3"]
+    data = manifest(out)
+    assert data["compress"] is False
+    assert data["totals"]["size_after"] == data["totals"]["size_before"] - (
+        len(PAGES["PMPI_Send.3"]) + len(PAGES["MPI_Send_c.3"])
+        - 2 * len(".so man3/MPI_Send.3\n"))
+    assert data["totals"]["removed"] == 6
@@ -0,0 +1,74 @@
+# manpages.py's manifest of the man_pages list.
+
+import os
+import re
+from pathlib import Path
+
+import fixcommon
+import manpages
+
+def make_tree(root):
+    os.makedirs(os.path.join(root, "ompi/mpi/man/man3"))
+    for name in ("MPI_Send", "MPI_Recv"):
+        with open(os.path.join(root, f"ompi/mpi/man/man3/{name}.3.rst"), 'w') as fp:
+            fp.write(f"{name}\n")
+
+def no_scan(root):
+    raise AssertionError("the tree was scanned again")
+
+# A page rewritten in place (through a temporary file, as the fixers do)
+# changes its directory's time, but not the list.
+def test_rewritten_page_keeps_the_manifest(tmp_path, monkeypatch):
+    root = str(tmp_path / "rst")
+    make_tree(root)
+    manifest = manpages.manifest_path(root, str(tmp_path))
+    pages = manpages.man_pages(root, manifest=manifest)
+    assert [page[1] for page in pages] == ["MPI_Recv", "MPI_Send"]
+
+    mandir = os.path.join(root, "ompi/mpi/man/man3")
+    fixcommon.write_lines(os.path.join(mandir, "MPI_Send.3.rst"), ["changed"])
+    os.utime(mandir, ns=(1, 1))
+    monkeypatch.setattr(manpages, "scan", no_scan)
+    assert manpages.man_pages(root, manifest=manifest) == pages
+    # the new time was saved: the next load does not list the directory
+    monkeypatch.setattr(manpages, "_dir_names", no_scan)
+    assert manpages.man_pages(root, manifest=manifest) == pages
+
+def test_added_page_rebuilds_the_list(tmp_path):
+    root = str(tmp_path / "rst")
+    make_tree(root)
+    manifest = manpages.manifest_path(root, str(tmp_path))
+    manpages.man_pages(root, manifest=manifest)
+    with open(os.path.join(root, "ompi/mpi/man/man3/MPI_Abort.3.rst"), 'w') as fp:
+        fp.write("MPI_Abort\n")
+    pages = manpages.man_pages(root, manifest=manifest)
+    assert [page[1] for page in pages] == ["MPI_Abort", "MPI_Recv", "MPI_Send"]
+
+def test_one_manifest_per_tree(tmp_path):
+    assert (manpages.manifest_path(str(tmp_path / "rst"), "_build")
+            != manpages.manifest_path(str(tmp_path / "mansrc"), "_build"))
+
+# conf.py's loop over the tree, as it was before manpages.py
+def old_conf_pages(root):
+    pages = list()
+    for path in Path(root).rglob('*.rst'):
+        vsname = re.sub(r'\.[0-9]*\.rst', '', path.name)
+        snum = os.path.basename(os.path.dirname(path)).replace('man', '')
+        if snum.isdigit():
+            lname = os.path.relpath(str(path.parent), root) + '/' + path.name.replace('.rst', '')
+            pages.append((lname, vsname, "", "", int(snum)))
+    return sorted(pages)
+
+# Every rst file in a manN directory is a page, named as conf.py named it
+def test_same_pages_as_the_old_conf_loop(tmp_path):
+    root = str(tmp_path / "rst")
+    make_tree(root)
+    os.makedirs(os.path.join(root, "ompi/mpi/man/man5"))
+    os.makedirs(os.path.join(root, "docs"))
+    for name in ("ompi/mpi/man/man3/notes.rst", "ompi/mpi/man/man5/Open-MPI.5.rst",
+                 "ompi/mpi/man/man5/a.b.rst", "docs/index.rst"):
+        with open(os.path.join(root, name), 'w') as fp:
+            fp.write("page\n")
+    pages = manpages.man_pages(root)
+    assert sorted(pages) == old_conf_pages(root)
+    assert ("ompi/mpi/man/man3/notes", "notes.rst", "", "", 3) in pages
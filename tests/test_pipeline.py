@@ -0,0 +1,14 @@
+# Stages of pipeline.py, outside of a run.
+
+import pipeline
+
+def test_copy_stage_counts_changed_copies(tmp_path):
+    src = tmp_path / "Open-MPI.5.rst"
+    src.write_text("page\n")
+    item = (str(src), str(tmp_path / "rst" / "man5" / "Open-MPI.5.rst"))
+    stage = pipeline.CopyStage("copy", [], item)
+    for expected in (True, False):
+        result = pipeline._copy_work(item)
+        assert result is expected
+        assert stage.route(None, item, result) == []
+    assert stage.metrics.changed == 1
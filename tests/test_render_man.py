@@ -0,0 +1,43 @@
+# render_man.py's render cache and ".so" pages.
+
+import os
+
+import convcache
+import render_man
+
+STUB = ".so man3/MPI_Target.3\n"
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as fp:
+        fp.write(text)
+
+# man itself is not run: a page "renders" to its own text.
+def fake_render(source, out, root):
+    with open(source) as src, open(out, 'w') as fp:
+        fp.write(src.read())
+    return 0
+
+def test_so_deps_follow_stubs(tmp_path):
+    root = str(tmp_path)
+    write(f"{root}/man/man3/MPI_Target.3in", ".TH MPI_Target 3\n")
+    write(f"{root}/man/man3/PMPI_Target.3in", STUB)
+    write(f"{root}/man/man3/PMPI_Alias.3in", ".so man3/PMPI_Target.3\n")
+    assert render_man.so_deps(f"{root}/man/man3/MPI_Target.3in", root) == []
+    assert render_man.so_deps(f"{root}/man/man3/PMPI_Alias.3in", root) == [
+        f"{root}/man/man3/PMPI_Target.3in", f"{root}/man/man3/MPI_Target.3in"]
+
+def test_stub_rendered_again_when_its_page_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(render_man, "render", fake_render)
+    monkeypatch.setattr(render_man, "man_version", lambda: "man 1")
+    root = str(tmp_path / "src")
+    target = f"{root}/man/man3/MPI_Target.3in"
+    write(target, ".TH MPI_Target 3\n")
+    write(f"{root}/man/man3/PMPI_Target.3in", STUB)
+    pages = render_man.orig_pages(root, ["man"], str(tmp_path / "out"))
+    cache = convcache.ConversionCache(str(tmp_path / "rendercache.json"))
+
+    assert render_man.render_all(pages, 1, cache) == (2, 0, [])
+    assert render_man.render_all(pages, 1, cache) == (0, 2, [])
+    write(target, ".TH MPI_Target 3\n.SH NAME\n")
+    assert render_man.render_all(pages, 1, cache) == (2, 0, [])
@@ -0,0 +1,56 @@
+# tokenindex.py: which pages a change of the label list can change.
+
+import json
+
+import tokenindex
+
+def recorded_index(tmp_path):
+    fname = str(tmp_path / "convcache.fixup_rst.tokens.json")
+    index = tokenindex.TokenIndex(fname, ["mpi_send", "mpi_recv", "mpi_abort"])
+    index.record("rst/MPI_Send.3.rst", {"mpi_send", "mpi_recv", "mpi_wait"})
+    index.record("rst/MPI_Recv.3.rst", {"mpi_recv", "mpi_status"})
+    index.record("rst/MPI_Abort.3.rst", {"mpi_abort"})
+    index.record("rst/MPI_Init.3.rst", {"mpi_init", "mpi_finalize"})
+    index.save()
+    return fname
+
+def test_labels_added_and_removed(tmp_path):
+    fname = recorded_index(tmp_path)
+    # mpi_wait and mpi_status added, mpi_abort removed
+    index = tokenindex.TokenIndex(
+        fname, ["mpi_send", "mpi_recv", "mpi_wait", "mpi_status"])
+    assert index.affected == {"rst/MPI_Send.3.rst", "rst/MPI_Recv.3.rst",
+                              "rst/MPI_Abort.3.rst"}
+    assert index.is_current("rst/MPI_Init.3.rst")
+    assert not index.is_current("rst/MPI_Abort.3.rst")
+
+def test_same_labels_affect_nothing(tmp_path):
+    fname = recorded_index(tmp_path)
+    index = tokenindex.TokenIndex(fname, ["mpi_abort", "mpi_recv", "mpi_send"])
+    assert index.affected == set()
+
+# An index in another format is ignored: no page is current, so every
+# page is fixed again.
+def test_other_format_is_ignored(tmp_path):
+    fname = recorded_index(tmp_path)
+    with open(fname) as fp:
+        data = json.load(fp)
+    data["format"] = tokenindex.FORMAT + 1
+    with open(fname, 'w') as fp:
+        json.dump(data, fp)
+    index = tokenindex.TokenIndex(fname, ["mpi_send"])
+    assert index.pages == dict()
+    assert index.affected == set()
+    assert not index.is_current("rst/MPI_Init.3.rst")
+
+# Pages affected but not fixed again are dropped when saved, so the next
+# run still fixes them.
+def test_affected_pages_not_fixed_are_dropped(tmp_path):
+    fname = recorded_index(tmp_path)
+    index = tokenindex.TokenIndex(fname, ["mpi_send", "mpi_recv"])
+    assert index.affected == {"rst/MPI_Abort.3.rst"}
+    index.save()
+    index = tokenindex.TokenIndex(fname, ["mpi_send", "mpi_recv"])
+    assert index.affected == set()
+    assert not index.is_current("rst/MPI_Abort.3.rst")
+    assert index.is_current("rst/MPI_Send.3.rst")
@@ -0,0 +1,117 @@
+# watch_man.py: what one batch of changed sources does to the rst tree and
+# the label list.  Only pages man2rst.py converts itself, so no pandoc.
+
+import argparse
+import os
+
+import pytest
+
+import watch_man
+
+FOO = ".TH MPI_Foo 3\n.SH NAME\nMPI_Foo \\- The page from nroff.\n"
+BAR = (".TH MPI_Bar 3\n.SH NAME\nMPI_Bar \\- Uses another page.\n"
+       ".SH DESCRIPTION\nSee MPI_Foo for more.\n")
+FOO_MD_RST = ".. _mpi_foo:\n\nMPI_Foo\n=======\n\nThe page from md.\n"
+
+# A tree as README.sh leaves it; run from its top, as watch_man.py runs
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("man/man3")
+    return tmp_path
+
+def write(fname, text):
+    os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
+    with open(fname, 'w') as fp:
+        fp.write(text)
+
+def read(fname):
+    with open(fname) as fp:
+        return fp.read()
+
+def watch(labels):
+    write("allrefs.txt", "".join(f"{label}\n" for label in labels))
+    args = argparse.Namespace(man_dirs=["man"], rst="rst", tmpdir="tmp",
+                              allrefs="allrefs.txt", cache="tmp/convcache.json",
+                              no_native=False, timeout=10, retries=0)
+    return watch_man.Watch(args)
+
+# An md page that was converted in place of its nroff page, as README.sh
+# leaves it
+def md_page_converted():
+    write("man/man3/MPI_Foo.3in", FOO)
+    write("man/man3/MPI_Foo.3.md", "# NAME\n\nMPI_Foo - The page from md.\n")
+    write("tmp/tmpmdrst/man/man3/MPI_Foo.3.rst", FOO_MD_RST)
+    write("rst/man/man3/MPI_Foo.3.rst", FOO_MD_RST)
+
+def test_sibling():
+    assert watch_man.sibling("man/man3/MPI_Foo.3.md") == "man/man3/MPI_Foo.3in"
+    assert watch_man.sibling("man/man3/MPI_Foo.3in") == "man/man3/MPI_Foo.3.md"
+
+def test_new_page_is_converted_and_labelled(tree):
+    write("man/man3/MPI_Bar.3in", BAR)
+    w = watch(["mpi_foo"])
+    w.handle({"man/man3/MPI_Bar.3in"})
+    assert ".. _mpi_bar:" in read("rst/man/man3/MPI_Bar.3.rst")
+    assert read("allrefs.txt") == "mpi_bar\nmpi_foo\n"
+
+# A new page links the pages that name it, a removed page unlinks them
+def test_label_added_and_removed_refixes_pages(tree):
+    write("man/man3/MPI_Bar.3in", BAR)
+    w = watch([])
+    w.handle({"man/man3/MPI_Bar.3in"})
+    assert "See MPI_Foo for more." in read("rst/man/man3/MPI_Bar.3.rst")
+
+    write("man/man3/MPI_Foo.3in", FOO)
+    w.handle({"man/man3/MPI_Foo.3in"})
+    assert read("allrefs.txt") == "mpi_bar\nmpi_foo\n"
+    assert "See :ref:`MPI_Foo` for more." in read("rst/man/man3/MPI_Bar.3.rst")
+
+    os.remove("man/man3/MPI_Foo.3in")
+    w.handle({"man/man3/MPI_Foo.3in"})
+    assert not os.path.exists("rst/man/man3/MPI_Foo.3.rst")
+    assert not os.path.exists("tmp/tmprst/man/man3/MPI_Foo.3.rst")
+    assert read("allrefs.txt") == "mpi_bar\n"
+    assert "See MPI_Foo for more." in read("rst/man/man3/MPI_Bar.3.rst")
+
+def test_relabel_refixes_only_pages_that_looked_up_the_labels(tree):
+    write("man/man3/MPI_Bar.3in", BAR)
+    write("man/man3/MPI_Foo.3in", FOO)
+    w = watch([])
+    w.handle({"man/man3/MPI_Bar.3in", "man/man3/MPI_Foo.3in"})
+    # only MPI_Bar's page (its own name) looks up mpi_bar
+    assert w.relabel(set(), {"mpi_bar"}) == ["rst/man/man3/MPI_Bar.3.rst"]
+    assert read("allrefs.txt") == "mpi_foo\n"
+    assert w.relabel({"mpi_bar"}, set()) == ["rst/man/man3/MPI_Bar.3.rst"]
+    assert read("allrefs.txt") == "mpi_bar\nmpi_foo\n"
+    assert w.relabel({"mpi_other"}, set()) == []
+
+# The md page's rst replaced the nroff page's: without the md page, the
+# nroff page is the page again
+def test_md_page_removed_converts_nroff_page(tree):
+    md_page_converted()
+    w = watch(["mpi_foo"])
+    os.remove("man/man3/MPI_Foo.3.md")
+    w.handle({"man/man3/MPI_Foo.3.md"})
+    assert "The page from nroff." in read("rst/man/man3/MPI_Foo.3.rst")
+    assert not os.path.exists("tmp/tmpmdrst/man/man3/MPI_Foo.3.rst")
+    assert read("allrefs.txt") == "mpi_foo\n"
+
+def test_nroff_page_removed_keeps_md_page(tree):
+    md_page_converted()
+    w = watch(["mpi_foo"])
+    os.remove("man/man3/MPI_Foo.3in")
+    assert w.remove("man/man3/MPI_Foo.3in") is None
+    assert read("rst/man/man3/MPI_Foo.3.rst") == FOO_MD_RST
+    w.handle({"man/man3/MPI_Foo.3in"})
+    assert read("rst/man/man3/MPI_Foo.3.rst") == FOO_MD_RST
+    assert read("allrefs.txt") == "mpi_foo\n"
+
+# A .so page is written again with the page it includes
+def test_stub_follows_the_page_it_includes(tree):
+    write("man/man3/MPI_Foo.3in", FOO)
+    write("man/man3/MPI_Foo_c.3in", ".so man3/MPI_Foo.3\n")
+    w = watch(["mpi_foo", "mpi_foo_c"])
+    os.makedirs("rst/man/man3")
+    w.handle({"man/man3/MPI_Foo.3in"})
+    assert os.path.exists("rst/man/man3/MPI_Foo_c.3.rst")
@@ -0,0 +1,77 @@
+# The single-pass Scanner against the two substitutions the fixers made
+# before it, one per token family.
+
+import os
+import random
+
+import pytest
+
+import fix_md_rst
+import fixup_rst
+import xref
+from conftest import REPODIR
+
+PATTERNS = {
+    "fixup_rst": (fixup_rst.mpiref_pat, fixup_rst.shmemref_pat),
+    "fixup_rst last": (fixup_rst.mpiref_last_pat, fixup_rst.shmemref_last_pat),
+    "fix_md_rst": (fix_md_rst.mpiref_pat, fix_md_rst.shmemref_pat),
+}
+
+# Lines the joined pattern alone gets wrong: stripping the markup of the
+# MPI_ token merges it with the shmem_ token next to it, or a shmem_ match
+# swallows the start of an MPI_ token.
+TWOPASS_LINES = {
+    "fixup_rst": " shmem_long_putshmem_put]MPI_Send xa",
+    "fixup_rst last": "MPI_Send``shmem_Foo shmem_long_put",
+    "fix_md_rst": "ashmem_put0]_]]MPI_Abort",
+}
+
+PIECES = ["MPI_Send", "MPI_Abort", "MPI_Foo", "shmem_put", "shmem_Foo", "SHMEM_GET",
+          "shmem_long_put", "*", "`", "(3)", ",", "_", " ", "x", "[", "]", "(", ")",
+          "0", "a"]
+
+@pytest.fixture(scope="module")
+def allrefs():
+    with open(os.path.join(REPODIR, "allrefs.txt")) as fp:
+        return [line.rstrip('\n') for line in fp]
+
+# What the fixers did before Scanner: the MPI_ pattern over the line, then
+# the shmem_ pattern over the result.
+def old_sub(line, mpi_pat, shmem_pat, labels):
+    def cmdrepl(match):
+        token = xref.strip_markup(match.group())
+        if token.lower() in labels:
+            return ':ref:`' + token + '`'
+        return token
+    return shmem_pat.sub(cmdrepl, mpi_pat.sub(cmdrepl, line))
+
+@pytest.mark.parametrize("name", sorted(PATTERNS))
+def test_twopass_lines(allrefs, name):
+    mpi_pat, shmem_pat = PATTERNS[name]
+    scanner = xref.LabelIndex(allrefs).scanner(mpi_pat, shmem_pat)
+    line = TWOPASS_LINES[name]
+    single = scanner.pattern.sub(lambda match: scanner.resolve(match.group()), line)
+    expected = old_sub(line, mpi_pat, shmem_pat, {label.lower() for label in allrefs})
+    assert single != expected
+    assert scanner.sub(line) == expected
+
+@pytest.mark.parametrize("name", sorted(PATTERNS))
+def test_mixed_lines(allrefs, name):
+    mpi_pat, shmem_pat = PATTERNS[name]
+    scanner = xref.LabelIndex(allrefs).scanner(mpi_pat, shmem_pat)
+    labels = {label.lower() for label in allrefs}
+    rand = random.Random(name)
+    for _ in range(20000):
+        line = "".join(rand.choice(PIECES) for _ in range(rand.randint(1, 8)))
+        assert scanner.sub(line) == old_sub(line, mpi_pat, shmem_pat, labels), line
+
+def test_counts_and_seen():
+    index = xref.LabelIndex(["MPI_Send", "shmem_put"])
+    scanner = index.scanner(*PATTERNS["fixup_rst"])
+    assert scanner.sub("no tokens here\n") == "no tokens here\n"
+    assert index.take_counts()["xref_lines"] == 0
+    assert scanner.sub("See MPI_Send, shmem_put and MPI_Recv.") == \
+        "See :ref:`MPI_Send`, :ref:`shmem_put` and MPI_Recv."
+    counts = index.take_counts()
+    assert (counts["xref_lines"], counts["resolved"], counts["unresolved"]) == (1, 2, 1)
+    assert index.take_seen() == {"mpi_send", "shmem_put", "mpi_recv"}
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# Inverted index from cross-reference tokens to the pages that contain
+# them, so that a change to allrefs.txt only sends the pages it can change
+# back through a fixer.
+#
+# The fixers' output depends on the label list only through the names
+# they look up in it: the MPI_* and shmem_* tokens that may become :ref:
+# links, and the page's own name.  While fixing a page, the names looked
+# up are collected (see xref.LabelIndex.take_seen) and recorded here,
+# case-folded, as token -> pages.  The label list the pages were fixed
+# with is kept as well.  When the list changes, the pages to fix again are
+# those holding a token that was added to or removed from it; every other
+# page would come out the same.
+#
+# One index per fixer stage, next to the conversion cache (see
+# convcache.py), which then leaves allrefs.txt out of the fixers' keys.
+#
+# Usage
+#  tokenindex.py <index_file> [<allrefs_file>]
+#      Print the size of the index and, given a label list, the pages that
+#      list would send back through the fixer.
+
+import json
+import os
+import sys
+
+import xref
+
+APPNAME=os.path.basename(__file__)
+
+FORMAT=1
+
+# Index file for one stage of a conversion cache:
+# /tmp/ompiman/convcache.json -> /tmp/ompiman/convcache.fixup_rst.tokens.json
+def index_file(cache_file, stage):
+    return f"{os.path.splitext(cache_file)[0]}.{stage}.tokens.json"
+
+# The index of one stage, for a run with the given label list (by default,
+# the one recorded).
+class TokenIndex:
+    def __init__(self, fname, labels=None):
+        self.fname = fname
+        self.tokens = dict()
+        self.pages = dict()
+        # labels the recorded pages were fixed with, None if not known
+        old_labels = None
+        if fname and os.path.exists(fname):
+            with open(fname) as fp:
+                data = json.load(fp)
+            if data.get("format") == FORMAT:
+                old_labels = frozenset(data["labels"])
+                for token, pages in data["tokens"].items():
+                    self.tokens[token] = set(pages)
+                    for page in pages:
+                        self.pages.setdefault(page, set()).add(token)
+        self.labels = frozenset(labels) if labels is not None else old_labels or frozenset()
+        # pages the change from the recorded labels can change
+        if old_labels is None:
+            self.affected = set(self.pages)
+        else:
+            self.affected = set()
+            for token in old_labels.symmetric_difference(self.labels):
+                self.affected |= self.tokens.get(token, set())
+        self.recorded = set()
+
+    # True if the page was fixed, and the label changes can't change it.
+    def is_current(self, page):
+        page = os.path.normpath(page)
+        return page in self.pages and page not in self.affected
+
+    def record(self, page, tokens):
+        page = os.path.normpath(page)
+        self.forget(page)
+        self.pages[page] = set(tokens)
+        for token in self.pages[page]:
+            self.tokens.setdefault(token, set()).add(page)
+        self.recorded.add(page)
+
+    def forget(self, page):
+        page = os.path.normpath(page)
+        for token in self.pages.pop(page, ()):
+            pages = self.tokens[token]
+            pages.discard(page)
+            if not pages:
+                del self.tokens[token]
+
+    # Save, with the labels of this run.  Pages the label changes affect
+    # but that were not fixed again in this run are dropped, so a later run
+    # still fixes them.
+    def save(self):
+        for page in self.affected - self.recorded:
+            self.forget(page)
+        if not self.fname:
+            return
+        os.makedirs(os.path.dirname(self.fname) or '.', exist_ok=True)
+        tmp = f"{self.fname}.tmp{os.getpid()}"
+        with open(tmp, 'w') as fp:
+            json.dump({"format": FORMAT, "labels": sorted(self.labels),
+                       "tokens": {token: sorted(pages)
+                                  for token, pages in sorted(self.tokens.items())}},
+                      fp, indent=1)
+        os.replace(tmp, self.fname)
+
+def main(argv):
+    if len(argv) < 2 or argv[1].startswith('-'):
+        print(f"{APPNAME} <index_file> [<allrefs_file>]")
+        return 1
+    labels = xref.LabelIndex.from_file(argv[2]).labels if len(argv) > 2 else None
+    index = TokenIndex(argv[1], labels)
+    print(f"{APPNAME}: {len(index.pages)} pages, {len(index.tokens)} tokens, "
+          f"{len(index.affected)} affected")
+    for page in sorted(index.affected):
+        print(page)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
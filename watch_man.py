@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+
+# This script watches the man page sources and converts a page again as
+# soon as it is saved, so a page being written can be looked at in the
+# rst tree without running README.sh again.
+#
+# What is kept in memory
+#  - The label list (allrefs.txt) and the fixers' cross-reference scanners
+#    and patterns, the conversion cache and the fixers' token indexes
+#    (see convcache.py and tokenindex.py), and for every ".so" page the
+#    page it includes.
+#
+# When a *.Nin or *.N.md source changes
+#  - It goes through the same steps as in README.sh, for that page only:
+#    man2rst.py (a .so stub, or the simple pages) or pandoc, then
+#    fixup_rst.py or fix_md_rst.py, into the rst tree.  A nroff page that
+#    also has an md page is left alone, as the md page's rst replaces it;
+#    when the md page goes away, the nroff page is converted again, and
+#    when the nroff page goes away, the md page's rst stays.
+#  - The .so pages that include it, and those including them, are
+#    converted again too.
+#  - A new page adds its label to allrefs.txt and a removed page takes its
+#    label out (and its rst page; a getcrossrefs.py --json index is only
+#    changed in memory); then the pages that looked up those
+#    labels are fixed again, as the fixers' --cache does.
+#  - The conversion cache and token indexes are updated, so the next
+#    README.sh run does not convert these pages again.
+#
+# Watching
+#  - Through inotify (libc's, with ctypes; no other module needed) on
+#    Linux.  Changes that arrive within DEBOUNCE seconds of each other are
+#    handled together, as editors save a page in several steps.
+#  - Elsewhere, or with --poll, by comparing the mtime and size of every
+#    source each --interval seconds.
+#
+# Usage (from the top of the ompi tree, after README.sh)
+#  watch_man.py [--rst <rst_dir>] [--tmpdir <dir>] [--allrefs <allrefs_file>]
+#               [--cache <manifest>] [--no-native] [--poll]
+#               [--interval <s>] [<man_dir> ...]
+
+import argparse
+import ctypes
+import os
+import re
+import select
+import struct
+import sys
+import time
+
+import convcache
+import fix_md_rst
+import fixcommon
+import fixup_rst
+import get_updated_man
+import man2rst
+import pandoc_stage
+import pipeline
+import tokenindex
+import xref
+
+APPNAME=os.path.basename(__file__)
+
+MANDIRS=["ompi/mpi/man", "ompi/mpiext", "ompi/tools", "oshmem/shmem/man",
+         "opal/tools/wrappers", "oshmem/tools/oshmem_info"]
+
+# Seconds to wait for more changes after one arrives
+DEBOUNCE=0.05
+
+# inotify(7)
+IN_CLOSE_WRITE=0x00000008
+IN_MOVED_FROM=0x00000040
+IN_MOVED_TO=0x00000080
+IN_CREATE=0x00000100
+IN_DELETE=0x00000200
+IN_Q_OVERFLOW=0x00004000
+IN_IGNORED=0x00008000
+IN_ISDIR=0x40000000
+IN_CLOEXEC=0o2000000
+EVENT_HEADER=struct.Struct("iIII")
+
+# PATTERNS
+source_pat = re.compile(r"\.[0-9]+in$|\.[0-9]+\.md$")
+md_pat = re.compile(r"\.[0-9]+\.md$")
+
+# The other source of the same page: MPI_Foo.3.md <-> MPI_Foo.3in
+def sibling(source):
+    if md_pat.search(source):
+        return f"{source[:-len('.md')]}in"
+    return f"{source[:-len('in')]}.md"
+
+def find_all_sources(man_dirs):
+    return ([os.path.normpath(fname) for fname in man2rst.find_sources(man_dirs)
+             if source_pat.search(fname)] +
+            [os.path.normpath(fname) for fname in pipeline.find_md_sources(man_dirs)
+             if source_pat.search(fname)])
+
+# Checks every source each interval seconds.
+class PollWatcher:
+    name = "polling"
+
+    def __init__(self, man_dirs, interval):
+        self.man_dirs = man_dirs
+        self.interval = interval
+        self.state = self.scan()
+
+    def scan(self):
+        state = dict()
+        for fname in find_all_sources(self.man_dirs):
+            try:
+                stat = os.stat(fname)
+            except OSError:
+                continue
+            state[fname] = (stat.st_mtime_ns, stat.st_size)
+        return state
+
+    # The sources that changed, appeared or went away, once there are some
+    def changes(self):
+        while True:
+            time.sleep(self.interval)
+            state = self.scan()
+            changed = {fname for fname in state.keys() | self.state.keys()
+                       if state.get(fname) != self.state.get(fname)}
+            self.state = state
+            if changed:
+                return changed
+
+# Watches every directory below the man dirs with inotify.
+class InotifyWatcher:
+    name = "inotify"
+    mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, man_dirs):
+        self.man_dirs = man_dirs
+        # AttributeError where libc has no inotify
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = dict()
+        for man_dir in man_dirs:
+            self.add_tree(man_dir)
+
+    def add_tree(self, top):
+        found = set()
+        for root, dirs, files in os.walk(top):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), self.mask)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"cannot watch {root}")
+            self.dirs[wd] = root
+            found.update(os.path.normpath(os.path.join(root, fname)) for fname in files)
+        return found
+
+    def _read(self):
+        data = os.read(self.fd, 1 << 16)
+        changed = set()
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+            pos += length
+            if mask & IN_Q_OVERFLOW:
+                # events were lost: take every source as changed
+                changed.update(find_all_sources(self.man_dirs))
+            elif mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+            elif wd in self.dirs:
+                path = os.path.normpath(os.path.join(self.dirs[wd], name))
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        changed |= self.add_tree(path)
+                else:
+                    changed.add(path)
+        return changed
+
+    def changes(self):
+        while True:
+            select.select([self.fd], [], [])
+            changed = self._read()
+            while select.select([self.fd], [], [], DEBOUNCE)[0]:
+                changed |= self._read()
+            changed = {fname for fname in changed if source_pat.search(fname)}
+            if changed:
+                return changed
+
+class Watch:
+    def __init__(self, args):
+        self.args = args
+        self.tmprst = os.path.join(args.tmpdir, "tmprst")
+        self.mdtmprst = os.path.join(args.tmpdir, "tmpmdrst")
+        self.cache = convcache.ConversionCache(args.cache)
+        self.allrefs = fixcommon.load_allrefs(args.allrefs)
+        self.pandoc_tool = convcache.hash_text(pandoc_stage.pandoc_version())
+        # stage -> (fixer, directory of its input pages); stage names as
+        # README.sh's runs of the fixers give them
+        self.fixers = {"fixup_rst": (fixup_rst.fixup_lines, self.tmprst),
+                       "fix_md_rst": (fix_md_rst.fixup_lines, self.mdtmprst)}
+        self.tools = {stage: fixcommon.fixer_version(fixfunc)
+                      for stage, (fixfunc, _) in self.fixers.items()}
+        self.indexes = {stage: tokenindex.TokenIndex(
+                            tokenindex.index_file(args.cache, stage), self.allrefs.labels)
+                        for stage in self.fixers}
+        # .so page -> the sources it may include
+        self.includes = dict()
+        for fname in find_all_sources(args.man_dirs):
+            if not md_pat.search(fname):
+                self.includes[fname] = get_updated_man.included_sources(fname)
+
+    def rst_page(self, stage, tmp):
+        return os.path.join(self.args.rst, os.path.relpath(tmp, self.fixers[stage][1]))
+
+    # Fix one page into the rst tree.  Returns the rst page, or None.
+    def fix(self, stage, tmp):
+        fixfunc, _ = self.fixers[stage]
+        rst = self.rst_page(stage, tmp)
+        messages, error, changed, names, stats = fixcommon.fix_page_captured(
+            fixfunc, tmp, rst, self.allrefs)
+        sys.stderr.write(messages)
+        if error:
+            print(f"ERROR: could not fix {tmp}", file=sys.stderr)
+            sys.stderr.write(error)
+            self.cache.forget(rst)
+            self.indexes[stage].forget(rst)
+            return None
+        self.cache.record(stage, tmp, rst, tool=self.tools[stage])
+        self.indexes[stage].record(rst, names)
+        return rst
+
+    def pandoc(self, source, out, reader, stage):
+        entry = pandoc_stage.convert(source, out, reader, self.args.timeout,
+                                     self.args.retries)
+        if entry["status"] != "ok":
+            self.cache.forget(out)
+            print(f"ERROR: could not convert {source}: {entry['status']}: "
+                  f"{entry['stderr'].strip()}", file=sys.stderr)
+            return False
+        self.cache.record(stage, source, out, tool=self.pandoc_tool)
+        return True
+
+    # Convert one source into the rst tree.  Returns the rst page, or None.
+    def convert(self, source):
+        if md_pat.search(source):
+            tmp = os.path.join(self.mdtmprst, pipeline.md_rst_name(source))
+            if not self.pandoc(source, tmp, "gfm", "md2rst"):
+                return None
+            return self.fix("fix_md_rst", tmp)
+        if os.path.exists(sibling(source)):
+            print(f"{source}: left alone, its md page replaces it")
+            return None
+        kind, out, reason, changed = man2rst.convert_source(
+            source, self.args.rst, self.tmprst, not self.args.no_native)
+        if kind != "pandoc":
+            # see man2rst.py's --cache
+            self.cache.forget(out)
+        if kind == "stub":
+            return out
+        if kind == "pandoc" and not self.pandoc(source, out, "man", "man2rst"):
+            return None
+        return self.fix("fixup_rst", out)
+
+    # Take away the rst page of a source that went away.  Returns the rst
+    # page, or None if the md page of a nroff page still writes it.
+    def remove(self, source):
+        if md_pat.search(source):
+            stage, tmp = "fix_md_rst", os.path.join(self.mdtmprst,
+                                                    pipeline.md_rst_name(source))
+        else:
+            stage, tmp = "fixup_rst", os.path.join(self.tmprst, man2rst.rst_name(source))
+        rst = self.rst_page(stage, tmp)
+        keep = not md_pat.search(source) and os.path.exists(sibling(source))
+        for fname in (tmp,) if keep else (tmp, rst):
+            if os.path.exists(fname):
+                os.remove(fname)
+        self.cache.forget(tmp)
+        self.indexes[stage].forget(rst)
+        if not keep:
+            self.cache.forget(rst)
+        return None if keep else rst
+
+    # The sources and every .so page that includes one of them
+    def with_includers(self, sources):
+        todo = list(sources)
+        found = set(sources)
+        while todo:
+            target = todo.pop()
+            for stub, included in self.includes.items():
+                if target in included and stub not in found:
+                    found.add(stub)
+                    todo.append(stub)
+        return found
+
+    # Add and remove labels, write allrefs.txt and fix the pages that looked
+    # up any of them.  Returns the pages fixed.
+    def relabel(self, added, removed):
+        labels = (self.allrefs.labels | added) - removed
+        self.allrefs = xref.LabelIndex(labels, self.allrefs.entries)
+        # a getcrossrefs.py index is only changed in memory
+        if not self.args.allrefs.endswith('.json'):
+            fixcommon.write_lines(self.args.allrefs, sorted(labels))
+        fixed = list()
+        for stage, index in self.indexes.items():
+            index.labels = self.allrefs.labels
+            pages = set()
+            for label in added | removed:
+                pages |= index.tokens.get(label, set())
+            for rst in sorted(pages):
+                tmp = os.path.join(self.fixers[stage][1], os.path.relpath(rst, self.args.rst))
+                if os.path.exists(tmp) and self.fix(stage, tmp):
+                    fixed.append(rst)
+        return fixed
+
+    def save(self):
+        self.cache.save()
+        for index in self.indexes.values():
+            index.save()
+
+    # Pages whose labels changed since they were last fixed
+    def refix_affected(self):
+        fixed = 0
+        for stage, index in self.indexes.items():
+            for rst in sorted(index.affected):
+                tmp = os.path.join(self.fixers[stage][1], os.path.relpath(rst, self.args.rst))
+                if os.path.exists(tmp):
+                    fixed += self.fix(stage, tmp) is not None
+        self.save()
+        return fixed
+
+    def handle(self, changed):
+        start = time.monotonic()
+        present = {fname for fname in changed if os.path.isfile(fname)}
+        gone = set(changed) - present
+        for fname in present:
+            if not md_pat.search(fname):
+                self.includes[fname] = get_updated_man.included_sources(fname)
+        for fname in gone:
+            self.includes.pop(fname, None)
+
+        written = [rst for rst in map(self.remove, sorted(gone)) if rst]
+        # a nroff page whose md page went away is converted again
+        present |= {sibling(fname) for fname in gone
+                    if md_pat.search(fname) and os.path.isfile(sibling(fname))}
+
+        # a page's label is its name; a name stays while any source has it.
+        # Labels change first, so the new pages find their own.
+        names = lambda fnames: {fixcommon.get_cmdname(fname).lower() for fname in fnames}
+        remaining = names(find_all_sources(self.args.man_dirs)) if gone else set()
+        added = names(present) - self.allrefs.labels
+        removed = names(gone) - remaining
+        fixed = self.relabel(added, removed) if added or removed else []
+
+        for source in sorted(self.with_includers(present) - gone):
+            rst = self.convert(source)
+            if rst:
+                written.append(rst)
+        self.save()
+        for rst in written:
+            print(f"{APPNAME}: {rst}")
+        if added or removed:
+            print(f"{APPNAME}: labels +{len(added)} -{len(removed)}, "
+                  f"{len(fixed)} pages fixed again")
+        print(f"{APPNAME}: {len(changed)} changed, {len(written)} pages written "
+              f"in {time.monotonic() - start:.2f}s")
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=APPNAME)
+    parser.add_argument('man_dirs', nargs='*', default=MANDIRS)
+    parser.add_argument('--rst', default="./rst/")
+    parser.add_argument('--tmpdir', default="/tmp/ompiman")
+    parser.add_argument('--allrefs', default=fixcommon.ALLREFSFILE)
+    parser.add_argument('--cache', default=None,
+                        help="conversion cache (default: convcache.json in --tmpdir)")
+    parser.add_argument('--no-native', action='store_true')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--retries', type=int, default=1)
+    parser.add_argument('--poll', action='store_true')
+    parser.add_argument('--interval', type=float, default=0.25)
+    args = parser.parse_args(argv[1:])
+    args.cache = args.cache or os.path.join(args.tmpdir, "convcache.json")
+    args.man_dirs = [d for d in args.man_dirs if os.path.isdir(d)]
+    if not args.man_dirs:
+        parser.error("none of the man dirs found here")
+
+    watch = Watch(args)
+    fixed = watch.refix_affected()
+    if fixed:
+        print(f"{APPNAME}: {fixed} pages fixed for the labels changed since the last run")
+    watcher = None
+    if not args.poll:
+        try:
+            watcher = InotifyWatcher(args.man_dirs)
+        except (OSError, AttributeError) as err:
+            print(f"{APPNAME}: no inotify ({err}), polling instead")
+    if watcher is None:
+        watcher = PollWatcher(args.man_dirs, args.interval)
+    print(f"{APPNAME}: watching {', '.join(args.man_dirs)} ({watcher.name}, "
+          f"{len(watch.allrefs)} labels)", flush=True)
+    try:
+        while True:
+            watch.handle(watcher.changes())
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        watch.save()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
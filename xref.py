@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+# Cross-reference resolver shared by fixup_rst.py and fix_md_rst.py.
+#
+# Label index
+#  - The labels from allrefs.txt are kept in a case-folded set, so checking
+#    whether MPI_Send has a label is a hash lookup instead of a scan of the
+#    whole list.
+#  - It is loaded from allrefs.txt or from the allrefs.json label index
+#    written by getcrossrefs.py, which also says which page defines each
+#    label.
+#
+# Scanner
+#  - The fixers look for two families of tokens, MPI_* and shmem_*.  A
+#    scanner joins both patterns into one regular expression and finds
+#    both families in a single pass over each line.
+#  - The replacement for each token is remembered, so a token that shows
+#    up on many lines or pages is resolved once per process.
+#
+# Names looked up
+#  - Every name checked against the index, through a scanner or not, is
+#    collected until take_seen() is called; it is all a page's output
+#    depends on in the label list (see tokenindex.py).
+#  - Tokens linked and left alone, and lines a scanner ran its pattern
+#    over, are counted until take_counts() is called (see buildtrace.py).
+#  - The result is the same as running the MPI_ pattern over the line and
+#    then the shmem_ pattern over the result.  The two can only differ on a
+#    line that holds both families, because stripping markup from an MPI_
+#    token can merge it with a neighbouring shmem_ token.  Those rare lines
+#    are run through the two patterns one after the other, as before.
+
+import json
+import re
+
+# xref_lines: lines scanned for tokens; resolved, unresolved: tokens found
+COUNTS = ("xref_lines", "resolved", "unresolved")
+
+# Strip man section numbers and inline markup
+def strip_markup(text):
+    text = text.replace('(3)','')
+    text = text.replace('(2)','')
+    text = text.replace('(1)','')
+    text = text.replace('`','')
+    return text.replace('*','')
+
+# :ref:`my-reference-label`:
+# Link a candidate token if it names a known label.
+def ref_text(token, index):
+    token = strip_markup(token)
+    if token in index:
+        return (':ref:`' + token + '`')
+    else:
+        return (token)
+
+class LabelIndex:
+    def __init__(self, labels, entries=None):
+        self.labels = frozenset(label.lower() for label in labels if label)
+        # label -> {"path", "section", "alias", "alias_of"}, if known
+        self.entries = entries or dict()
+        self.scanners = dict()
+        # case-folded names looked up since the last take_seen()
+        self.seen = set()
+        # cross-reference counts since the last take_counts()
+        self.counts = dict.fromkeys(COUNTS, 0)
+
+    @classmethod
+    def from_file(cls, fname):
+        if fname.endswith('.json'):
+            with open(fname) as fp:
+                entries = json.load(fp)["labels"]
+            return cls(entries, entries)
+        with open(fname) as fp:
+            return cls(line.rstrip('\n') for line in fp)
+
+    def __contains__(self, name):
+        key = name.lower()
+        self.seen.add(key)
+        return key in self.labels
+
+    # The names looked up since the last call, e.g. while fixing one page.
+    def take_seen(self):
+        seen, self.seen = self.seen, set()
+        return seen
+
+    # A cross-reference candidate was linked, or left as text.
+    def note_ref(self, linked):
+        self.counts["resolved" if linked else "unresolved"] += 1
+
+    # The counts since the last call, e.g. while fixing one page.
+    def take_counts(self):
+        counts, self.counts = self.counts, dict.fromkeys(COUNTS, 0)
+        return counts
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __iter__(self):
+        return iter(sorted(self.labels))
+
+    # Scanners are rebuilt, not pickled, when the index is sent to a worker.
+    def __reduce__(self):
+        return (LabelIndex, (sorted(self.labels), self.entries))
+
+    # One scanner per (MPI_ pattern, shmem_ pattern) pair, built on first use.
+    def scanner(self, mpi_pat, shmem_pat):
+        key = (mpi_pat.pattern, shmem_pat.pattern)
+        if key not in self.scanners:
+            self.scanners[key] = Scanner(self, mpi_pat, shmem_pat)
+        return self.scanners[key]
+
+class Scanner:
+    def __init__(self, index, mpi_pat, shmem_pat):
+        self.index = index
+        self.mpi_pat = mpi_pat
+        self.shmem_pat = shmem_pat
+        self.pattern = re.compile(f"(?:{mpi_pat.pattern})|(?:{shmem_pat.pattern})")
+        self.memo = dict()
+
+    def resolve(self, token):
+        try:
+            text, key, linked = self.memo[token]
+        except KeyError:
+            text = ref_text(token, self.index)
+            key = strip_markup(token).lower()
+            linked = key in self.index.labels
+            self.memo[token] = (text, key, linked)
+        # looked up once, but seen and counted on every page it is on
+        self.index.seen.add(key)
+        self.index.note_ref(linked)
+        return text
+
+    def _repl(self, match):
+        return self.resolve(match.group())
+
+    # Replace every MPI_* and shmem_* token on the line.
+    def sub(self, line):
+        if 'MPI_' in line:
+            if 'shmem_' in strip_markup(line).lower():
+                return self.sub_twopass(line)
+        elif 'shmem_' not in line.lower():
+            return line
+        self.index.counts["xref_lines"] += 1
+        pieces = list()
+        pos = 0
+        for match in self.pattern.finditer(line):
+            pieces.append(line[pos:match.start()])
+            pieces.append(self.resolve(match.group()))
+            pos = match.end()
+        if not pieces:
+            return line
+        pieces.append(line[pos:])
+        return "".join(pieces)
+
+    # The original two substitutions, for lines the single pass can't handle.
+    def sub_twopass(self, line):
+        self.index.counts["xref_lines"] += 1
+        line = self.mpi_pat.sub(self._repl, line)
+        return self.shmem_pat.sub(self._repl, line)